@@ -0,0 +1,53 @@
+"""
+How long it takes to import swiftcontents
+
+Every spawned single-user server (and every command line tool) pays this, so
+keep an eye on it:
+
+    python benchmarks/import_time.py [-n 10] [module ...]
+
+Each import is timed in a fresh interpreter with python -X importtime; the
+median total is reported, with the slowest imports it pulled in.
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+DEFAULT_MODULES = ['swiftcontents', 'swiftcontents.swiftfs', 'swiftcontents.swiftmanager']
+
+
+def import_times(module):
+    """{module: cumulative microseconds} for one import of module"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         env=env, stderr=subprocess.PIPE, universal_newlines=True,
+                         check=True).stderr
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=10, help="runs per module")
+    parser.add_argument('--top', type=int, default=10, help="slowest imports to list")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.n)]
+        total = statistics.median(r[module] for r in runs) / 1000.0
+        print("%-30s %8.1f ms (median of %d)" % (module, total, args.n))
+        slowest = sorted(runs[-1].items(), key=lambda kv: -kv[1])
+        for name, us in slowest[1:args.top + 1]:
+            print("    %-40s %8.1f ms" % (name, us / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Memory and time to hold, and build models for, a large directory listing
+
+    python benchmarks/listing.py [-n 100000]
+
+Compares the dicts SwiftService lists with ListingRecords, and
+dateutil's parser with parse_timestamp.
+"""
+import time
+import argparse
+import tracemalloc
+from dateutil.parser import parse
+from swiftcontents.listing import ListingRecord, parse_timestamp
+
+
+def fake_listing(n):
+    return [{'hash': '%032x' % i, 'bytes': i,
+             'last_modified': '2017-05-31T09:%02d:%02d.%06d' % (i // 60 % 60, i % 60, i),
+             'name': 'folder/file%d.txt' % i, 'content_type': 'text/plain'}
+            for i in range(n)]
+
+
+# timed without tracemalloc, which slows everything down
+def measure(label, build):
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-32s %8.1f MB %8.3f s" % (label, size / 1e6, elapsed))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=100000, help="entries in the listing")
+    args = parser.parse_args()
+
+    measure('dict records', lambda: fake_listing(args.n))
+    records = measure('ListingRecords',
+                      lambda: [ListingRecord.from_dict(r) for r in fake_listing(args.n)])
+    measure('dateutil.parser.parse', lambda: [parse(r.last_modified) for r in records])
+    measure('parse_timestamp', lambda: [parse_timestamp(r.last_modified) for r in records])
+
+
+if __name__ == '__main__':
+    main()
@@ -14,8 +14,8 @@ from os import path
 import sys
 
 v = sys.version_info
-if v[:2] < (3,3):
-    error = "SwiftContentsManager requires Python version 3.3 or above."
+if v[:2] < (3,7):
+    error = "SwiftContentsManager requires Python version 3.7 or above."
     print(error, file=sys.stderr)
     sys.exit(1)
 
@@ -59,10 +59,8 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
 
     # What does your project relate to?
@@ -72,6 +70,10 @@ setup(
     # simple. Or you can use find_packages().
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
 
+    # the lazy imports in swiftcontents/__init__.py and ipycompat.py need
+    # module __getattr__ (PEP 562)
+    python_requires='>=3.7',
+
     # Alternatively, if you want to distribute just a my_module.py, uncomment
     # this:
     #   py_modules=["my_module"],
@@ -86,5 +88,6 @@ setup(
     # dependencies). You can install these using the following syntax,
     # for example:
     # $ pip install -e .[dev,test]
-    extras_require={},
+    # AsyncSwiftContentsManager is built on jupyter_server
+    extras_require={'jupyter_server': ['jupyter_server>=1.0']},
 )
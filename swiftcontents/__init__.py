@@ -1 +1,14 @@
-from .swiftmanager import SwiftContentsManager
+# SwiftContentsManager pulls in the notebook server, so it is only imported
+# when asked for: swiftcontents.swiftfs (say) can be used without it
+__all__ = ['SwiftContentsManager', 'AsyncSwiftContentsManager']
+
+
+def __getattr__(name):
+    if name == 'AsyncSwiftContentsManager':
+        # built on jupyter_server, so only there when it's installed
+        from . import asyncmanager
+        return asyncmanager.AsyncSwiftContentsManager
+    if name in __all__:
+        from . import swiftmanager
+        return getattr(swiftmanager, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
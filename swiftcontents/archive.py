@@ -0,0 +1,197 @@
+"""
+Reading tar and zip archives for SwiftFS.upload_archive, and writing them
+for SwiftFS.iter_archive
+
+Only regular files and directories are taken from an archive; links, devices
+and anything named outside the archive (an absolute path, or with a '..'
+component) are skipped.
+
+Archives are written as a stream: each file's data is passed through as it
+arrives, and nothing is seeked back to, so an archive of any size can be
+sent as it is made.
+"""
+import time
+import tarfile
+import zipfile
+import posixpath
+
+__all__ = ['archive_format', 'safe_name', 'archive_entries', 'bulk_extractable',
+           'archive_stream', 'BULK_FORMATS', 'STREAM_FORMATS']
+
+# the formats Swift's bulk middleware can extract-archive
+BULK_FORMATS = ('tar', 'tar.gz', 'tar.bz2')
+
+# the formats archive_stream writes
+STREAM_FORMATS = ('zip', 'tar')
+
+_MAGIC = ((b'\x1f\x8b', 'tar.gz'), (b'BZh', 'tar.bz2'), (b'\xfd7zXZ\x00', 'tar.xz'))
+
+
+def archive_format(fileobj):
+    """'zip', 'tar', 'tar.gz', 'tar.bz2', 'tar.xz', or None for anything else"""
+    start = fileobj.tell()
+    try:
+        if zipfile.is_zipfile(fileobj):
+            return 'zip'
+        fileobj.seek(start)
+        head = fileobj.read(6)
+        for magic, fmt in _MAGIC:
+            if head.startswith(magic):
+                return fmt
+        fileobj.seek(start)
+        try:
+            with tarfile.open(fileobj=fileobj, mode='r:'):
+                return 'tar'
+        except tarfile.TarError:
+            return None
+    finally:
+        fileobj.seek(start)
+
+
+def safe_name(name):
+    """the normalised name of an archive member, or None if it isn't safe"""
+    name = name.replace('\\', '/')
+    if name.startswith('/') or '..' in name.split('/'):
+        return None
+    name = posixpath.normpath(name)
+    return None if name in ('.', '') else name
+
+
+def archive_entries(fileobj, fmt):
+    """
+    generate (name, data) for each file in the archive, in archive order, and
+    (name + '/', None) for each directory it names
+    """
+    if fmt == 'zip':
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                name = safe_name(info.filename)
+                if name is None:
+                    continue
+                if info.is_dir():
+                    yield name + '/', None
+                else:
+                    yield name, zf.read(info)
+    else:
+        # streaming mode: each member is read once, in order
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+            for info in tf:
+                name = safe_name(info.name)
+                if name is None:
+                    continue
+                if info.isdir():
+                    yield name + '/', None
+                elif info.isfile():
+                    yield name, tf.extractfile(info).read()
+
+
+def bulk_extractable(fileobj, fmt):
+    """
+    whether extracting the tar archive as it is (as Swift's bulk middleware
+    does) gives what archive_entries reads from it: every member a file or
+    directory, named safely and already normalised
+    """
+    start = fileobj.tell()
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+            for info in tf:
+                if not (info.isfile() or info.isdir()):
+                    return False
+                if safe_name(info.name) != info.name.rstrip('/'):
+                    return False
+        return True
+    except tarfile.TarError:
+        return False
+    finally:
+        fileobj.seek(start)
+
+
+class _Sink(object):
+    """a write-only file that hands on whatever has been written to it"""
+
+    def __init__(self):
+        self.parts = []
+        self.offset = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def archive_stream(entries, fmt='zip'):
+    """
+    generate a zip or tar archive a chunk at a time.
+
+    entries gives (name, size, mtime, chunks) for each member: a name ending
+    in '/' is a directory (size and chunks are ignored), mtime is seconds
+    since the epoch, and chunks is an iterable of bytes.  A tar needs each
+    file's size before its data; a zip doesn't, and size may be None.
+    """
+    if fmt not in STREAM_FORMATS:
+        raise ValueError("can't write a %r archive" % fmt)
+    sink = _Sink()
+    if fmt == 'zip':
+        # an unseekable file: zipfile writes sizes after the data instead
+        archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    else:
+        # file data is written to the sink directly, past tarfile
+        archive = tarfile.open(fileobj=sink, mode='w', format=tarfile.PAX_FORMAT)
+    with archive:
+        for name, size, mtime, chunks in entries:
+            if fmt == 'zip':
+                info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315532800))[:6])
+                if name.endswith('/'):
+                    archive.writestr(info, b'')
+                else:
+                    info.external_attr = 0o644 << 16
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with archive.open(info, 'w', force_zip64=True) as member:
+                        for chunk in chunks:
+                            member.write(chunk)
+                            data = sink.drain()
+                            if data:
+                                yield data
+            else:
+                info = tarfile.TarInfo(name.rstrip('/'))
+                info.mtime = int(mtime)
+                if name.endswith('/'):
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    archive.addfile(info)
+                else:
+                    info.size = size
+                    info.mode = 0o644
+                    archive.addfile(info)
+                    written = 0
+                    for chunk in chunks:
+                        written += len(chunk)
+                        sink.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                    if written != size:
+                        raise IOError("%s: expected %d bytes, got %d" % (name, size, written))
+                    # pad the member to a whole block
+                    blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+                    if remainder:
+                        sink.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                        blocks += 1
+                    archive.offset += blocks * tarfile.BLOCKSIZE
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
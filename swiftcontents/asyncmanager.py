@@ -0,0 +1,101 @@
+"""
+SwiftContentsManager for jupyter_server, which awaits every contents call
+
+    c.ServerApp.contents_manager_class = 'swiftcontents.AsyncSwiftContentsManager'
+
+Every contents method is a coroutine: the Swift I/O of each runs on the
+SwiftContentsManager's thread pool (executor_threads), so none of it blocks
+the event loop.  The work itself is done by a SwiftContentsManager, which
+(with SwiftFS) is configured as usual.  The notebook server calls some
+contents methods synchronously: use SwiftContentsManager itself there.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from jupyter_server.services.contents.manager import AsyncContentsManager
+from tornado.web import HTTPError
+
+from swiftcontents.swiftmanager import SwiftContentsManager
+
+__all__ = ['AsyncSwiftContentsManager']
+
+
+class AsyncSwiftContentsManager(AsyncContentsManager):
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncSwiftContentsManager, self).__init__(*args, **kwargs)
+        self.manager = SwiftContentsManager(parent=self, log=self.log)
+        self.executor = self.manager.executor
+        # the notary's SQLite can only be used from one thread
+        self.manager._notary_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='swiftcontents-notary')
+
+    @property
+    def swiftfs(self):
+        return self.manager.swiftfs
+
+    def _run(self, fn, *args, **kwargs):
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def get(self, path, content=True, type=None, format=None):
+        return await self._run(self.manager._get_model, path, content=content,
+                               type=type, format=format)
+
+    async def save(self, model, path):
+        return await self._run(self.manager._save_model, model, path)
+
+    async def delete_file(self, path):
+        await self._run(self.manager.delete_file, path)
+
+    async def rename_file(self, old_path, new_path):
+        await self._run(self.manager.rename_file, old_path, new_path)
+
+    async def file_exists(self, path=''):
+        return await self._run(self.manager.file_exists, path)
+
+    async def dir_exists(self, path):
+        return await self._run(self.manager.dir_exists, path)
+
+    async def is_hidden(self, path):
+        return False
+
+    # Swift keeps no checkpoints, so deletes and renames have none to move
+    async def delete(self, path):
+        path = path.strip('/')
+        if not path:
+            raise HTTPError(400, "Can't delete root")
+        await self.delete_file(path)
+        self._emit(action='delete', path=path)
+
+    async def rename(self, old_path, new_path):
+        await self.rename_file(old_path, new_path)
+        self._emit(action='rename', path=new_path, source_path=old_path)
+
+    async def list_checkpoints(self, path):
+        return []
+
+    async def trust_notebook(self, path):
+        await self._run(self.manager._trust_notebook, path)
+
+    def _emit(self, **data):
+        # jupyter_server 2 publishes contents events
+        emit = getattr(self, 'emit', None)
+        if emit is not None:
+            emit(data=data)
+
+    # The extras the handlers (see handlers.py) use
+    async def upload_archive(self, path, archive):
+        return await self._run(self.manager.upload_archive, path, archive)
+
+    async def open_stream(self, path, start=None, end=None):
+        return await self._run(self.manager.open_stream, path, start, end)
+
+    async def iter_archive(self, path, fmt='zip'):
+        return await self._run(self.manager.iter_archive, path, fmt)
+
+    async def search(self, query, path='', limit=50):
+        return await self._run(self.manager.search, query, path, limit)
+
+    async def sweep_blobs(self):
+        return await self._run(self.manager.sweep_blobs)
@@ -0,0 +1,228 @@
+"""
+Content-addressed storage of large notebook outputs
+
+Large output payloads (typically base64 images) are lifted out of the notebook
+JSON and stored once, under the sha256 of their JSON encoding, in a separate
+container.  The notebook object keeps a small reference in their place:
+
+    {"swiftcontents_blob": "<sha256 hex digest>"}
+
+and the notebook metadata is flagged so readers know to reassemble it.
+
+A blob may be shared by any number of notebooks, so deleting or re-saving a
+notebook leaves its blobs where they are: they are only ever deleted by
+BlobStore.sweep(), which keeps every blob a live notebook refers to.
+"""
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+__all__ = ['BlobStore', 'externalize_outputs', 'internalize_outputs',
+           'has_blobs', 'blob_refs']
+
+BLOB_KEY = 'swiftcontents_blob'
+METADATA_KEY = 'swiftcontents'
+
+
+def _approx_size(value):
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return sum(len(v) for v in value if isinstance(v, str))
+    return 0
+
+
+def _blob_ref(value):
+    if isinstance(value, dict) and len(value) == 1 and BLOB_KEY in value:
+        return value[BLOB_KEY]
+    return None
+
+
+def has_blobs(nb):
+    """does the (dictionary) notebook refer to externally stored blobs?"""
+    metadata = nb.get('metadata', {}).get(METADATA_KEY, {})
+    return bool(metadata.get('blobs'))
+
+
+def _refs(nb):
+    for cell in nb.get('cells', []):
+        for output in cell.get('outputs', []):
+            data = output.get('data', {})
+            for mimetype, value in data.items():
+                key = _blob_ref(value)
+                if key is not None:
+                    yield data, mimetype, key
+
+
+def blob_refs(nb):
+    """the keys of the blobs a (dictionary) notebook refers to"""
+    return set(key for _, _, key in _refs(nb))
+
+
+def externalize_outputs(nb, threshold):
+    """
+    Split the large output payloads out of a notebook dictionary.
+
+    The notebook passed in is not modified.
+
+    returns a tuple (stub, blobs) where 'stub' is the notebook to store and
+    'blobs' is a dictionary of {key: bytes} for every blob it refers to
+    """
+    blobs = {}
+    cells = []
+    for cell in nb.get('cells', []):
+        outputs = cell.get('outputs')
+        if outputs:
+            new_outputs = []
+            for output in outputs:
+                data = output.get('data')
+                if data:
+                    new_data = {}
+                    for mimetype, value in data.items():
+                        if _approx_size(value) >= threshold:
+                            blob = json.dumps(value).encode('utf-8')
+                            key = hashlib.sha256(blob).hexdigest()
+                            blobs[key] = blob
+                            value = {BLOB_KEY: key}
+                        new_data[mimetype] = value
+                    output = dict(output, data=new_data)
+                new_outputs.append(output)
+            cell = dict(cell, outputs=new_outputs)
+        cells.append(cell)
+
+    if not blobs:
+        return nb, blobs
+
+    metadata = dict(nb.get('metadata', {}))
+    metadata[METADATA_KEY] = {'blobs': True}
+    stub = dict(nb, cells=cells, metadata=metadata)
+    return stub, blobs
+
+
+def internalize_outputs(nb, fetch):
+    """
+    Replace the blob references in a notebook dictionary with their content.
+
+    'fetch' is called once with the list of keys needed and must return a
+    dictionary of {key: bytes}.  The notebook is modified in place.
+    """
+    refs = list(_refs(nb))
+    blobs = fetch(sorted(set(key for _, _, key in refs))) if refs else {}
+    for data, mimetype, key in refs:
+        data[mimetype] = json.loads(blobs[key].decode('utf-8'))
+
+    metadata = nb.get('metadata', {})
+    metadata.pop(METADATA_KEY, None)
+    return nb
+
+
+class BlobStore(object):
+    """
+    Read and write blobs through a SwiftFS, remembering which blobs are known
+    to exist and keeping recently used ones in a size-bounded memory cache.
+    """
+
+    log = logging.getLogger('BlobStore')
+
+    # blobs deleted by a sweep per request
+    sweep_batch_size = 1000
+
+    def __init__(self, swiftfs, cache_size=64 * 1024 * 1024):
+        self.swiftfs = swiftfs
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._known = set()
+        # keys put while a sweep runs, which it mustn't delete
+        self._used = None
+
+    # called with the lock held
+    def _remember(self, key, blob):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return
+        if len(blob) > self.cache_size:
+            return
+        self._cache[key] = blob
+        self._cache_bytes += len(blob)
+        while self._cache_bytes > self.cache_size:
+            _, old = self._cache.popitem(last=False)
+            self._cache_bytes -= len(old)
+
+    def _forget(self, key):
+        self._known.discard(key)
+        blob = self._cache.pop(key, None)
+        if blob is not None:
+            self._cache_bytes -= len(blob)
+
+    def put(self, blobs):
+        """upload any of the {key: bytes} blobs that are not already stored"""
+        with self._lock:
+            if self._used is not None:
+                self._used.update(blobs)
+            unknown = [k for k in blobs if k not in self._known]
+        if unknown:
+            missing = self.swiftfs.missing_blobs(unknown)
+            self.log.debug("BlobStore.put uploading %d of %d blobs",
+                           len(missing), len(blobs))
+            self.swiftfs.write_blobs(dict((k, blobs[k]) for k in missing))
+        with self._lock:
+            self._known.update(unknown)
+            for key, blob in blobs.items():
+                self._remember(key, blob)
+
+    def get(self, keys):
+        """return a dictionary of {key: bytes}, fetching uncached blobs in parallel"""
+        found = {}
+        wanted = []
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+                else:
+                    wanted.append(key)
+        if wanted:
+            fetched = self.swiftfs.read_blobs(wanted)
+            with self._lock:
+                for key in wanted:
+                    if key not in fetched:
+                        raise KeyError("missing notebook output blob %s" % key)
+                    self._known.add(key)
+                    self._remember(key, fetched[key])
+                    found[key] = fetched[key]
+        return found
+
+    # A save puts its blobs before it writes the notebook that refers to
+    # them, so a sweep keeps the blobs put while it runs, and those written
+    # after 'before' (which ought to allow for saves by other servers).
+    # Each batch is deleted with the lock held, so a put either marks its
+    # blobs used first or finds them gone and uploads them again.
+    def sweep(self, referenced, before):
+        """
+        delete the stored blobs that aren't in referenced() and were written
+        before the unix time 'before'; referenced is called once the sweep
+        has started.  returns the keys deleted
+        """
+        with self._lock:
+            self._used = set()
+        deleted = []
+        try:
+            keep = referenced()
+            unused = sorted(key for key, (size, mtime) in self.swiftfs.list_blobs().items()
+                            if key not in keep and mtime < before)
+            for i in range(0, len(unused), self.sweep_batch_size):
+                with self._lock:
+                    batch = [k for k in unused[i:i + self.sweep_batch_size]
+                             if k not in self._used]
+                    for key in batch:
+                        self._forget(key)
+                    deleted.extend(self.swiftfs.delete_blobs(batch))
+        finally:
+            with self._lock:
+                self._used = None
+        self.log.info("BlobStore.sweep deleted %d unused blobs", len(deleted))
+        return deleted
@@ -20,7 +20,12 @@ class LogMethod(object):
                 log = args[0].log
             else:
                 log = self.log
-            
+
+            # building the message means repr'ing every argument (and result),
+            # which for a big listing or notebook costs far more than the call
+            if not log.isEnabledFor(logging.DEBUG):
+                return oFunc(*args,**kwargs)
+
             msg = 'calling %s('%fName
             for a in args[1:]:
                 msg+=repr(a)+','
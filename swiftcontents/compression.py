@@ -0,0 +1,106 @@
+"""
+Compression of stored objects
+
+Compressed objects are marked with the object metadata header
+X-Object-Meta-Swiftcontents-Encoding, so objects written without compression
+(or before it was turned on) are read back unchanged.
+
+zstd is only available when the 'zstandard' package is installed.
+"""
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ['ENCODING_META', 'ENCODING_HEADER', 'available_encodings',
+           'compress', 'compress_stream', 'decompress', 'decompress_stream']
+
+# as given to SwiftService in the 'meta' option, and as read back in the
+# (lower-cased) response headers
+ENCODING_META = 'Swiftcontents-Encoding'
+ENCODING_HEADER = 'x-object-meta-swiftcontents-encoding'
+
+
+def available_encodings():
+    encodings = ['gzip']
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def compress(data, encoding):
+    """compress bytes with the named encoding"""
+    if encoding == 'gzip':
+        # a fixed mtime keeps the output (and so the ETag) stable
+        return gzip.compress(data, mtime=0)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError("unknown compression '%s'" % encoding)
+
+
+def compress_stream(chunks, encoding):
+    """compress() an iterable of chunks, a chunk at a time"""
+    if encoding == 'gzip':
+        # the gzip header with mtime 0, as gzip.compress(mtime=0) writes it
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError("unknown compression '%s'" % encoding)
+    return _compressing(chunks, compressor)
+
+
+def _compressing(chunks, compressor):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+def decompress(data, encoding):
+    """undo compress(); an empty encoding returns the data unchanged"""
+    if not encoding:
+        return data
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compressed object, but no zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError("unknown compression '%s'" % encoding)
+
+
+def decompress_stream(chunks, encoding):
+    """undo compress() on an iterable of chunks, a chunk at a time"""
+    if not encoding:
+        return chunks
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compressed object, but no zstandard package")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise ValueError("unknown compression '%s'" % encoding)
+    return _decompressing(chunks, decompressor)
+
+
+def _decompressing(chunks, decompressor):
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if hasattr(decompressor, 'flush'):
+        data = decompressor.flush()
+        if data:
+            yield data
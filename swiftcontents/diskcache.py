@@ -0,0 +1,157 @@
+"""
+A persistent local disk cache for SwiftFS
+
+Object bodies are kept with the ETag and last-modified time they were
+downloaded with, so they can be validated against Swift (or against a fresh
+listing) instead of downloaded again.
+
+Every file is written to a temporary name and renamed into place, and an
+object's body is only used once its metadata record has been written, so a
+crash never leaves a half-written entry that looks valid.  Least recently
+used entries are evicted to keep the cache under its byte budget; recency is
+the metadata file's mtime, so it survives restarts.
+"""
+import os
+import json
+import mmap
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+__all__ = ['DiskCache']
+
+
+class DiskCache(object):
+
+    log = logging.getLogger('DiskCache')
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024, mmap_threshold=1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> size, in LRU order
+        self._bytes = 0
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._load()
+
+    def _key(self, container, name):
+        return hashlib.sha1(('%s/%s' % (container, name)).encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.root, 'objects', key[:2], key)
+        return base, base + '.json'
+
+    # rebuild the index from disk, dropping anything a crash left behind
+    def _load(self):
+        found = []
+        objects = os.path.join(self.root, 'objects')
+        for d in os.listdir(objects):
+            for f in os.listdir(os.path.join(objects, d)):
+                p = os.path.join(objects, d, f)
+                if f.startswith('tmp'):
+                    os.remove(p)
+                elif f.endswith('.json'):
+                    body = p[:-len('.json')]
+                    if os.path.exists(body):
+                        found.append((os.path.getmtime(p), f[:-len('.json')],
+                                      os.path.getsize(body)))
+                    else:
+                        os.remove(p)
+                elif not os.path.exists(p + '.json'):
+                    os.remove(p)
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+        self.log.debug("DiskCache loaded %d entries, %d bytes", len(found), self._bytes)
+
+    def _atomic_write(self, path, data):
+        d = os.path.dirname(path)
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='tmp', dir=d)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _drop(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+        for p in self._paths(key):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self.log.debug("DiskCache evicting %s", key)
+            self._drop(key)
+
+    def _meta(self, key):
+        try:
+            with open(self._paths(key)[1]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def etag(self, container, name):
+        """the ETag of the cached copy of an object, or None"""
+        key = self._key(container, name)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            meta = self._meta(key)
+        return meta['etag'] if meta else None
+
+    def get(self, container, name, etag):
+        """
+        returns the cached body of an object if it was cached with this etag,
+        otherwise None.  Large bodies are returned as a memory-mapped,
+        read-only buffer rather than read into memory.
+        """
+        key = self._key(container, name)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            meta = self._meta(key)
+            if meta is None or meta['etag'] != etag:
+                return None
+            self._entries.move_to_end(key)
+        body, meta_path = self._paths(key)
+        try:
+            os.utime(meta_path)
+            with open(body, 'rb') as f:
+                if meta['size'] >= self.mmap_threshold:
+                    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, container, name, etag, data, last_modified=None):
+        if not etag or len(data) > self.max_bytes:
+            return
+        key = self._key(container, name)
+        body, meta_path = self._paths(key)
+        with self._lock:
+            self._drop(key)
+            self._atomic_write(body, data)
+            meta = {'container': container, 'name': name, 'etag': etag,
+                    'last_modified': last_modified, 'size': len(data)}
+            self._atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+            self._entries[key] = len(data)
+            self._bytes += len(data)
+            self._evict()
+
+    def invalidate(self, container, name):
+        with self._lock:
+            self._drop(self._key(container, name))
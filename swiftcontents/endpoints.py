@@ -0,0 +1,97 @@
+"""
+Choosing between several Swift proxy endpoints
+
+Each endpoint's latency and error rate are tracked as exponentially weighted
+moving averages.  A request goes to the better of two endpoints picked at
+random ("power of two choices"), which spreads load across the healthy ones
+while steering it away from a slow or failing one; if that endpoint fails,
+the rest are tried, best first.  An endpoint that hasn't been used for a
+while is tried again, so one that has recovered gets its traffic back.
+"""
+import time
+import random
+import socket
+import threading
+from requests.exceptions import ConnectionError, Timeout
+from .requestpolicy import _http_status
+
+__all__ = ['EndpointSelector', 'is_endpoint_failure']
+
+# what swiftclient raises when it got no response, once its own retries are used up
+_NO_RESPONSE = (ConnectionError, Timeout, socket.error)
+
+
+def is_endpoint_failure(e):
+    """
+    is this an error another endpoint might not give: no response at all, a
+    server error or too many requests (rather than, say, a 404, or a bug)
+    """
+    # a SwiftError may wrap the exception that caused it
+    if isinstance(e, _NO_RESPONSE) or isinstance(getattr(e, 'exception', None), _NO_RESPONSE):
+        return True
+    status = _http_status(e)
+    return status is not None and (status >= 500 or status == 429)
+
+
+class _Stats(object):
+
+    __slots__ = ('latency', 'errors', 'requests', 'failures', 'last_used')
+
+    def __init__(self):
+        self.latency = None
+        self.errors = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_used = 0.0
+
+
+class EndpointSelector(object):
+
+    def __init__(self, urls, alpha=0.2, error_weight=10.0, probe_interval=30.0):
+        if not urls:
+            raise ValueError("EndpointSelector needs at least one endpoint")
+        self.urls = list(urls)
+        self.alpha = alpha
+        self.error_weight = error_weight
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stats = dict((url, _Stats()) for url in self.urls)
+
+    def _score(self, url, now):
+        s = self._stats[url]
+        # unmeasured, or not measured lately: worth (re)trying
+        if s.latency is None or now - s.last_used > self.probe_interval:
+            return 0.0
+        return s.latency * (1 + self.error_weight * s.errors)
+
+    def candidates(self):
+        """every endpoint, in the order a request should try them"""
+        now = time.monotonic()
+        with self._lock:
+            first = self.urls[0]
+            if len(self.urls) > 1:
+                a, b = random.sample(self.urls, 2)
+                first = min(a, b, key=lambda u: self._score(u, now))
+            rest = sorted((u for u in self.urls if u != first),
+                          key=lambda u: self._score(u, now))
+        return [first] + rest
+
+    def best(self):
+        return self.candidates()[0]
+
+    def record(self, url, elapsed, ok=True):
+        with self._lock:
+            s = self._stats[url]
+            s.latency = elapsed if s.latency is None else \
+                (1 - self.alpha) * s.latency + self.alpha * elapsed
+            s.errors = (1 - self.alpha) * s.errors + (0.0 if ok else self.alpha)
+            s.requests += 1
+            s.failures += 0 if ok else 1
+            s.last_used = time.monotonic()
+
+    def metrics(self):
+        """returns {url: {latency, error_rate, requests, failures}}"""
+        with self._lock:
+            return dict((url, {'latency': s.latency, 'error_rate': s.errors,
+                               'requests': s.requests, 'failures': s.failures})
+                        for url, s in self._stats.items())
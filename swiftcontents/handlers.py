@@ -0,0 +1,161 @@
+"""
+Handlers that move files between the client and Swift without going through
+a contents model
+
+The notebook's /files/ handler reads the whole file through
+ContentsManager.get(), so the server holds all of it in memory (twice, for
+base64).  /swiftfiles/<path> pipes the Swift response to the client a chunk at
+a time, and honours single-range Range requests.  Notebooks stored with
+their outputs as blobs are put back together first, here and in archives.
+
+GET /swiftarchive/<path>?format=zip (or tar) streams a directory as an
+archive, made as it is sent (see SwiftFS.iter_archive).  POST
+/swiftarchive/<path> with a tar or zip archive as the request body extracts
+it into that directory (see SwiftFS.upload_archive).
+
+GET /swiftusage/<path> gives the bytes and objects stored under a directory,
+and under each directory in it, from SwiftFS's running totals (with
+SwiftFS.usage_tracking on).  Enable these with
+
+    c.NotebookApp.nbserver_extensions = {'swiftcontents.handlers': True}
+"""
+import io
+import re
+import json
+import inspect
+from tornado import gen, web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from .ipycompat import IPythonHandler, url_path_join
+from .swiftfs import NoSuchFile
+
+__all__ = ['SwiftFileHandler', 'SwiftArchiveHandler', 'SwiftUsageHandler', 'load_jupyter_server_extension']
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header):
+    """
+    (start, end) from a Range header, or (None, None) for no header, or one
+    we don't handle (such as several ranges) - which means the whole file
+    """
+    m = RANGE_RE.match((header or '').strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None, None
+    start, end = m.groups()
+    return (int(start) if start else None), (int(end) if end else None)
+
+
+@gen.coroutine
+def manager_call(handler, name, *args):
+    """
+    the contents manager's method name, called with args off the IOLoop:
+    awaited if it's a coroutine (AsyncSwiftContentsManager runs its own
+    work on its pool), and otherwise run on the manager's pool
+    """
+    cm = handler.contents_manager
+    method = getattr(cm, name)
+    if inspect.iscoroutinefunction(method):
+        result = yield method(*args)
+    else:
+        result = yield IOLoop.current().run_in_executor(cm.executor, method, *args)
+    return result
+
+
+class SwiftFileHandler(IPythonHandler):
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path):
+        start, end = parse_range(self.request.headers.get('Range'))
+        try:
+            headers, chunks = yield manager_call(self, 'open_stream', path, start, end)
+        except NoSuchFile:
+            raise web.HTTPError(404, 'No such file: %s' % path)
+
+        if 'content-range' in headers:
+            self.set_status(206)
+            self.set_header('Content-Range', headers['content-range'])
+        if 'content-length' in headers:
+            self.set_header('Content-Length', headers['content-length'])
+        self.set_header('Content-Type', headers.get('content-type') or 'application/octet-stream')
+        self.set_header('Accept-Ranges', 'bytes')
+        self.set_header('Etag', '"%s"' % headers.get('etag', '').strip('"'))
+        if self.get_argument('download', False):
+            name = path.rsplit('/', 1)[-1]
+            self.set_header('Content-Disposition', 'attachment; filename="%s"' % name)
+        yield send_chunks(self, chunks, path)
+
+
+@gen.coroutine
+def send_chunks(handler, chunks, path):
+    """write chunks to the client, and finish"""
+    # reading from Swift blocks, so it's done on the manager's pool; waiting
+    # for each flush keeps only a chunk or so in memory
+    loop = IOLoop.current()
+    executor = handler.contents_manager.executor
+    chunks = iter(chunks)
+    try:
+        while True:
+            chunk = yield loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                break
+            handler.write(chunk)
+            yield handler.flush()
+    except StreamClosedError:
+        handler.log.debug("%s: client went away reading %s", type(handler).__name__, path)
+        return
+    finally:
+        # stops any fetching still going on for an archive
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+    handler.finish()
+
+
+class SwiftArchiveHandler(IPythonHandler):
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path):
+        fmt = self.get_argument('format', 'zip')
+        if fmt not in ('zip', 'tar'):
+            raise web.HTTPError(400, 'Unknown archive format: %s' % fmt)
+        try:
+            chunks = yield manager_call(self, 'iter_archive', path, fmt)
+        except NoSuchFile:
+            raise web.HTTPError(404, 'No such directory: %s' % path)
+        name = path.strip('/').rsplit('/', 1)[-1] or 'files'
+        self.set_header('Content-Type', 'application/zip' if fmt == 'zip' else 'application/x-tar')
+        self.set_header('Content-Disposition', 'attachment; filename="%s.%s"' % (name, fmt))
+        yield send_chunks(self, chunks, path)
+
+    @web.authenticated
+    @gen.coroutine
+    def post(self, path):
+        archive = io.BytesIO(self.request.body)
+        model = yield manager_call(self, 'upload_archive', path, archive)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(model, default=str))
+
+
+class SwiftUsageHandler(IPythonHandler):
+
+    @web.authenticated
+    def get(self, path):
+        swiftfs = self.contents_manager.swiftfs
+        if swiftfs.usage is None:
+            raise web.HTTPError(404, 'Usage tracking is not enabled')
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(swiftfs.usage_totals(path)))
+
+
+def load_jupyter_server_extension(nbapp):
+    web_app = nbapp.web_app
+    pattern = url_path_join(web_app.settings['base_url'], r'/swiftfiles/(.*)')
+    archives = url_path_join(web_app.settings['base_url'], r'/swiftarchive/(.*)')
+    usage = url_path_join(web_app.settings['base_url'], r'/swiftusage/(.*)')
+    web_app.add_handlers('.*$', [(pattern, SwiftFileHandler), (archives, SwiftArchiveHandler),
+                                 (usage, SwiftUsageHandler)])
+    nbapp.log.info("SwiftContents: streaming downloads at /swiftfiles/, archives at /swiftarchive/,"
+                   " usage at /swiftusage/")
@@ -2,15 +2,26 @@
 Utilities for managing IPython 3/4 compat.
 
 Taken from: https://github.com/quantopian/pgcontents/blob/master/pgcontents/utils/ipycompat.py
+
+Only what a running server needs is imported up front; the rest (the
+notebook's own file manager, its handlers and its test suites) is imported
+the first time it is asked for, so importing swiftcontents stays cheap.
 """
-import IPython
+import importlib
+from importlib.util import find_spec
 
-SUPPORTED_VERSIONS = {3, 4, 5, 6}
-IPY_MAJOR = IPython.version_info[0]
-if IPY_MAJOR not in SUPPORTED_VERSIONS:
-    raise ImportError("IPython version %d is not supported." % IPY_MAJOR)
+# IPython 4 split the notebook out into its own package; only IPython 3 (and
+# so only checking its version) needs IPython itself
+if find_spec('notebook') is None:
+    import IPython
 
-IPY3 = (IPY_MAJOR == 3)
+    SUPPORTED_VERSIONS = {3, 4, 5, 6}
+    IPY_MAJOR = IPython.version_info[0]
+    if IPY_MAJOR not in SUPPORTED_VERSIONS:
+        raise ImportError("IPython version %d is not supported." % IPY_MAJOR)
+    IPY3 = (IPY_MAJOR == 3)
+else:
+    IPY3 = False
 
 if IPY3:
     from IPython.config import Config
@@ -18,12 +29,8 @@ if IPY3:
     from IPython.html.services.contents.checkpoints import (
         Checkpoints,
         GenericCheckpointsMixin,)
-    from IPython.html.services.contents.filemanager import FileContentsManager
-    from IPython.html.services.contents.filecheckpoints import (GenericFileCheckpoints)
-    from IPython.html.services.contents.tests.test_manager import (TestContentsManager)
-    from IPython.html.services.contents.tests.test_contents_api import (APITest)
-    from IPython.html.utils import to_os_path
-    from IPython.nbformat import from_dict, reads, writes
+    from IPython.html.utils import url_path_join
+    from IPython.nbformat import convert, from_dict, reads, versions, writes
     from IPython.nbformat.v4.nbbase import (
         new_code_cell,
         new_markdown_cell,
@@ -43,13 +50,9 @@ else:
     from notebook.services.contents.checkpoints import (
         Checkpoints,
         GenericCheckpointsMixin,)
-    from notebook.services.contents.filemanager import FileContentsManager
-    from notebook.services.contents.filecheckpoints import (GenericFileCheckpoints)
     from notebook.services.contents.manager import ContentsManager
-    from notebook.services.contents.tests.test_manager import (TestContentsManager)
-    from notebook.services.contents.tests.test_contents_api import (APITest)
-    from notebook.utils import to_os_path
-    from nbformat import from_dict, reads, writes
+    from notebook.utils import url_path_join
+    from nbformat import convert, from_dict, reads, versions, writes
     from nbformat.v4.nbbase import (
         new_code_cell,
         new_markdown_cell,
@@ -65,6 +68,29 @@ else:
         HasTraits,
         Unicode,)
 
+# name: (module, IPython 3 module)
+_LAZY = {
+    'APITest': ('notebook.services.contents.tests.test_contents_api',
+                'IPython.html.services.contents.tests.test_contents_api'),
+    'FileContentsManager': ('notebook.services.contents.filemanager',
+                            'IPython.html.services.contents.filemanager'),
+    'GenericFileCheckpoints': ('notebook.services.contents.filecheckpoints',
+                               'IPython.html.services.contents.filecheckpoints'),
+    'IPythonHandler': ('notebook.base.handlers', 'IPython.html.base.handlers'),
+    'TestContentsManager': ('notebook.services.contents.tests.test_manager',
+                            'IPython.html.services.contents.tests.test_manager'),
+    'to_os_path': ('notebook.utils', 'IPython.html.utils'),
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(_LAZY[name][IPY3]), name)
+    globals()[name] = value
+    return value
+
+
 __all__ = [
     'APITest',
     'Any',
@@ -77,10 +103,12 @@ __all__ = [
     'GenericCheckpointsMixin',
     'GenericFileCheckpoints',
     'HasTraits',
+    'IPythonHandler',
     'Instance',
     'Integer',
     'TestContentsManager',
     'Unicode',
+    'convert',
     'from_dict',
     'new_code_cell',
     'new_markdown_cell',
@@ -89,5 +117,7 @@ __all__ = [
     'reads',
     'strip_transient',
     'to_os_path',
+    'url_path_join',
+    'versions',
     'writes',
 ]
@@ -0,0 +1,103 @@
+"""
+Compact records for Swift container listings
+
+A listing of a large directory can hold 100,000s of entries, and SwiftService
+gives each one as a dict.  ListingRecord keeps just the fields we use, in
+__slots__, without a dict's per-entry overhead; it still answers
+record['name'] and record.get('hash') like the dict it replaces.
+"""
+import sys
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from .objectmeta import object_meta
+
+__all__ = ['ListingRecord', 'parse_timestamp']
+
+
+def parse_timestamp(value):
+    """
+    parse a listing's last_modified time.  Swift always gives these as
+    '2017-05-31T09:20:22.224000' (sometimes with a trailing 'Z'), which
+    datetime.fromisoformat() handles far faster than a general parser; any
+    other format is left to dateutil.
+    """
+    utc = value.endswith('Z')
+    try:
+        parsed = datetime.fromisoformat(value[:-1] if utc else value)
+    except ValueError:
+        from dateutil.parser import parse
+        return parse(value)
+    return parsed.replace(tzinfo=timezone.utc) if utc else parsed
+
+
+class ListingRecord(object):
+
+    # meta is the object's swiftcontents metadata (see objectmeta), when it
+    # came from a stat rather than a listing
+    __slots__ = ('name', 'bytes', 'hash', 'last_modified', 'content_type', 'meta')
+
+    def __init__(self, name, bytes=0, hash=None, last_modified=None, content_type=None,
+                 meta=None):
+        self.name = name
+        self.bytes = bytes
+        self.hash = hash
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.meta = meta
+
+    @classmethod
+    def from_dict(cls, record):
+        get = record.get
+        content_type = get('content_type')
+        # a listing has only a handful of distinct content types
+        if content_type is not None:
+            content_type = sys.intern(content_type)
+        return cls(record['name'], get('bytes', 0), get('hash'),
+                   get('last_modified'), content_type, get('meta'))
+
+    @classmethod
+    def from_headers(cls, name, headers):
+        """the record a listing would have for an object, from its stat headers"""
+        if 'x-timestamp' in headers:
+            modified = datetime.fromtimestamp(float(headers['x-timestamp']), timezone.utc)
+            last_modified = modified.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        else:
+            try:
+                modified = parsedate_to_datetime(headers['last-modified'])
+                last_modified = modified.strftime('%Y-%m-%dT%H:%M:%S.%f')
+            except (KeyError, TypeError, ValueError):
+                last_modified = headers.get('last-modified')
+        return cls(name, int(headers.get('content-length', 0)), headers.get('etag'),
+                   last_modified, headers.get('content-type'), object_meta(headers))
+
+    def to_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__
+                    if getattr(self, k) is not None)
+
+    def modified(self):
+        """last_modified as a datetime, or None"""
+        if self.last_modified is None:
+            return None
+        return parse_timestamp(self.last_modified)
+
+    # the dict-style interface of the records this replaces
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, ListingRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return 'ListingRecord(%r)' % self.to_dict()
@@ -0,0 +1,111 @@
+"""
+Move a container's objects to a different shard layout
+
+    python -m swiftcontents.migrate --container jupyter-alice --shards 16 [--delete]
+
+moves everything in the container into 16 shard containers (see
+sharding.py); --from-shards moves between shard layouts, and --shards 0
+back into the one container.  Objects are copied server side, each one
+whose container changes; then the copies are checked against the
+originals' ETags, and only with --delete are the originals removed.  Run
+it with the notebook server stopped, and then set SwiftFS.shards to match.
+"""
+import sys
+import logging
+import argparse
+from swiftclient.service import SwiftError, SwiftCopyObject, SwiftUploadObject
+from .swiftfs import SwiftFS
+from .objectmeta import meta_options
+
+__all__ = ['migrate']
+
+log = logging.getLogger('swiftcontents.migrate')
+
+
+def migrate(container, shards, from_shards=0, delete=False, batch_size=1000):
+    """
+    move container's objects from the from_shards layout to the shards one.
+
+    returns (objects moved, objects that failed to copy or check)
+    """
+    source = SwiftFS(container=container, shards=from_shards, log=log)
+    target = SwiftFS(container=container, shards=shards, log=log)
+    target.swift    # creates the target containers
+
+    # source container -> [(name, etag)], for the objects that have to move
+    moves = {}
+    for record in source.iterlist(''):
+        name = record['name']
+        if source.container_for(name) != target.container_for(name):
+            moves.setdefault(source.container_for(name), []).append((name, record.get('hash')))
+
+    moved, failed = 0, []
+    for from_container, objects in sorted(moves.items()):
+        for i in range(0, len(objects), batch_size):
+            batch = objects[i:i + batch_size]
+            copies = [SwiftCopyObject(name, {'destination': '/%s/%s' % (
+                target.container_for(name), name)})
+                for name, _ in batch if not name.endswith(target.delimiter)]
+            markers = [SwiftUploadObject(None, object_name=name,
+                                         options={'meta': meta_options({'type': 'directory'})})
+                       for name, _ in batch if name.endswith(target.delimiter)]
+            copied = set()
+            try:
+                for r in source.swift.copy(from_container, copies):
+                    if r['action'] != 'copy_object':
+                        continue
+                    if r['success']:
+                        copied.add(r['object'])
+                    else:
+                        log.error("could not copy %s: %s", r['object'], r.get('error'))
+                for to_container, group in target._by_container(
+                        markers, lambda m: m.object_name).items():
+                    for r in target.swift.upload(to_container, group):
+                        if r['action'] != 'upload_object':
+                            continue
+                        if r['success']:
+                            copied.add(r['object'])
+                        else:
+                            log.error("could not make %s: %s", r['object'], r.get('error'))
+            except SwiftError as e:
+                log.error("copying from %s: %s", from_container, e.value)
+
+            # only the originals of copies that check out are deleted
+            names = [name for name, _ in batch if name in copied]
+            headers = target.stat_many(names)
+            checked = [name for (name, etag), h in
+                       zip([o for o in batch if o[0] in copied], headers)
+                       if h is not None and h.get('etag') == etag]
+            failed.extend(name for name, _ in batch if name not in checked)
+            moved += len(checked)
+            if delete and checked:
+                for r in source.swift.delete(container=from_container, objects=checked):
+                    if not r['success']:
+                        log.error("could not delete %s: %s", r.get('object'), r.get('error'))
+            log.info("%s: %d of %d objects moved", from_container, moved,
+                     sum(len(o) for o in moves.values()))
+    return moved, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--container', required=True, help="the (logical) container")
+    parser.add_argument('--shards', type=int, required=True,
+                        help="shards to move to (0 for the one container)")
+    parser.add_argument('--from-shards', type=int, default=0,
+                        help="shards the objects are in now (0 for the one container)")
+    parser.add_argument('--delete', action='store_true',
+                        help="delete the originals once their copies are checked")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    moved, failed = migrate(args.container, args.shards, args.from_shards,
+                            args.delete, args.batch_size)
+    print("%d objects moved, %d failed" % (moved, len(failed)))
+    for name in failed:
+        print("failed: %s" % name)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+A cache of parsed, validated and trust-marked notebooks, keyed by ETag
+
+An object's ETag changes whenever its content does, so a notebook whose ETag
+(from the directory listing) matches the cached one needs neither downloading,
+parsing nor validating.  Callers always get their own copy of the notebook.
+
+It also remembers, for many more paths, the ETags of notebooks this server
+saved having validated them, so reading one back needn't validate it again.
+"""
+import threading
+from copy import deepcopy
+from collections import OrderedDict
+
+__all__ = ['NotebookCache']
+
+
+class NotebookCache(object):
+
+    def __init__(self, size=32, valid_size=4096):
+        self.size = size
+        self.valid_size = valid_size
+        self._entries = OrderedDict()
+        self._valid = OrderedDict()   # path -> etag
+        self._lock = threading.Lock()
+
+    def get(self, path, etag):
+        """
+        returns a tuple (notebook, validation message) if the cached notebook
+        for path has this etag, otherwise None
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(path)
+        return deepcopy(entry[1]), entry[2]
+
+    def put(self, path, etag, nb, message=None):
+        if self.size <= 0 or not etag:
+            return
+        entry = (etag, deepcopy(nb), message)
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def mark_valid(self, path, etag):
+        """the notebook at path, with etag, was valid when it was saved"""
+        if self.valid_size <= 0 or not etag:
+            return
+        with self._lock:
+            self._valid[path] = etag
+            self._valid.move_to_end(path)
+            while len(self._valid) > self.valid_size:
+                self._valid.popitem(last=False)
+
+    def known_valid(self, path, etag):
+        with self._lock:
+            return etag is not None and self._valid.get(path) == etag
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+            self._valid.pop(path, None)
+
+    def invalidate_tree(self, path):
+        """forget path and everything below it"""
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            for entries in (self._entries, self._valid):
+                for p in list(entries):
+                    if p == path or p.startswith(prefix):
+                        del entries[p]
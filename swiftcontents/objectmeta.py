@@ -0,0 +1,39 @@
+"""
+What SwiftFS records about an object in its X-Object-Meta-Swiftcontents-*
+headers
+
+    type      notebook, file or directory
+    size      the size of the content, before any compression
+    hash      the md5 of the content, before any compression
+    format    how a file's content was given to save(): text or base64
+    nbformat  a notebook's nbformat version, eg 4.2
+    valid     1 if the notebook passed validation when it was saved (a
+              record only: anything that can write the object can set it)
+    blobs     1 if the notebook's large outputs are stored as blobs
+    encoding  the compression applied (see compression.py)
+
+These come back with every stat (and so with stat_many), so what an object
+is can be known without a listing probe or a download.  Objects written by
+anything else simply have none of them.
+"""
+
+__all__ = ['META_PREFIX', 'HEADER_PREFIX', 'meta_options', 'object_meta']
+
+# as given to SwiftService in the 'meta' option, and as read back in the
+# (lower-cased) response headers
+META_PREFIX = 'Swiftcontents-'
+HEADER_PREFIX = 'x-object-meta-swiftcontents-'
+
+
+def meta_options(meta):
+    """SwiftService 'meta' option entries for a dictionary of metadata"""
+    return ['%s%s:%s' % (META_PREFIX, key.capitalize(), value)
+            for key, value in sorted(meta.items()) if value is not None]
+
+
+def object_meta(headers):
+    """the swiftcontents metadata in an object's headers, as a dictionary"""
+    if not headers:
+        return {}
+    n = len(HEADER_PREFIX)
+    return dict((k[n:], v) for k, v in headers.items() if k.startswith(HEADER_PREFIX))
@@ -0,0 +1,54 @@
+"""
+A lock for each path, so changes to one path happen one at a time while
+changes to different paths go ahead together
+
+Locks only exist while they are held (or waited for), so there's no table
+of every path ever seen.
+"""
+import threading
+from contextlib import contextmanager
+
+__all__ = ['PathLocks']
+
+
+class PathLocks(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}    # path -> [RLock, holders and waiters]
+
+    def _get(self, path):
+        with self._lock:
+            entry = self._locks.setdefault(path, [threading.RLock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _put(self, path):
+        with self._lock:
+            entry = self._locks[path]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[path]
+
+    @contextmanager
+    def hold(self, *paths):
+        """
+        hold the locks of all of paths; they are taken in sorted order, so
+        two callers holding overlapping sets can't deadlock
+        """
+        paths = sorted(set(p.strip('/') for p in paths))
+        held = []
+        try:
+            for path in paths:
+                lock = self._get(path)
+                try:
+                    lock.acquire()
+                except BaseException:
+                    self._put(path)
+                    raise
+                held.append((path, lock))
+            yield
+        finally:
+            for path, lock in reversed(held):
+                lock.release()
+                self._put(path)
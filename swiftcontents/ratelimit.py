@@ -0,0 +1,134 @@
+"""
+Keeping the rate of requests to Swift within a budget
+
+Each kind of request ('list', 'stat', 'read', 'write', 'delete', 'copy')
+can have a token bucket: a request takes a token (a request for several
+objects takes one per object) and tokens come back at the configured
+rate, up to burst seconds' worth.  A caller that finds too few waits, in
+priority order: interactive work (a notebook being opened or saved) goes
+ahead of bulk work (recursive deletes, moves, background scans), and
+callers of the same priority go first come, first served.
+
+When Swift refuses a request with 429 or 503, throttled() halves that
+kind's rate; it grows back to the configured rate over recovery seconds.
+"""
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+__all__ = ['RateLimiter', 'INTERACTIVE', 'BULK']
+
+INTERACTIVE = 0
+BULK = 1
+
+
+class _Bucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.current = self.rate
+        self.capacity = max(1.0, self.rate * burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waiting = []     # heap of (priority, sequence)
+        self.metrics = {'requests': 0, 'waited': 0, 'wait_seconds': 0.0,
+                        'max_wait': 0.0, 'max_queued': 0, 'throttled': 0}
+
+
+class RateLimiter(object):
+
+    # the least a bucket is throttled down to, as a fraction of its rate
+    min_fraction = 0.1
+
+    def __init__(self, rates=None, burst=1.0, recovery=10.0):
+        """rates is {kind of request: requests per second}; other kinds are unlimited"""
+        self.recovery = recovery
+        self._buckets = dict((op, _Bucket(rate, burst))
+                             for op, rate in (rates or {}).items() if rate > 0)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._sequence = itertools.count()
+        self._local = threading.local()
+
+    @contextmanager
+    def priority(self, level):
+        """requests made (from this thread) inside the with block have priority level"""
+        previous = getattr(self._local, 'priority', INTERACTIVE)
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        return getattr(self._local, 'priority', INTERACTIVE)
+
+    def _refill(self, bucket, now):
+        elapsed = now - bucket.updated
+        bucket.updated = now
+        if bucket.current < bucket.rate:
+            bucket.current = min(bucket.rate,
+                                 bucket.current + bucket.rate * elapsed / self.recovery)
+        bucket.tokens = min(bucket.capacity, bucket.tokens + bucket.current * elapsed)
+
+    def acquire(self, op, n=1):
+        """
+        wait until n requests of kind op may be made; returns the seconds waited.
+
+        More than a burst's worth is let through once the bucket is full,
+        leaving it in debt, so large batches are paid for by the wait after.
+        """
+        bucket = self._buckets.get(op)
+        if bucket is None:
+            return 0.0
+        start = time.monotonic()
+        entry = (self.current_priority(), next(self._sequence))
+        with self._lock:
+            heapq.heappush(bucket.waiting, entry)
+            bucket.metrics['max_queued'] = max(bucket.metrics['max_queued'], len(bucket.waiting))
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(bucket, now)
+                    need = min(n, bucket.capacity)
+                    if bucket.waiting[0] == entry and bucket.tokens >= need:
+                        break
+                    if bucket.waiting[0] == entry:
+                        self._changed.wait((need - bucket.tokens) / bucket.current)
+                    else:
+                        self._changed.wait()
+                bucket.tokens -= n
+            finally:
+                bucket.waiting.remove(entry)
+                heapq.heapify(bucket.waiting)
+                self._changed.notify_all()
+            waited = time.monotonic() - start
+            metrics = bucket.metrics
+            metrics['requests'] += n
+            if waited > 0.001:
+                metrics['waited'] += 1
+                metrics['wait_seconds'] += waited
+                metrics['max_wait'] = max(metrics['max_wait'], waited)
+        return waited
+
+    def throttled(self, op):
+        """Swift refused a request of kind op as too many: slow down"""
+        bucket = self._buckets.get(op)
+        if bucket is None:
+            return
+        with self._lock:
+            self._refill(bucket, time.monotonic())
+            bucket.current = max(bucket.rate * self.min_fraction, bucket.current / 2)
+            bucket.metrics['throttled'] += 1
+
+    def metrics(self):
+        """
+        {kind: {counter: value}} for each limited kind of request: the rate
+        now, callers queued now and at most, and the calls that waited with
+        their total and longest waits (in seconds)
+        """
+        with self._lock:
+            return dict((op, dict(b.metrics, rate=b.current, queued=len(b.waiting)))
+                        for op, b in self._buckets.items())
@@ -0,0 +1,159 @@
+"""
+Keeping directory listings fresh in the background
+
+SwiftFS.listdir() answers from the listings kept here rather than asking
+Swift every time.  A thread re-lists the directories worth keeping fresh -
+those listed lately (hot), or with something modified lately - and compares
+each new listing with the one kept, by name and ETag.  Whatever was added,
+changed or removed (by another server, or anything else writing to the
+container) is published to subscribers, which drop what they had cached for
+those objects.
+
+Each directory's watermark is the newest last_modified in its listing.  A
+directory whose watermark is recent is re-listed every interval; one that
+hasn't changed for a while is re-listed less often, up to max_interval.  A
+directory that is neither hot nor recently changed is forgotten.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from datetime import timezone
+from .listing import parse_timestamp
+
+__all__ = ['ListingRefresher']
+
+
+class _Listing(object):
+
+    __slots__ = ('records', 'etags', 'watermark', 'fetched', 'accessed')
+
+    def __init__(self, records, now):
+        self.records = records
+        self.etags = dict((r['name'], r.get('hash')) for r in records)
+        self.watermark = max((r.get('last_modified') or '' for r in records), default='')
+        self.fetched = now
+        self.accessed = now
+
+
+class ListingRefresher(object):
+
+    log = logging.getLogger('ListingRefresher')
+
+    def __init__(self, lister, interval=2.0, max_interval=60.0, hot_seconds=300.0):
+        """lister(path) gives a directory's current listing, from Swift"""
+        self.lister = lister
+        self.interval = interval
+        self.max_interval = max_interval
+        self.hot_seconds = hot_seconds
+        self._listings = {}
+        # bumped by each invalidation, which is remembered for a while, so a
+        # listing fetched while its directory was being changed isn't kept
+        self._generation = 0
+        self._invalidated = deque(maxlen=1024)   # (generation, path, recursive)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """callback(names) is called with the names of objects changed elsewhere"""
+        self._subscribers.append(callback)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='SwiftFS-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, path):
+        """the kept listing of path, or None"""
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is None:
+                return None
+            listing.accessed = time.monotonic()
+            return list(listing.records)
+
+    def put(self, path, records, generation):
+        """keep a listing of path, fetched since generation() gave generation"""
+        with self._lock:
+            if self._generation - generation > len(self._invalidated):
+                # too long ago to tell what was invalidated since
+                return
+            for invalidated, p, recursive in reversed(self._invalidated):
+                if invalidated <= generation:
+                    break
+                if p == path or (recursive and path.startswith(p)):
+                    return
+            self._listings[path] = _Listing(records, time.monotonic())
+
+    def invalidate(self, path, recursive=False):
+        """forget the listing of path (and, recursive, of every directory in it)"""
+        with self._lock:
+            for p in [p for p in self._listings
+                      if p == path or (recursive and p.startswith(path))]:
+                del self._listings[p]
+            self._generation += 1
+            self._invalidated.append((self._generation, path, recursive))
+
+    # how often to re-list, from how long since anything in it was modified
+    def _due(self, listing, now, wall_now):
+        try:
+            modified = parse_timestamp(listing.watermark)
+            if modified.tzinfo is None:
+                modified = modified.replace(tzinfo=timezone.utc)
+            age = max(0.0, wall_now - modified.timestamp())
+        except ValueError:
+            age = float('inf')
+        if now - listing.accessed > self.hot_seconds and age > self.hot_seconds:
+            return None
+        interval = min(self.max_interval, max(self.interval, age / 10))
+        return now - listing.fetched >= interval
+
+    def refresh(self):
+        """re-list every directory that's due, publishing what changed"""
+        now, wall_now = time.monotonic(), time.time()
+        due = []
+        with self._lock:
+            for path, listing in list(self._listings.items()):
+                is_due = self._due(listing, now, wall_now)
+                if is_due is None:
+                    del self._listings[path]
+                elif is_due:
+                    due.append((path, listing))
+        changed = []
+        for path, old in due:
+            try:
+                records = self.lister(path)
+            except Exception as e:
+                self.log.warning("ListingRefresher: could not list `%s`: %s", path, e)
+                continue
+            new = _Listing(records, time.monotonic())
+            new.accessed = old.accessed
+            names = [name for name, etag in new.etags.items() if old.etags.get(name) != etag]
+            names.extend(name for name in old.etags if name not in new.etags)
+            # an invalidation of this path (and only this path) while it was
+            # being listed drops or replaces the kept listing; then the new
+            # one isn't kept, though what it shows changed is still news
+            with self._lock:
+                if self._listings.get(path) is old:
+                    self._listings[path] = new
+            changed.extend(names)
+        if changed:
+            self.log.debug("ListingRefresher: %d objects changed elsewhere", len(changed))
+            for callback in self._subscribers:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    self.log.warning("ListingRefresher: subscriber failed: %s", e)
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
@@ -0,0 +1,174 @@
+"""
+Hedging, retries and deadlines for idempotent Swift requests
+
+A request that takes longer than the recent latency percentile for its kind of
+operation gets a duplicate ("hedged") request sent alongside it, and whichever
+answers first is used.  Requests refused with 429 (Too Many Requests) or 503
+(Service Unavailable) are retried after an exponential backoff with jitter.
+Each kind of operation has an overall deadline.  throttled(op), if given, is
+told of every refusal, so the rate of requests can be brought down too.  An
+attempt whose error failover(error) says another attempt might not get (at
+another endpoint, say) is followed by one straight away.
+
+Attempts run on the policy's threads; a caller's before(), called on its own
+thread ahead of each attempt, can wait (for a rate limiter, say) without
+holding one of them.
+
+Only use this for requests that are safe to repeat: GET, HEAD and listings.
+"""
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from swiftclient.service import SwiftError
+
+__all__ = ['RequestPolicy', 'is_retryable', 'RETRY_STATUSES']
+
+RETRY_STATUSES = (429, 503)
+
+
+def _http_status(e):
+    status = getattr(e, 'http_status', None)
+    if status is None:
+        # a SwiftError may wrap the ClientException that caused it
+        status = getattr(getattr(e, 'exception', None), 'http_status', None)
+    return status
+
+
+def is_retryable(e):
+    return _http_status(e) in RETRY_STATUSES
+
+
+class RequestPolicy(object):
+
+    log = logging.getLogger('RequestPolicy')
+
+    # no hedging until an operation has this many latency samples
+    min_samples = 20
+
+    def __init__(self, hedge=True, hedge_percentile=95.0, hedge_min_delay=0.05,
+                 max_retries=3, backoff=0.1, max_backoff=5.0, deadlines=None,
+                 threads=8, throttled=None, failover=None):
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadlines = dict(deadlines or {})
+        self.throttled = throttled
+        self.failover = failover
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._metrics = {}
+
+    def _count(self, op, name, n=1):
+        with self._lock:
+            counters = self._metrics.setdefault(op, {'requests': 0, 'hedged': 0,
+                                                     'hedge_wins': 0, 'retries': 0,
+                                                     'deadline_exceeded': 0})
+            counters[name] += n
+
+    def metrics(self):
+        """returns {operation: {counter: value}} for every operation seen"""
+        with self._lock:
+            return dict((op, dict(c)) for op, c in self._metrics.items())
+
+    def _record(self, op, elapsed):
+        with self._lock:
+            self._latencies.setdefault(op, deque(maxlen=500)).append(elapsed)
+
+    def hedge_delay(self, op):
+        """how long to wait before hedging, or None if not (yet) hedging"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get(op, ()))
+        if len(samples) < self.min_samples:
+            return None
+        i = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100.0))
+        return max(samples[i], self.hedge_min_delay)
+
+    def call(self, op, fn, hedge=True, before=None):
+        """
+        call fn() under the policy for operation 'op', returning its result.
+
+        fn must do all of its network I/O before returning (so, for
+        SwiftService, it must consume the generator it is given), and should
+        raise for errors worth retrying.  hedge=False only retries, for
+        requests whose losing duplicate would be left holding a connection.
+        before(), if given, is called on this thread ahead of every attempt:
+        the first, hedges, retries and failovers.
+        """
+        deadline = self.deadlines.get(op)
+        expires = time.monotonic() + deadline if deadline else None
+        attempt = 0
+        while True:
+            self._count(op, 'requests')
+            try:
+                return self._hedged(op, fn, expires, hedge, before)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if self.throttled is not None:
+                    self.throttled(op)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                pause = random.uniform(0, min(self.max_backoff,
+                                              self.backoff * 2 ** attempt))
+                if expires is not None and time.monotonic() + pause >= expires:
+                    raise
+                self.log.debug("RequestPolicy %s got %s, retry %d in %.2fs",
+                               op, _http_status(e), attempt, pause)
+                self._count(op, 'retries')
+                time.sleep(pause)
+
+    def _remaining(self, expires):
+        if expires is None:
+            return None
+        return max(0, expires - time.monotonic())
+
+    def _hedged(self, op, fn, expires, hedge=True, before=None):
+        def submit():
+            if before is not None:
+                before()
+            return self._executor.submit(fn)
+
+        start = time.monotonic()
+        first = submit()
+        pending, hedges = set([first]), set()
+        delay = self.hedge_delay(op) if hedge else None
+        if delay is not None:
+            remaining = self._remaining(expires)
+            done, _ = wait(pending, timeout=delay if remaining is None else min(delay, remaining))
+            if not done and (expires is None or time.monotonic() < expires):
+                self.log.debug("RequestPolicy %s slower than %.3fs, hedging", op, delay)
+                self._count(op, 'hedged')
+                hedged = submit()
+                pending.add(hedged)
+                hedges.add(hedged)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=self._remaining(expires),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                self._count(op, 'deadline_exceeded')
+                raise SwiftError("%s request deadline exceeded" % op)
+            for f in done:
+                if f.exception() is None:
+                    self._record(op, time.monotonic() - start)
+                    if f in hedges:
+                        self._count(op, 'hedge_wins')
+                    return f.result()
+                if self.failover is not None and self.failover(f.exception()) and \
+                        (expires is None or time.monotonic() < expires):
+                    pending.add(submit())
+                    continue
+                if error is None:
+                    error = f.exception()
+        raise error
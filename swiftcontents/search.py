@@ -0,0 +1,132 @@
+"""
+A local full-text index of the notebooks (and the names of the other files)
+in a container
+
+Each indexed object is kept with the ETag it was indexed at, so bringing the
+index up to date needs only a listing: objects whose ETag has changed are
+downloaded and re-indexed, and objects no longer listed are dropped.  The
+contents manager also updates it directly as it saves, deletes and renames.
+
+The index is an SQLite FTS5 table, with a notebook's cell sources as its
+text; queries are answered from it alone.
+"""
+import json
+import sqlite3
+import threading
+import posixpath
+
+__all__ = ['SearchIndex', 'notebook_text']
+
+
+def notebook_text(content):
+    """the cell sources of a notebook (as stored JSON, or parsed), one cell per line"""
+    try:
+        nb = json.loads(content) if isinstance(content, str) else content
+    except ValueError:
+        return ''
+    if not isinstance(nb, dict):
+        return ''
+    sources = []
+    for cell in nb.get('cells', []):
+        source = cell.get('source', '')
+        sources.append(''.join(source) if isinstance(source, list) else source)
+    return '\n'.join(sources)
+
+
+def _fts_query(query):
+    """every word of query, each as a quoted prefix term, so all must match"""
+    words = query.replace('"', ' ').split()
+    return ' '.join('"%s"*' % w for w in words)
+
+
+class SearchIndex(object):
+
+    def __init__(self, path=':memory:'):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS objects'
+                             ' (id INTEGER PRIMARY KEY, path TEXT UNIQUE, etag TEXT)')
+            self._db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS text USING fts5'
+                             ' (name, content, tokenize="unicode61")')
+
+    def etags(self):
+        """returns {path: etag} for everything indexed"""
+        with self._lock:
+            return dict(self._db.execute('SELECT path, etag FROM objects'))
+
+    def update(self, path, etag, content=''):
+        """index path (at etag) with the given text"""
+        path = path.strip('/')
+        name = posixpath.basename(path)
+        with self._lock, self._db:
+            row = self._db.execute('SELECT id FROM objects WHERE path = ?', (path,)).fetchone()
+            if row is None:
+                rowid = self._db.execute('INSERT INTO objects (path, etag) VALUES (?, ?)',
+                                         (path, etag)).lastrowid
+            else:
+                rowid = row[0]
+                self._db.execute('UPDATE objects SET etag = ? WHERE id = ?', (etag, rowid))
+                self._db.execute('DELETE FROM text WHERE rowid = ?', (rowid,))
+            self._db.execute('INSERT INTO text (rowid, name, content) VALUES (?, ?, ?)',
+                             (rowid, name, content))
+
+    def remove(self, paths):
+        with self._lock, self._db:
+            for path in paths:
+                row = self._db.execute('SELECT id FROM objects WHERE path = ?',
+                                       (path.strip('/'),)).fetchone()
+                if row is not None:
+                    self._db.execute('DELETE FROM text WHERE rowid = ?', row)
+                    self._db.execute('DELETE FROM objects WHERE id = ?', row)
+
+    def _tree(self, path):
+        path = path.strip('/')
+        return [p for p, in self._db.execute(
+            "SELECT path FROM objects WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, len(path) + 1, path + '/'))]
+
+    def remove_tree(self, path):
+        """forget path, and everything under it if it's a directory"""
+        with self._lock:
+            paths = self._tree(path)
+        self.remove(paths)
+
+    def move(self, old_path, new_path):
+        """rename path, and everything under it if it's a directory"""
+        old_path, new_path = old_path.strip('/'), new_path.strip('/')
+        with self._lock, self._db:
+            for path in self._tree(old_path):
+                moved = new_path + path[len(old_path):]
+                replaced = self._db.execute('SELECT id FROM objects WHERE path = ?',
+                                            (moved,)).fetchone()
+                if replaced is not None:
+                    self._db.execute('DELETE FROM text WHERE rowid = ?', replaced)
+                    self._db.execute('DELETE FROM objects WHERE id = ?', replaced)
+                rowid = self._db.execute('SELECT id FROM objects WHERE path = ?',
+                                         (path,)).fetchone()[0]
+                self._db.execute('UPDATE objects SET path = ? WHERE id = ?', (moved, rowid))
+                self._db.execute('UPDATE text SET name = ? WHERE rowid = ?',
+                                 (posixpath.basename(moved), rowid))
+
+    def search(self, query, path='', limit=50):
+        """
+        returns [(path, snippet)] for the objects under path whose name or
+        text has every word of query (as a word prefix), best match first
+        """
+        match = _fts_query(query)
+        if not match:
+            return []
+        path = path.strip('/')
+        prefix = path + '/' if path else ''
+        with self._lock:
+            return self._db.execute(
+                "SELECT objects.path, snippet(text, 1, '[', ']', '...', 12)"
+                " FROM text JOIN objects ON objects.id = text.rowid"
+                " WHERE text MATCH ? AND substr(objects.path, 1, ?) = ?"
+                " ORDER BY rank LIMIT ?",
+                (match, len(prefix), prefix, limit)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,62 @@
+"""
+A process-wide pool of SwiftService connections
+
+Every SwiftFS with the same connection options shares one SwiftService (and so
+one set of authenticated connections), whichever container it works on.  The
+containers known to exist are remembered, so a new SwiftFS for an existing
+container costs no round trip to Swift.
+"""
+import json
+import threading
+from swiftclient.service import SwiftService, get_conn
+
+__all__ = ['get_service', 'get_connection', 'ensure_container', 'forget_container']
+
+_lock = threading.Lock()
+_services = {}
+_containers = set()
+
+
+def _key(options):
+    return json.dumps(options or {}, sort_keys=True)
+
+
+def get_service(options=None):
+    """return the shared SwiftService for these options, creating it if needed"""
+    key = _key(options)
+    with _lock:
+        service = _services.get(key)
+        if service is None:
+            service = SwiftService(options=dict(options) if options else None)
+            _services[key] = service
+        return service
+
+
+def get_connection(options=None):
+    """
+    a swiftclient Connection, set up as the shared SwiftService's own are,
+    for the requests SwiftService has no method for
+    """
+    return get_conn(get_service(options)._options)
+
+
+def ensure_container(container, options=None):
+    """
+    make sure the container exists, posting to Swift only the first time it
+    is asked for.
+
+    returns the SwiftService 'post' result, or None if the container is
+    already known to exist; raises SwiftError if the post fails
+    """
+    key = (_key(options), container)
+    if key in _containers:
+        return None
+    result = get_service(options).post(container=container)
+    if result["success"]:
+        _containers.add(key)
+    return result
+
+
+def forget_container(container, options=None):
+    """forget that a container exists (for example, after deleting it)"""
+    _containers.discard((_key(options), container))
@@ -0,0 +1,34 @@
+"""
+Spreading a container's objects over several shard containers
+
+Swift slows down badly once a container holds a few million objects, so
+with SwiftFS.shards set the objects are spread over that many containers,
+'<container>_shard<n>'.  An object goes in the shard chosen by a hash of the
+directory it is in, so everything one directory listing needs (its files,
+and the markers of the directories in it) is in a single shard.  Paths are
+unchanged: only the container an object is in depends on the layout.
+
+Existing data is moved to (or between) layouts with
+
+    python -m swiftcontents.migrate --shards N
+"""
+import hashlib
+
+__all__ = ['parent_directory', 'shard_index', 'shard_containers']
+
+
+def parent_directory(name, delimiter='/'):
+    """the directory name is in, ending in the delimiter ('' for the root)"""
+    parent = name.rstrip(delimiter).rpartition(delimiter)[0]
+    return parent + delimiter if parent else ''
+
+
+def shard_index(directory, shards):
+    """which of shards a directory's entries go in; the same in every process"""
+    digest = hashlib.md5(directory.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def shard_containers(container, shards):
+    """the names of a container's shards"""
+    return ['%s_shard%d' % (container, i) for i in range(shards)]
@@ -0,0 +1,61 @@
+"""
+Sharing one request between identical concurrent callers
+
+When several threads ask for the same thing at once (the same listing,
+stat or object), only the first actually asks Swift; the rest wait for it
+and get the same result, or the same exception.  Nothing is kept once the
+request is done: a caller arriving after that makes a new one.
+"""
+import threading
+
+__all__ = ['SingleFlight']
+
+
+class _Call(object):
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.requests = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """fn(), or the result of the call for key already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.requests += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def metrics(self):
+        """requests made, and calls that shared one already in flight"""
+        with self._lock:
+            return {'requests': self.requests, 'shared': self.shared}
@@ -0,0 +1,111 @@
+"""
+Uploading content a chunk at a time
+
+SwiftService uploads from anything with a read() method, and sends what it
+reads with chunked transfer encoding, so nothing needs to know the length
+up front.  ChunkReader gives it that over an iterator of chunks (bytes,
+bytearrays or memoryviews, passed on as views rather than copied), so a
+large file is never in memory all at once.  json_chunks makes the chunks
+of a JSON document as it is serialised.
+"""
+import json
+import hashlib
+
+__all__ = ['CHUNK_SIZE', 'as_chunks', 'json_chunks', 'Measured', 'ChunkReader']
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _view(chunk):
+    view = memoryview(chunk)
+    return view if view.format == 'B' and view.ndim == 1 else view.cast('B')
+
+
+def as_chunks(content, chunk_size=CHUNK_SIZE):
+    """content (bytes, a bytearray or memoryview, or an iterable of them) as chunks"""
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        view = _view(content)
+        return (view[i:i + chunk_size] for i in range(0, len(view), chunk_size))
+    return iter(content)
+
+
+def _json_pieces(obj, depth):
+    # the same text as json.dumps(obj), in pieces: containers down to depth
+    # are written a member at a time, and what's in them by json.dumps
+    if depth > 0 and isinstance(obj, dict) and obj and \
+            all(isinstance(key, str) for key in obj):
+        separator = '{'
+        for key, value in obj.items():
+            yield separator + json.dumps(key) + ': '
+            yield from _json_pieces(value, depth - 1)
+            separator = ', '
+        yield '}'
+    elif depth > 0 and isinstance(obj, (list, tuple)) and obj:
+        separator = '['
+        for value in obj:
+            yield separator
+            yield from _json_pieces(value, depth - 1)
+            separator = ', '
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+
+def json_chunks(obj, depth=4, chunk_size=CHUNK_SIZE):
+    """
+    json.dumps(obj), UTF-8 encoded, as chunks of about chunk_size bytes.
+
+    Only one member of a container at depth is serialised at once: for a
+    notebook, that's a single output of a single cell.
+    """
+    pieces, size = [], 0
+    for piece in _json_pieces(obj, depth):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(pieces).encode('utf-8')
+            pieces, size = [], 0
+    if pieces:
+        yield ''.join(pieces).encode('utf-8')
+
+
+class Measured(object):
+    """chunks, passed through while taking their size and md5"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self._md5.update(chunk)
+            self.size += _view(chunk).nbytes
+            yield chunk
+
+    def hexdigest(self):
+        return self._md5.hexdigest()
+
+
+class ChunkReader(object):
+    """a file, to read from once, over an iterator of chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b'')
+        self.size = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = b''.join([self._pending] + [_view(c) for c in self._chunks])
+            self._pending = memoryview(b'')
+            self.size += len(data)
+            return data
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._pending = _view(chunk)
+        piece, self._pending = self._pending[:size], self._pending[size:]
+        self.size += len(piece)
+        return piece
@@ -2,31 +2,251 @@
 Utilities to make Swift look like a regular file system
 """
 import os
-import swiftclient
 import io
+import heapq
+import functools
+import itertools
+import hashlib
 import re
 import logging
 import tempfile
-from swiftclient.service import SwiftService, SwiftError, SwiftUploadObject
-from swiftclient.multithreading import OutputManager
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from swiftclient.service import SwiftError, SwiftUploadObject, SwiftCopyObject, SwiftPostObject
 from swiftclient.exceptions import ClientException
-from keystoneauth1 import session
-from keystoneauth1.identity import v3
 from tornado.web import HTTPError
-from traitlets import default, HasTraits, Unicode, Any, Instance
+from traitlets import default, validate, HasTraits, Unicode, Any, Instance, Integer, Float, Bool, Dict, List, TraitError
+from traitlets.config import Configurable
 from .callLogging import *
+from .servicepool import get_service, get_connection, ensure_container, forget_container
+from .diskcache import DiskCache
+from .listing import ListingRecord, parse_timestamp
+from .usage import Usage, USAGE_OBJECT
+from .refresher import ListingRefresher
+from .singleflight import SingleFlight
+from .sharding import parent_directory, shard_index, shard_containers
+from .objectmeta import meta_options, object_meta
+from .archive import (archive_format, archive_entries, archive_stream, bulk_extractable,
+                      BULK_FORMATS, STREAM_FORMATS)
+from .requestpolicy import RequestPolicy, is_retryable
+from .ratelimit import RateLimiter, BULK
+from .endpoints import EndpointSelector, is_endpoint_failure
+from .compression import (ENCODING_HEADER, available_encodings,
+                          compress, compress_stream, decompress, decompress_stream)
+from .streaming import as_chunks, Measured, ChunkReader
 #from pprint import pprint
 
 
-class SwiftFS(HasTraits):
+def _changes_container(method):
+    """
+    marks a method that changes the container, so a usage scan can tell
+    whether one was going on while it listed
+    """
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        with self._changing_lock:
+            self._changing += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            with self._changing_lock:
+                self._changing -= 1
+                self._changes += 1
+    return wrapped
+
+
+def _bulk_work(method):
+    """
+    marks a method that makes many requests, which wait behind interactive
+    ones for the request budget (see ratelimit.py)
+    """
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        with self.limiter.priority(BULK):
+            return method(self, *args, **kwargs)
+    return wrapped
+
+
+class SwiftFS(Configurable):
 
     container = Unicode(os.environ.get('CONTAINER', 'demo'))
+
+    user = Unicode(os.environ.get('JUPYTERHUB_USER', ''),
+        help="The user whose files these are, for container_template",
+        config=True
+        )
+
+    container_template = Unicode("",
+        help="""Name the container after the user, eg 'jupyter-{user}'.
+        When empty, the CONTAINER environment variable is used""",
+        config=True
+        )
+
+    swift_options = Dict(
+        help="Options for SwiftService; SwiftFS instances with the same options share connections",
+        config=True
+        )
+
     storage_url = Unicode(
         help="The base URL for containers",
         default_value='http://example.com',
         config=True
         )
 
+    storage_urls = List(Unicode(),
+        help="""Storage URLs of several Swift proxies for the same account.
+        Reads go to the fastest, healthiest of them and fail over to the
+        others; when empty, SwiftService's own storage URL is used""",
+        config=True
+        )
+
+    blob_container = Unicode(
+        help="The container holding content-addressed notebook output blobs",
+        config=True
+        )
+
+    compression = Unicode("",
+        help="Compress stored files with 'gzip' or 'zstd' (empty for none)",
+        config=True
+        )
+
+    compression_min_size = Integer(1024,
+        help="Files smaller than this many bytes are stored uncompressed",
+        config=True
+        )
+
+    cache_dir = Unicode("",
+        help="Directory for a persistent cache of objects (empty for none)",
+        config=True
+        )
+
+    cache_max_bytes = Integer(1024 * 1024 * 1024,
+        help="The most bytes of objects to keep in the disk cache",
+        config=True
+        )
+
+    cache_mmap_threshold = Integer(1024 * 1024,
+        help="Cached objects at least this big are memory-mapped rather than read",
+        config=True
+        )
+
+    stat_batch_size = Integer(100,
+        help="How many objects stat_many asks SwiftService to stat (in parallel) at once",
+        config=True
+        )
+
+    hedge_requests = Bool(True,
+        help="Send a duplicate of a slow read, stat or list request and use whichever answers first",
+        config=True
+        )
+
+    hedge_percentile = Float(95.0,
+        help="A request is slow (and hedged) once it takes longer than this percentile of recent ones",
+        config=True
+        )
+
+    max_retries = Integer(3,
+        help="How often to retry a read, stat or list refused with 429 or 503",
+        config=True
+        )
+
+    retry_backoff = Float(0.1,
+        help="Seconds to back off before the first retry; doubles (with jitter) for each retry",
+        config=True
+        )
+
+    request_deadlines = Dict({'list': 30, 'stat': 10, 'read': 120},
+        help="Seconds allowed for each kind of request, including hedges and retries",
+        config=True
+        )
+
+    skip_unchanged = Bool(True,
+        help="""Don't upload a file whose content and metadata are the same as what is
+already stored (costs a HEAD request for each write, unless the disk cache shows
+the content has changed)""",
+        config=True
+        )
+
+    request_rates = Dict({},
+        help="""Most requests per second to make to Swift, for each kind of request:
+'list', 'stat', 'read', 'write', 'delete' and 'copy' (a request for several
+objects counts once for each).  Kinds not given are unlimited.  Bulk work
+(recursive deletes, moves, background scans) waits behind everything else""",
+        config=True
+        )
+
+    request_burst = Float(1.0,
+        help="How many seconds' worth of requests (at request_rates) may be made at once",
+        config=True
+        )
+
+    archive_batch_size = Integer(500,
+        help="How many files of an uploaded archive are held in memory and uploaded (in parallel) at once",
+        config=True
+        )
+
+    archive_parallel = Integer(4,
+        help="How many files are fetched from Swift at once when downloading a directory as an archive",
+        config=True
+        )
+
+    archive_prefetch_limit = Integer(8 * 1024 * 1024,
+        help="""Files up to this size are fetched ahead, in parallel, when downloading a
+directory as an archive; larger ones are streamed when their turn comes""",
+        config=True
+        )
+
+    usage_tracking = Bool(False,
+        help="""Keep running totals of the bytes and objects under each directory
+(see usage()), saved in the blob container""",
+        config=True
+        )
+
+    usage_save_interval = Float(60.0,
+        help="Seconds between saves of the usage totals, when they have changed",
+        config=True
+        )
+
+    usage_reconcile_interval = Float(6 * 3600.0,
+        help="""Seconds between scans of the whole container to correct the usage totals
+(for changes made other than through this SwiftFS); 0 never scans after the first""",
+        config=True
+        )
+
+    shards = Integer(0,
+        help="""Spread objects over this many containers, '<container>_shard<n>', by a hash
+of their directory (see sharding.py); 0 keeps them all in the one container.
+Existing data has to be moved with 'python -m swiftcontents.migrate'""",
+        config=True
+        )
+
+    coalesce_requests = Bool(True,
+        help="""Have identical listings, stats and reads made at the same time (from
+different threads) share one request to Swift""",
+        config=True
+        )
+
+    listing_refresh_interval = Float(0.0,
+        help="""Keep directory listings in memory, re-listing the ones in use in the
+background every this many seconds to pick up changes made elsewhere (see
+refresher.py); 0 asks Swift for every listing""",
+        config=True
+        )
+
+    listing_hot_seconds = Float(300.0,
+        help="How long a directory's listing is kept fresh after it was last listed",
+        config=True
+        )
+
+    warm_up = Bool(False,
+        help="""Connect to Swift and fetch the root listing in the background
+        as soon as SwiftFS is created, rather than on first use""",
+        config=True
+        )
+
     delimiter = Unicode("/", help="Path delimiter", config=True)
 
     root_dir = Unicode("/", config=True)
@@ -36,25 +256,173 @@ class SwiftFS(HasTraits):
     def __init__(self, **kwargs):
         super(self.__class__, self).__init__(**kwargs)
 
+        if self.container_template:
+            self.container = self.container_template.format(user=self.user)
+
         # With the python swift client, the connection is automagically
         # created using environment variables (I know... horrible or what?)
         self.log.info("using swift container `%s`", self.container)
 
-        # open connection to swift container
-        self.swift = SwiftService()
+        self.cache = None
+        if self.cache_dir:
+            self.cache = DiskCache(os.path.join(self.cache_dir, self.container),
+                                   max_bytes=self.cache_max_bytes,
+                                   mmap_threshold=self.cache_mmap_threshold)
+
+        self.limiter = RateLimiter(self.request_rates, burst=self.request_burst)
+        self.policy = RequestPolicy(hedge=self.hedge_requests,
+                                    hedge_percentile=self.hedge_percentile,
+                                    max_retries=self.max_retries,
+                                    backoff=self.retry_backoff,
+                                    deadlines=self.request_deadlines,
+                                    throttled=self.limiter.throttled,
+                                    failover=self._failover)
+
+        # nothing talks to swift until it's first needed (see the swift
+        # property), so a slow swift doesn't hold up (or fail) server startup
+        self._swift = None
+        self._bulk_upload = None
+        self._connect_lock = threading.Lock()
+        self.endpoints = None
+        if self.storage_urls:
+            self.endpoints = EndpointSelector(self.storage_urls)
+
+        # bumped by every change to the container, so a listing fetched in
+        # the background is only used if nothing changed while fetching it
+        self._changes = 0
+        self._changing = 0
+        self._changing_lock = threading.Lock()
+        self._prefetched = None
+        self._warm_up_thread = None
+
+        self.flights = SingleFlight() if self.coalesce_requests else None
+        # writes skipped because the content was already stored
+        self.unchanged_writes = 0
+
+        self.refresher = None
+        if self.listing_refresh_interval > 0:
+            self.refresher = ListingRefresher(self._refresh_listing,
+                                              interval=self.listing_refresh_interval,
+                                              max_interval=30 * self.listing_refresh_interval,
+                                              hot_seconds=self.listing_hot_seconds)
+            self.refresher.subscribe(self._changed_elsewhere)
+            self.refresher.start()
+
+        self.usage = None
+        self._usage_thread = None
+        if self.usage_tracking:
+            self.usage = Usage(self.delimiter)
+            self._usage_wake = threading.Event()
+            self._usage_reconcile_due = False
+            self._usage_thread = threading.Thread(target=self._usage_loop,
+                                                  name='SwiftFS-usage',
+                                                  daemon=True)
+            self._usage_thread.start()
+
+        if self.warm_up:
+            self._warm_up_thread = threading.Thread(target=self._warm_up,
+                                                    name='SwiftFS-warm-up',
+                                                    daemon=True)
+            self._warm_up_thread.start()
+
+    @property
+    def swift(self):
+        """
+        the (shared) SwiftService, once the container is known to exist; with
+        several storage_urls, the one for the best endpoint right now
+        """
+        if self._swift is None:
+            self._connect()
+        if self.endpoints is None:
+            return self._swift
+        return self._service(self.endpoints.best())
+
+    def _options(self, url=None):
+        if url is None:
+            return self.swift_options
+        return dict(self.swift_options, os_storage_url=url)
+
+    # the endpoint the container is checked (and created) through
+    def _primary_options(self):
+        return self._options(self.storage_urls[0] if self.storage_urls else None)
+
+    # one SwiftService (from the pool) per endpoint
+    def _service(self, url):
+        return get_service(self._options(url))
+
+    def _connect(self):
+        with self._connect_lock:
+            if self._swift is not None:
+                return
+            # open (or share) the connection to swift
+            options = self._primary_options()
+            swift = get_service(options)
+
+            # make sure the container (or every shard) exists
+            for container in self.containers:
+                try:
+                    result = ensure_container(container, options)
+                except SwiftError as e:
+                    self.log.error("creating container %s", e.value)
+                    raise HTTPError(404,e.value)
+
+                if result is not None and not result["success"]:
+                    msg = "could not create container %s"%container
+                    self.log.error(msg)
+                    raise HTTPError(404,msg)
+            self._swift = swift
+
+    @property
+    def containers(self):
+        """every container objects are stored in: the container, or its shards"""
+        if self.shards:
+            return shard_containers(self.container, self.shards)
+        return [self.container]
+
+    def container_for(self, path):
+        """the container the object at path is stored in"""
+        if not self.shards:
+            return self.container
+        return self.directory_container(parent_directory(path.lstrip(self.delimiter),
+                                                          self.delimiter))
+
+    def directory_container(self, directory):
+        """the container holding a directory's entries (its listing)"""
+        if not self.shards:
+            return self.container
+        base = directory.strip(self.delimiter)
+        directory = base + self.delimiter if base else ''
+        return self.containers[shard_index(directory, self.shards)]
 
-        # make sure container exists
+    def _by_container(self, items, name=lambda item: item):
+        """group items (objects, or things with names) by the container they're in"""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.container_for(name(item)), []).append(item)
+        return groups
+
+    def _warm_up(self):
         try:
-            result = self.swift.post(container=self.container)
-        except SwiftError as e:
-            self.log.error("creating container %s", e.value)
-            raise HTTPError(404,e.value)
+            changes = self._changes
+            files = self.listdir("")
+            if changes == self._changes:
+                self._prefetched = (changes, files)
+            self.log.info("SwiftFS warmed up: %d objects in the root of `%s`",
+                          len(files), self.container)
+        except Exception as e:
+            self.log.warning("SwiftFS warm up failed: %s", e)
+
 
-        if not result["success"]:
-            msg = "could not create container %s"%self.container
-            self.log.error(msg)
-            raise HTTPError(404,msg)
+    @default('blob_container')
+    def _blob_container_default(self):
+        return self.container + '_blobs'
 
+    @validate('compression')
+    def _validate_compression(self, proposal):
+        value = proposal['value']
+        if value and value not in available_encodings():
+            raise TraitError("compression must be one of %s" % available_encodings())
+        return value
 
     # see 'list' at https://docs.openstack.org/developer/python-swiftclient/service-api.html
     # Returns a list of all objects that start with the prefix given
@@ -72,7 +440,8 @@ class SwiftFS(HasTraits):
         the full list of all objects in that path are returned (needed for a
         rename, for example)
 
-        returns a list of dictionaries for each object:
+        returns a list of ListingRecords (which can be read as dictionaries)
+        for each object:
             {'bytes': 11,
              'hash': '3e25960a79dbc69b674cd4ec67a72c62',
              'last_modified': '2017-06-06T08:55:36.473Z',
@@ -82,18 +451,35 @@ class SwiftFS(HasTraits):
 
         # Get all objects that match the known path
         path = self.clean_path(path)
-        _opts = {'prefix': path}
+        prefetched = self._prefetched
+        if this_dir_only and path == "" and prefetched is not None:
+            self._prefetched = None
+            if prefetched[0] == self._changes:
+                return prefetched[1]
+
+        generation = None
+        if this_dir_only and self.refresher is not None:
+            # kept under the directory's name, ending in the delimiter
+            base = path.rstrip(self.delimiter)
+            path = base + self.delimiter if base else ''
+            kept = self.refresher.get(path)
+            if kept is not None:
+                return kept
+            generation = self.refresher.generation()
+
         try:
-            dir_listing = self.swift.list(container=self.container,
-                                     options=_opts)
-            for page in dir_listing:  # each page is up to 10,000 items
-                if page["success"]:
-                    files.extend(page["listing"])   # page is returning a list
-                else:
-                    raise page["error"]
+            files = list(self._coalesced(('list', path, this_dir_only),
+                                         lambda: self._fetch_listing(path, this_dir_only)))
         except SwiftError as e:
             self.log.error("SwiftFS.listdir %s", e.value)
+            return files
+        if generation is not None:
+            self.refresher.put(path, files, generation)
+        return files
 
+    def _fetch_listing(self, path, this_dir_only=True):
+        """listdir(), always from Swift"""
+        regex = None
         if this_dir_only:
             # make up the pattern to compile into our regex engine
             regex_delim = re.escape(self.delimiter)
@@ -105,14 +491,246 @@ class SwiftFS(HasTraits):
             self.log.debug("restrict directory pattern is: `%s`", pattern)
             regex = re.compile(pattern, re.UNICODE)
 
-            new_files = []
-            for f in files:
-                if regex.match(f['name']):
-                    new_files.append(f)
-            files = new_files
+        # filter as the listing streams in, so only the records we keep are
+        # ever held (compactly) in memory
+        from_dict = ListingRecord.from_dict
+        if this_dir_only and self.shards:
+            # one directory's entries are all in its shard
+            base = path.rstrip(self.delimiter)
+            listing = self._iterlist(base + self.delimiter if base else '',
+                                     self.directory_container(path))
+        else:
+            listing = self.iterlist(path)
+        files = [from_dict(f) for f in listing
+                 if regex is None or regex.match(f['name'])]
 
         return files
 
+    @_bulk_work
+    def _refresh_listing(self, path):
+        """the refresher's re-listing of path, as bulk work"""
+        return self._fetch_listing(path)
+
+    def _listing_changed(self, path):
+        """forget the kept listings a change to path (or the tree at path) makes stale"""
+        if self.refresher is None:
+            return
+        name = path.strip(self.delimiter)
+        parent = name.rpartition(self.delimiter)[0]
+        self.refresher.invalidate(parent + self.delimiter if parent else '')
+        if name:
+            self.refresher.invalidate(name + self.delimiter, recursive=True)
+
+    def _changed_elsewhere(self, names):
+        """the refresher found names changed, other than through this SwiftFS"""
+        self._changes += 1
+        if self.cache is not None:
+            for name in names:
+                self.cache.invalidate(self.container, name)
+        if self.usage is not None:
+            self._usage_reconcile_due = True
+
+    def iterlist(self, prefix):
+        """
+        generate the listing record of every object whose name starts with
+        prefix, fetching the listing a page at a time
+        """
+        if self.shards:
+            # a tree is spread over every shard: merge their listings
+            key = lambda record: record['name']
+            for record in heapq.merge(*[self._iterlist(prefix, c) for c in self.containers],
+                                      key=key):
+                yield record
+            return
+        for record in self._iterlist(prefix):
+            yield record
+
+    def _iterlist(self, prefix, container=None):
+        for page in self._list_pages(prefix, container):  # each page is up to 10,000 items
+            if page["success"]:
+                for record in page["listing"]:
+                    yield record
+            else:
+                raise page["error"]
+
+    # Reads, stats and listings are safe to repeat, so they go through the
+    # request policy (hedging, retries, deadlines).  Each attempt has to
+    # finish its network I/O, so SwiftService's generators are consumed
+    # inside it, and errors worth retrying are raised rather than returned.
+    def _raise_retryable(self, r):
+        if r['success']:
+            return
+        error = r.get('error')
+        if is_retryable(error) or (self.endpoints is not None and is_endpoint_failure(error)):
+            raise error
+
+    # Returns a callable for the request policy that runs attempt(swift)
+    # against the best endpoint not yet tried, and feeds each endpoint's
+    # latency and errors back into the choice.  An endpoint that doesn't
+    # answer is failed over from by the policy (see _failover), which calls
+    # this again; once every endpoint has been tried, the last error is
+    # raised.  With a single endpoint it just runs attempt.
+    def _routed(self, attempt):
+        if self.endpoints is None:
+            return lambda: attempt(self.swift)
+        tried = set()
+        lock = threading.Lock()
+
+        def routed():
+            self.swift
+            with lock:
+                untried = [u for u in self.endpoints.candidates() if u not in tried]
+                url = untried[0]
+                tried.add(url)
+                last = len(untried) == 1
+                if last:
+                    # a retry starts again from the best
+                    tried.clear()
+            start = time.monotonic()
+            try:
+                result = attempt(self._service(url))
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    self.endpoints.record(url, time.monotonic() - start)
+                    raise
+                self.log.warning("SwiftFS: endpoint %s failed: %s", url, e)
+                self.endpoints.record(url, time.monotonic() - start, ok=False)
+                if last:
+                    raise _NoEndpointAnswered("no storage endpoint answered: %s" % e, exc=e)
+                raise
+            self.endpoints.record(url, time.monotonic() - start)
+            return result
+        return routed
+
+    def _failover(self, error):
+        return self.endpoints is not None and is_endpoint_failure(error) and \
+            not isinstance(error, _NoEndpointAnswered)
+
+    # Every attempt at a request (retries, hedged duplicates and failovers
+    # too) takes its own tokens from the rate limiter, on the calling
+    # thread, before it is handed to the policy's threads: a request waiting
+    # for tokens never holds one of those, so interactive requests can get
+    # ahead of queued bulk ones
+    def _call(self, op, attempt, n=1, hedge=True):
+        """attempt(swift), for n objects, under the request policy for op"""
+        return self.policy.call(op, self._routed(attempt), hedge=hedge,
+                                before=functools.partial(self.limiter.acquire, op, n))
+
+    # Each page is its own request, made on one of SwiftService's pooled
+    # connections when the page is wanted: SwiftService.list would keep
+    # fetching pages in the background, which nothing stops when a hedged
+    # attempt loses or the caller only wants the first page
+    def _list_pages(self, prefix, container=None):
+        """the pages of a listing, each fetched under the request policy as it is needed"""
+        container = container or self.container
+        marker = ''
+        while True:
+            page = self._call('list', functools.partial(self._list_page, container, prefix, marker))
+            if page is None:
+                return
+            yield page
+            if not page['success']:
+                return
+            last = page['listing'][-1]
+            marker = last.get('name', last.get('subdir'))
+
+    def _list_page(self, container, prefix, marker, swift):
+        """one page of a listing, in SwiftService.list's format; None past the end"""
+        def get(conn):
+            return conn.get_container(container, prefix=prefix, marker=marker)[1]
+
+        page = {'action': 'list_container_part', 'container': container,
+                'prefix': prefix, 'marker': marker}
+        try:
+            items = swift.thread_manager.container_pool.submit(get).result()
+        except Exception as e:
+            if getattr(e, 'http_status', None) == 404:
+                e = SwiftError('Container %r not found' % container, container=container, exc=e)
+            page.update(success=False, error=e)
+            self._raise_retryable(page)
+            return page
+        if not items:
+            return None
+        page.update(success=True, listing=items)
+        return page
+
+    def _stat(self, objects, container=None):
+        """stat a list of objects, returning a list of SwiftService results"""
+        container = container or self.container
+
+        def attempt(swift):
+            results = list(swift.stat(container=container, objects=objects))
+            for r in results:
+                self._raise_retryable(r)
+            return results
+
+        return self._call('stat', attempt, len(objects))
+
+    # SwiftService stats a list of objects in parallel, with as many threads
+    # as its object_dd_threads option allows (see swift_options)
+    @LogMethod()
+    def stat_many(self, paths, strict=False):
+        """
+        stat many objects at once.
+
+        returns a list in the same order as paths, holding each object's
+        headers (a dictionary), or None where the object could not be stat'ed.
+        With strict, None is only for objects that don't exist, and any
+        other failure is an error.
+        """
+        names = [p.lstrip(self.delimiter) for p in paths]
+        headers = {}
+        for container, group in self._by_container(names).items():
+            for i in range(0, len(group), self.stat_batch_size):
+                batch = group[i:i + self.stat_batch_size]
+                try:
+                    results = self._stat(batch, container)
+                except SwiftError as e:
+                    if strict:
+                        self.do_error("SwiftFS.stat_many %s" % e.value)
+                    self.log.error("SwiftFS.stat_many %s", e.value)
+                    continue
+                for r in results:
+                    if r['success']:
+                        headers[r['object']] = r['headers']
+                    elif strict and getattr(r.get('error'), 'http_status', None) != 404:
+                        self.do_error("SwiftFS.stat_many %s: %s" % (r['object'], r.get('error')))
+        return [headers.get(n) for n in names]
+
+    def stat(self, path, strict=False):
+        """an object's headers (a dictionary), or None if it can't be stat'ed (see stat_many)"""
+        headers = self._coalesced(('stat', path.lstrip(self.delimiter), strict),
+                                  lambda: self.stat_many([path], strict)[0])
+        return dict(headers) if headers is not None else None
+
+    # Identical requests made at the same time share one: the key includes
+    # the change counter, so a request made after a change never gets the
+    # result of one made before it
+    def _coalesced(self, key, fn):
+        if self.flights is None:
+            return fn()
+        return self.flights.do(key + (self._changes,), fn)
+
+    def coalescing_metrics(self):
+        """requests made, and calls that shared one already in flight"""
+        if self.flights is None:
+            return {}
+        return self.flights.metrics()
+
+    def request_metrics(self):
+        """hedge, retry and deadline counts for each kind of request"""
+        return self.policy.metrics()
+
+    def rate_limit_metrics(self):
+        """rates, queue depths and waits for each kind of request with a limit"""
+        return self.limiter.metrics()
+
+    def endpoint_metrics(self):
+        """latency and error rates of each storage URL (empty for just one)"""
+        if self.endpoints is None:
+            return {}
+        return self.endpoints.metrics()
+
     # We can 'stat' files, but not directories
     @LogMethodResults()
     def isfile(self, path):
@@ -124,10 +742,11 @@ class SwiftFS(HasTraits):
         _isfile = False
         if not path.endswith(self.delimiter):
            path = self.clean_path(path)
+           response = []
            try:
-                response = self.swift.stat(container=self.container, objects=[path])
+                response = self._stat([path], self.container_for(path))
            except Exception as e:
-                self.log.error("SwiftFS.isfile %s", e.value)
+                self.log.error("SwiftFS.isfile %s", e)
            for r in response:
                if r['success']:
                    _isfile =  True
@@ -154,20 +773,25 @@ class SwiftFS(HasTraits):
         _isdir = False
 
         path = self.clean_path(path)
-        _opts = {}
+        prefix = ''
         if re.search('\w', path):
-            _opts = {'prefix': path}
+            prefix = path
+        r = None
         try:
             self.log.debug("SwiftFS.isdir setting prefix to '%s'", path)
-            response = self.swift.list(container=self.container, options=_opts)
+            # _list_pages is a generator: the request is made by fetching
+            # the first page, so that has to happen in here
+            r = next(self._list_pages(prefix, self.directory_container(prefix)), None)
         except SwiftError as e:
             self.log.error("SwiftFS.isdir %s", e.value)
-        for r in response:
+        if r is not None:
             if r['success']:
                 _isdir = True
             else:
                 self.log.error('Failed to retrieve stats for %s' % path)
-            break
+        if not _isdir and self.shards and prefix:
+            # an empty directory: just its marker, which is in its parent's shard
+            _isdir = self.stat(prefix) is not None
         return _isdir
 
     @LogMethod()
@@ -180,14 +804,24 @@ class SwiftFS(HasTraits):
 
     @LogMethod()
     def remove_container(self):
+        for container in self.containers:
+            self._remove_container(container)
+
+    def _remove_container(self, container):
         response = {}
         try:
-            response = self.swift.stat(container=self.container)
+            response = self.swift.stat(container=container)
         except SwiftError as e:
             self.log.error("SwiftFS.remove_container %s", e.value)
         if 'success' in response and response['success'] == True :
+            forget_container(container, self._primary_options())
+            self._changes += 1
+            if self.usage is not None:
+                self.usage.rebuild([])
+            if self.refresher is not None:
+                self.refresher.invalidate('', recursive=True)
             try:
-                response = self.swift.delete(container=self.container)
+                response = self.swift.delete(container=container)
             except SwiftError as e:
                 self.log.error("SwiftFS.remove_container %s", e.value)
             for r in response:
@@ -195,6 +829,7 @@ class SwiftFS(HasTraits):
 
 
     @LogMethod()
+    @_changes_container
     def rm(self, path, recursive=False):
 
         if path in ["", self.delimiter]:
@@ -204,11 +839,20 @@ class SwiftFS(HasTraits):
             return False
 
         if recursive:
-            for f in self._walk_path(path, dir_first=True):
-                self.log.debug("SwiftFS.rm recurse into `%s`", f)
-                self.rm(f)
-            self.log.info("SwiftFS.rm and now remove `%s`", path)
-            self.rm(path)
+            sizes = {} if self.usage is not None else None
+            with self.limiter.priority(BULK):
+                objects = list(self._walk_path(path, dir_first=True, sizes=sizes))
+                self.log.info("SwiftFS.rm removing %d objects from `%s`",
+                              len(objects), path)
+                if sizes is not None:
+                    self._stored_sizes([o for o in objects if not o.endswith(self.delimiter)], sizes)
+                deleted = self._delete_objects(objects)
+            self._listing_changed(path)
+            if deleted and sizes is not None:
+                for name in objects:
+                    if name in sizes:
+                        self.usage.remove(name, sizes[name])
+            return deleted
         else:
             self.log.info("SwiftFS.rm not recursing for `%s`", path)
             files = self.listdir(path)
@@ -221,8 +865,13 @@ class SwiftFS(HasTraits):
                 self.do_error("directory %s not empty" % path, code=400)
 
             path = self.clean_path(path)
+            headers = self.stat(path) if self.usage is not None else None
+            self._changes += 1
+            if self.cache is not None:
+                self.cache.invalidate(self.container, path)
+            self.limiter.acquire('delete')
             try:
-                response = self.swift.delete(container=self.container,
+                response = self.swift.delete(container=self.container_for(path),
                                         objects=[path])
             except SwiftError as e:
                 self.log.error("SwiftFS.rm %s", e.value)
@@ -230,65 +879,142 @@ class SwiftFS(HasTraits):
             for r in response:
                 self.log.debug("SwiftFS.rm action: `%s` success: `%s`",
                                r['action'], r['success'])
+                if r['action'] == 'delete_object' and r['success'] and headers is not None:
+                    self.usage.remove(path, int(headers.get('content-length', 0)))
+            self._listing_changed(path)
             return True
 
     @LogMethod()
-    def _walk_path(self, path, dir_first=False):
-        if not dir_first:
-            yield path
-        for f in self.listdir(path):
-            if not dir_first:
-                yield f['name']
-            if self.guess_type(f['name']) == 'directory':
-                for ff in self._walk_path(f['name'], dir_first=dir_first):
-                    yield ff
+    def _delete_objects(self, objects):
+        """delete a list of objects in one (parallel) request"""
+        if not objects:
+            return True
+        self._changes += 1
+        if self.cache is not None:
+            for name in objects:
+                self.cache.invalidate(self.container, name)
+        try:
+            for container, group in self._by_container(objects).items():
+                self.limiter.acquire('delete', len(group))
+                response = self.swift.delete(container=container, objects=group)
+                for r in response:
+                    self.log.debug("SwiftFS.rm action: `%s` success: `%s`",
+                                   r['action'], r['success'])
+        except SwiftError as e:
+            self.log.error("SwiftFS.rm %s", e.value)
+            return False
+        return True
+
+    # Walks a path from a single prefix listing: the path itself (its
+    # directory marker, for a directory) and every object below it.
+    # Swift lists in lexical order, where a directory marker ('a/b/') sorts
+    # before everything in it, so the listing order visits each directory
+    # before its contents and can be streamed.  dir_first visits the contents
+    # before their directory, so reverses the whole (in memory) listing.
+    # sizes, if given, is filled in with the size of each object listed.
+    @LogMethod()
+    def _walk_path(self, path, dir_first=False, sizes=None):
+        path = path.lstrip(self.delimiter)
+        base = path.rstrip(self.delimiter)
+        prefix = base + self.delimiter if base else ''
+        found = False
+        names = []
+        for f in self.iterlist(prefix):
+            if sizes is not None:
+                sizes[f['name']] = f.get('bytes', 0)
+            if not found:
+                found = True
+                if prefix and not dir_first:
+                    yield prefix
+            if f['name'] == prefix:
+                continue
             if dir_first:
+                names.append(f['name'])
+            else:
                 yield f['name']
         if dir_first:
-            yield path
+            for name in reversed(names):
+                yield name
+        if not found:
+            # nothing below it: a file, or an empty (implicit) directory
+            if not path.endswith(self.delimiter):
+                yield path
+            elif prefix:
+                yield prefix
+        elif prefix and dir_first:
+            yield prefix
 
     # core function to copy or move file-objects
-    # does clever recursive stuff for directory trees
+    # does clever recursive stuff for directory trees: the whole tree comes
+    # from one listing, then the directory markers are made in one upload and
+    # the files copied in one (parallel) copy request
     @LogMethod()
+    @_bulk_work
+    @_changes_container
     def _copymove(self, old_path, new_path, with_delete=False):
 
         # check parent directory exists
         self.checkParentDirExists(new_path)
-        
-        for f in self._walk_path(old_path):
-            new_f = f.replace(old_path, new_path, 1)
-            if self.guess_type(f) == 'directory':
-                self.mkdir(new_f)
+
+        old_path = old_path.lstrip(self.delimiter)
+        old_base = old_path.rstrip(self.delimiter)
+        new_base = new_path.strip(self.delimiter)
+        markers = []
+        copies = []
+        sizes = {} if self.usage is not None else None
+        copied = []
+        for f in self._walk_path(old_path, sizes=sizes):
+            new_f = new_base + f[len(old_base):]
+            copied.append((f, new_f))
+            if f.endswith(self.delimiter):
+                markers.append(SwiftUploadObject(None, object_name=new_f,
+                                                 options={'meta': meta_options({'type': 'directory'})}))
             else:
-                old_path = self.clean_path(old_path)
-                new_path = self.clean_path(new_path)
-                try:
-                    response = self.swift.copy(self.container, [f],
-                                          {'destination': self.delimiter +
-                                           self.container +
-                                           self.delimiter +
-                                           new_f})
-                except SwiftError as e:
-                    self.log.error(e.value)
-                    raise 
-                for r in response:
-                    if r["success"]:
-                        if r["action"] == "copy_object":
-                            self.log.debug(
-                                "object %s copied from /%s/%s" %
-                               (r["destination"], r["container"], r["object"])
-                            )
-                        if r["action"] == "create_container":
-                            self.log.debug(
-                                "container %s created" % r["container"]
-                            )
-                    else:
-                        if "error" in r and isinstance(r["error"], Exception):
-                            raise r["error"]
+                # with shards, the copy may well be to another container
+                copies.append(SwiftCopyObject(f, {'destination': self.delimiter +
+                                                  self.container_for(new_f) +
+                                                  self.delimiter +
+                                                  new_f}))
+        self._changes += 1
+        try:
+            for container, group in self._by_container(markers, lambda m: m.object_name).items():
+                self.limiter.acquire('write', len(group))
+                for r in self.swift.upload(container, group):
+                    self.log.debug("SwiftFS._copymove action: '%s', response: '%s'",
+                                   r['action'], r['success'])
+            response = itertools.chain.from_iterable(
+                self._copy(container, group) for container, group in
+                self._by_container(copies, lambda c: c.object_name).items())
+        except SwiftError as e:
+            self.log.error(e.value)
+            raise
+        for r in response:
+            if r["success"]:
+                if r["action"] == "copy_object":
+                    self.log.debug(
+                        "object %s copied from /%s/%s" %
+                       (r["destination"], r["container"], r["object"])
+                    )
+                if r["action"] == "create_container":
+                    self.log.debug(
+                        "container %s created" % r["container"]
+                    )
+            else:
+                if "error" in r and isinstance(r["error"], Exception):
+                    raise r["error"]
+        self._listing_changed(new_path)
+        if sizes is not None:
+            self._stored_sizes([f for f, _ in copied if not f.endswith(self.delimiter)], sizes)
+            for f, new_f in copied:
+                self.usage.add(new_f, sizes.get(f, 0))
         # we always test for delete: file or directory...
         if with_delete:
             self.rm(old_path, recursive=True)
 
+    def _copy(self, container, copies):
+        self.limiter.acquire('copy', len(copies))
+        return self.swift.copy(container, copies)
+
     # Directories are just objects that have a trailing '/'
     @LogMethod()
     def mkdir(self, path):
@@ -296,40 +1022,429 @@ class SwiftFS(HasTraits):
         path = path + self.delimiter
         self._do_write(path, None)
 
+    # Usage accounting: every write, copy and delete adjusts the totals by the
+    # (stored) sizes it knows, from a listing it made anyway or from a stat
+    # taken just before.  A thread saves the totals when they've changed, and
+    # now and then replaces them with a scan of the whole container; the
+    # first scan only happens if there are no saved totals to start from.
+    def usage_totals(self, path=''):
+        """
+        bytes and objects stored under the directory at path, with the same
+        for each directory in it:
+
+            {'bytes': 1234, 'objects': 5, 'directories': {'sub': {...}, ...}}
+        """
+        if self.usage is None:
+            self.do_error("usage tracking is not enabled", code=404)
+        totals = self.usage.totals(path)
+        totals['directories'] = self.usage.subdirectories(path)
+        return totals
+
+    @LogMethod()
+    @_bulk_work
+    def reconcile_usage(self):
+        """replace the usage totals with those of listings of the whole container and its blobs"""
+        # a change during the scan may or may not be in it: try again later
+        with self._changing_lock:
+            changes = None if self._changing else self._changes
+        if changes is not None:
+            records = list(self.iterlist(''))
+            records.extend({'name': key, 'bytes': size}
+                           for key, (size, mtime) in self.list_blobs().items())
+        with self._changing_lock:
+            if changes is None or self._changing or changes != self._changes:
+                self.log.info("SwiftFS.reconcile_usage: container changed while scanning")
+                return False
+            self.usage.rebuild(records)
+        self.log.info("SwiftFS.reconcile_usage: %d objects in `%s`", len(records), self.container)
+        return True
+
+    def save_usage(self):
+        data = self.usage.to_json()
+        try:
+            self.write_blobs({USAGE_OBJECT: data.encode('utf-8')})
+        except (SwiftError, ClientException) as e:
+            self.usage.dirty = True
+            self.log.warning("SwiftFS: could not save usage totals: %s", e)
+
+    def _usage_loop(self):
+        try:
+            saved = self.read_blobs([USAGE_OBJECT]).get(USAGE_OBJECT)
+            if saved is not None:
+                self.usage.merge(saved)
+            else:
+                self._usage_reconcile_due = True
+        except Exception as e:
+            self.log.warning("SwiftFS: could not load usage totals: %s", e)
+            self._usage_reconcile_due = True
+        last_scan = time.monotonic()
+        while True:
+            try:
+                interval = self.usage_reconcile_interval
+                if self._usage_reconcile_due or \
+                        (interval > 0 and time.monotonic() - last_scan > interval):
+                    if self.reconcile_usage():
+                        self._usage_reconcile_due = False
+                        last_scan = time.monotonic()
+                if self.usage.dirty:
+                    self.save_usage()
+            except Exception as e:
+                self.log.warning("SwiftFS usage update failed: %s", e)
+            self._usage_wake.wait(self.usage_save_interval)
+            self._usage_wake.clear()
+
+    def _stored_sizes(self, names, sizes):
+        """fill in sizes (from a listing) with a stat of the names it hasn't got"""
+        missing = [n for n in names if n not in sizes]
+        for name, headers in zip(missing, self.stat_many(missing) if missing else []):
+            if headers is not None:
+                sizes[name] = int(headers.get('content-length', 0))
+        return sizes
+
+    # Uploading an archive: where the cluster has Swift's bulk middleware,
+    # a tar archive is sent as one PUT and extracted server side; anything it
+    # didn't create (checked against a listing), and zip archives or clusters
+    # without it, go through SwiftService's parallel upload in batches.
+    # The middleware writes each member under its name in the archive, as it
+    # is, with no compression or metadata, so it's only used when none of
+    # that matters.  Directory markers are all uploaded at once.
+    @LogMethod()
+    @_bulk_work
+    def upload_archive(self, path, archive, metadata=False):
+        """
+        write every file in a tar or zip archive (a seekable binary file)
+        into the directory at path, creating the directories they are in.
+        With metadata, every file is written with its metadata (see
+        objectmeta), as write() does.
+
+        returns the names of the files written
+        """
+        base = self.clean_path(path).strip(self.delimiter)
+        if base and not self.isdir(base):
+            self.do_error("directory does not exist %s" % path, code=400)
+        fmt = archive_format(archive)
+        if fmt is None:
+            self.do_error("not a tar or zip archive", code=400)
+        prefix = base + self.delimiter if base else ''
+        start = archive.tell()
+
+        pending = None
+        # the bulk middleware extracts into one container, so not with shards
+        if fmt in BULK_FORMATS and not self.shards and not self.compression and \
+                not metadata and bulk_extractable(archive, fmt) and \
+                self._bulk_upload_supported():
+            # file name -> md5, to check what the cluster extracted
+            hashes = dict((name, hashlib.md5(data).hexdigest())
+                          for name, data in archive_entries(archive, fmt)
+                          if data is not None)
+            archive.seek(start)
+            if self._extract_archive(base, archive, fmt):
+                listed = dict((f['name'], f.get('hash')) for f in self.iterlist(prefix))
+                pending = set(name for name, md5 in hashes.items()
+                              if listed.get(prefix + name) != md5)
+                self.log.info("SwiftFS.upload_archive: %d of %d files extracted by swift",
+                              len(hashes) - len(pending), len(hashes))
+            archive.seek(start)
+
+        self._changes += 1
+        written, dirs = [], set()
+        batch = []
+        for name, data in archive_entries(archive, fmt):
+            parts = name.rstrip(self.delimiter).split(self.delimiter)
+            for i in range(1, len(parts) + (data is None)):
+                dirs.add(prefix + self.delimiter.join(parts[:i]) + self.delimiter)
+            if data is None:
+                continue
+            written.append(prefix + name)
+            if self.cache is not None:
+                self.cache.invalidate(self.container, prefix + name)
+            if pending is not None and name not in pending:
+                continue
+            batch.append(self._upload_object(prefix + name, data,
+                                             self.guess_type(name, allow_directory=False)))
+            if len(batch) >= self.archive_batch_size:
+                self._upload_batch(batch)
+                batch = []
+        markers = [SwiftUploadObject(None, object_name=d,
+                                     options={'meta': meta_options({'type': 'directory'})})
+                   for d in sorted(dirs)]
+        self._upload_batch(batch + markers)
+        self._listing_changed(base)
+        if self.usage is not None:
+            # what the bulk middleware replaced isn't known: count it all again
+            self._usage_reconcile_due = True
+            self._usage_wake.set()
+        return written
+
+    def _bulk_upload_supported(self):
+        if self._bulk_upload is None:
+            try:
+                result = self.swift.capabilities()
+                self._bulk_upload = result['success'] and \
+                    'bulk_upload' in result.get('capabilities', {})
+            except (SwiftError, ClientException) as e:
+                self.log.warning("SwiftFS: no cluster capabilities: %s", e)
+                self._bulk_upload = False
+        return self._bulk_upload
+
+    def _extract_archive(self, base, archive, fmt):
+        """PUT the archive for the bulk middleware to extract; False if that failed"""
+        url = self.endpoints.best() if self.endpoints is not None else None
+        self.limiter.acquire('write')
+        try:
+            conn = get_connection(self._options(url))
+            conn.put_object(self.container, base or None, archive,
+                            query_string='extract-archive=%s' % fmt,
+                            headers={'Accept': 'application/json'})
+        except ClientException as e:
+            self.log.warning("SwiftFS: extract-archive failed, uploading instead: %s", e)
+            return False
+        return True
+
+    def _upload_batch(self, things):
+        if not things:
+            return
+        failed = []
+        try:
+            for container, group in self._by_container(things, lambda t: t.object_name).items():
+                self.limiter.acquire('write', len(group))
+                for r in self.swift.upload(container, group):
+                    if r['action'] == 'upload_object' and not r['success']:
+                        failed.append(r['object'])
+        except SwiftError as e:
+            self.log.error("SwiftFS.upload_archive swift-error: %s", e.value)
+            raise
+        if failed:
+            self.do_error("could not upload %d files, including %s" % (len(failed), failed[0]))
+
+    # Downloading a directory as an archive: one listing of the prefix, with
+    # up to archive_parallel files fetched ahead of the one being written.
+    # Only files up to archive_prefetch_limit are fetched ahead (and held in
+    # memory); larger ones are streamed through as they are written, so
+    # memory use doesn't grow with the size of the directory.
+    @LogMethod()
+    def iter_archive(self, path, fmt='zip', resolve=None):
+        """
+        generate a zip or tar archive of everything in the directory at path,
+        a chunk at a time.  Names in the archive are relative to path.
+
+        resolve(headers, chunks), if given, returns the (headers, chunks) to
+        archive for each file, in place of what open_stream gave
+        """
+        base = self.clean_path(path).strip(self.delimiter)
+        if fmt not in STREAM_FORMATS:
+            self.do_error("can't make a %s archive" % fmt, code=400)
+        if base and not self.isdir(base):
+            raise NoSuchFile(path)
+        prefix = base + self.delimiter if base else ''
+        records = (r for r in self.iterlist(prefix) if r['name'] != prefix)
+        return archive_stream(self._archive_members(records, prefix, fmt, resolve), fmt)
+
+    def _archive_members(self, records, prefix, fmt, resolve):
+        pool = ThreadPoolExecutor(max_workers=max(1, self.archive_parallel))
+
+        def fetch(record):
+            if record['name'].endswith(self.delimiter) or \
+                    record.get('bytes', 0) > self.archive_prefetch_limit:
+                return None
+            with self.limiter.priority(BULK):
+                headers, chunks = self._archive_open(record['name'], resolve)
+                return headers, [b''.join(chunks)]
+
+        window = deque()
+        try:
+            for record in records:
+                window.append((record, pool.submit(fetch, record)))
+                if len(window) > self.archive_parallel:
+                    member = self._archive_member(prefix, fmt, resolve, *window.popleft())
+                    if member is not None:
+                        yield member
+            while window:
+                member = self._archive_member(prefix, fmt, resolve, *window.popleft())
+                if member is not None:
+                    yield member
+        finally:
+            for record, future in window:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def _archive_open(self, name, resolve):
+        headers, chunks = self.open_stream(name)
+        return resolve(headers, chunks) if resolve is not None else (headers, chunks)
+
+    def _archive_member(self, prefix, fmt, resolve, record, future):
+        """(name, size, mtime, chunks) for archive_stream, or None for a file that's gone"""
+        name = record['name'][len(prefix):]
+        modified = parse_timestamp(record['last_modified'])
+        if modified.tzinfo is None:
+            modified = modified.replace(tzinfo=timezone.utc)
+        mtime = modified.timestamp()
+        if name.endswith(self.delimiter):
+            return name, None, mtime, None
+        try:
+            fetched = future.result()
+            headers, chunks = fetched if fetched is not None else \
+                self._archive_open(record['name'], resolve)
+        except NoSuchFile:
+            self.log.warning("SwiftFS.iter_archive: %s was deleted while archiving", record['name'])
+            return None
+        meta = object_meta(headers)
+        if 'size' in meta:
+            size = int(meta['size'])
+        elif 'content-length' in headers:
+            size = int(headers['content-length'])
+        else:
+            size = None
+        if size is None and fmt == 'tar':
+            # a compressed file from before sizes were recorded
+            chunks = [b''.join(chunks)]
+            size = len(chunks[0])
+        return name, size, mtime, chunks
+
     # This works by downloading the file to disk then reading the contents of
     # that file into memory, before deleting the file
     # NOTE this is reading text files!
     # NOTE this really only works with files in the local direcotry, but given
     # local filestore will disappear when the docker ends, I'm not too bothered.
+    # If the caller knows the object's ETag (from a listing), a cached copy
+    # with that ETag is used without asking Swift at all
     @LogMethod()
-    def read(self, path):
+    def read(self, path, etag=None):
         if self.guess_type(path) == "directory":
             msg = "cannot read from path %s: it is a directory"%path
             self.do_error(msg, code=400)
 
-        content = ''
-        fhandle,localFile = tempfile.mkstemp(prefix="swiftfs_")
-        os.close(fhandle)
         path = self.clean_path(path)
-        try:
-            response = self.swift.download(container=self.container,
-                                           objects=[path],options={"out_file":localFile})
-        except SwiftError as e:
-            self.log.error("SwiftFS.read %s", e.value)
+        data = self._read_bytes(path, etag=etag)
+        if data is None:
             return ''
+        return str(data, 'utf-8')
 
-        for r in response:
-            if r['success']:
-                self.log.debug("SwiftFS.read: using local file %s",localFile)
-                with open(localFile) as lf:
-                    content = lf.read()
+    def _read_bytes(self, path, etag=None):
+        return self._coalesced(('read', path, etag), lambda: self._download(path, etag))
+
+    def _download(self, path, etag=None, conditional=True):
+        options = {}
+        cached_etag = None
+        if self.cache is not None and conditional:
+            if etag:
+                data = self.cache.get(self.container, path, etag)
+                if data is not None:
+                    self.log.debug("SwiftFS.read: %s from the disk cache", path)
+                    return data
+            # otherwise, a conditional GET: Swift answers 304 if it's unchanged
+            cached_etag = self.cache.etag(self.container, path)
+            if cached_etag:
+                options['header'] = ['If-None-Match: %s' % cached_etag]
+
+        # each attempt (there may be a hedged pair) downloads to its own file
+        def attempt(swift):
+            fhandle,localFile = tempfile.mkstemp(prefix="swiftfs_")
+            os.close(fhandle)
+            try:
+                response = swift.download(container=self.container_for(path), objects=[path],
+                                               options=dict(options, out_file=localFile))
+                for r in response:
+                    self._raise_retryable(r)
+                    if r['success']:
+                        self.log.debug("SwiftFS.read: using local file %s",localFile)
+                        with open(localFile, 'rb') as lf:
+                            return r, lf.read()
+                    return r, None
+            finally:
                 os.remove(localFile)
-        return content
+            return None, None
+
+        data = None
+        try:
+            r, data = self._call('read', attempt)
+        except SwiftError as e:
+            # a missed deadline, or no endpoint answering: not an empty file
+            self.do_error("SwiftFS.read %s" % e.value)
+        if r is None:
+            return None
+        if r['success']:
+            headers = r['response_dict'].get('headers', {})
+            data = decompress(data, headers.get(ENCODING_HEADER))
+            if self.cache is not None:
+                self.cache.put(self.container, path, headers.get('etag'),
+                               data, headers.get('last-modified'))
+        elif cached_etag and getattr(r.get('error'), 'http_status', None) == 304:
+            self.log.debug("SwiftFS.read: %s unchanged, using the disk cache", path)
+            data = self.cache.get(self.container, path, cached_etag)
+            if data is None:
+                # evicted since its ETag was asked for: fetch it after all
+                self.log.debug("SwiftFS.read: %s gone from the disk cache", path)
+                return self._download(path, etag, conditional=False)
+        elif getattr(r.get('error'), 'http_status', None) != 404:
+            # only a missing object reads as nothing
+            self.do_error("SwiftFS.read %s: %s" % (path, r.get('error')))
+        return data
+
+    @LogMethod()
+    def open_stream(self, path, start=None, end=None):
+        """
+        open a file to be read a chunk at a time, rather than all at once.
+
+        start and end (inclusive) ask for a byte range, as an HTTP Range
+        header would: start alone reads to the end, end alone is a suffix
+        length.  Returns (headers, chunks): the object's headers, with
+        content-length and content-range describing what the chunks hold.
+        Ranges are ignored for compressed files, which are decompressed as
+        they stream (and so have no content-length).
+        """
+        path = path.lstrip(self.delimiter)
+        try:
+            stat = self._stat([path], self.container_for(path))[0]
+        except SwiftError as e:
+            self.do_error("SwiftFS.open_stream %s" % e.value)
+        if not stat['success']:
+            raise NoSuchFile(path)
+        headers = dict(stat['headers'])
+        encoding = headers.get(ENCODING_HEADER)
+
+        # If-Match: fail rather than mix the sizes of two versions of the file
+        options = {'out_file': '-', 'header': ['If-Match: %s' % headers['etag']]}
+        if encoding:
+            headers.pop('content-length', None)
+        elif start is not None or end is not None:
+            size = int(headers['content-length'])
+            if start is None:
+                start, end = max(0, size - end), size - 1
+            elif end is None or end >= size:
+                end = size - 1
+            if start >= size or start > end:
+                self.do_error("SwiftFS.open_stream range not satisfiable for %s" % path, code=416)
+            options['header'].append('Range: bytes=%d-%d' % (start, end))
+            headers['content-length'] = str(end - start + 1)
+            headers['content-range'] = 'bytes %d-%d/%d' % (start, end, size)
+
+        # returns as soon as the response headers are in; the body is left
+        # unread, so this is never hedged
+        def attempt(swift):
+            for r in swift.download(container=self.container_for(path), objects=[path],
+                                         options=options):
+                # a streamed result has 'contents', and no 'success' key
+                if 'contents' not in r:
+                    self._raise_retryable(r)
+                return r
+
+        try:
+            r = self._call('read', attempt, hedge=False)
+        except SwiftError as e:
+            self.do_error("SwiftFS.open_stream %s" % e.value)
+        if r is None or 'contents' not in r:
+            raise NoSuchFile(path)
+        return headers, decompress_stream(r['contents'], encoding)
 
     # Write is 'upload' and 'upload' needs a "file" it can read from
     # We use io.StringIO for this
     @LogMethod()
-    def write(self, path, content):
+    def write(self, path, content, meta=None):
+        """
+        write a text file.  meta is extra metadata (see objectmeta) to store
+        alongside the type, size and hash SwiftFS always records.
+        """
         if self.guess_type(path) == "directory":
             msg = "cannot write to path %s: it is a directory"%path
             self.do_error(msg, code=400)
@@ -337,7 +1452,87 @@ class SwiftFS(HasTraits):
         #path = self.clean_path(path)
         # If we can't make the directory path, then we can't make the file!
         #success = self._make_intermedate_dirs(path)
-        self._do_write(path, content)
+        return self._do_write(path, content, meta=meta)
+
+    # Streamed writes: the content goes to Swift as it is read (by
+    # SwiftService, with chunked transfer encoding), so only a chunk or two
+    # is in memory at a time.  Unless the caller gives them, its size and
+    # md5 are only known once it's all sent, and are added to its metadata
+    # afterwards.  With compression configured, streamed content is always
+    # compressed.  Without a digest it is always uploaded (see
+    # skip_unchanged), as it can't be compared first.
+    @LogMethod()
+    @_changes_container
+    def write_stream(self, path, content, meta=None, digest=None):
+        """
+        write a file from bytes, a memoryview, or an iterable of chunks of
+        either, without holding it all in memory.  meta is as for write().
+        digest is the (size, md5 hex digest) of the content, if known.
+
+        returns the ETag of the object written
+        """
+        type = self.guess_type(path)
+        if type == "directory":
+            self.do_error("cannot write to path %s: it is a directory" % path, code=400)
+        self.checkParentDirExists(path)
+        path = self.clean_path(path)
+
+        previous = None
+        if self.usage is not None or (digest is not None and self.skip_unchanged):
+            previous = self.stat(path)
+        if digest is not None and self.skip_unchanged and \
+                self._stored_as(previous, digest[1], digest[0], self.compression or None, type, meta):
+            self.log.debug("SwiftFS.write_stream %s is unchanged, not uploading", path)
+            self.unchanged_writes += 1
+            return previous.get('etag')
+
+        measured = Measured(as_chunks(content))
+        meta = dict(meta or {}, type=type)
+        if digest is not None:
+            meta.update(size=digest[0], hash=digest[1])
+        chunks = measured
+        if self.compression:
+            chunks = compress_stream(measured, self.compression)
+            meta['encoding'] = self.compression
+        source = ChunkReader(chunks)
+
+        container = self.container_for(path)
+        self._changes += 1
+        if self.cache is not None:
+            self.cache.invalidate(self.container, path)
+        self.limiter.acquire('write')
+        etag, error = None, None
+        try:
+            upload = SwiftUploadObject(source, object_name=path,
+                                       options={'meta': meta_options(meta)})
+            for r in self.swift.upload(container, [upload]):
+                if r['action'] == 'upload_object':
+                    if r['success']:
+                        etag = r.get('response_dict', {}).get('headers', {}).get('etag')
+                    else:
+                        error = r.get('error')
+        except SwiftError as e:
+            self.log.error("SwiftFS.write_stream swift-error: %s", e.value)
+            raise
+        self._listing_changed(path)
+        if error is not None:
+            self.do_error("could not write %s: %s" % (path, error))
+
+        # without a digest (or with a wrong one), record what was actually sent
+        if (meta.get('size'), meta.get('hash')) != (measured.size, measured.hexdigest()):
+            meta.update(size=measured.size, hash=measured.hexdigest())
+            self.limiter.acquire('write')
+            post = SwiftPostObject(path, options={'meta': meta_options(meta)})
+            for r in self.swift.post(container=container, objects=[post]):
+                if not r['success']:
+                    self.log.error("SwiftFS.write_stream could not record the size of %s: %s",
+                                   path, r.get('error'))
+        if self.usage is not None:
+            if previous is None:
+                self.usage.add(path, source.size)
+            else:
+                self.usage.add(path, source.size - int(previous.get('content-length', 0)), 0)
+        return etag
 
     @LogMethod()
     def _make_intermedate_dirs(self, path):
@@ -360,35 +1555,224 @@ class SwiftFS(HasTraits):
 
         return True
 
+    # returns the ETag of the object written (if Swift gave us one)
     @LogMethod()
-    def _do_write(self, path, content):
+    @_changes_container
+    def _do_write(self, path, content, meta=None):
 
         # check parent directory exists
         self.checkParentDirExists(path)
         
         type = self.guess_type(path)
+        written = None
+        if type != "directory":
+            written = content.encode('utf-8')
+        name = self.clean_path(path)
+        previous = None
+        if self.usage is not None or \
+                (written is not None and self.skip_unchanged and
+                 not self._cache_differs(name, written)):
+            previous = self.stat(name)
+        if written is not None and self.skip_unchanged and \
+                self._unchanged(previous, written, type, meta):
+            self.log.debug("SwiftFS._do_write %s is unchanged, not uploading", name)
+            self.unchanged_writes += 1
+            return previous.get('etag')
+
         things = []
         if type == "directory":
             self.log.debug("SwiftFS._do_write create directory")
-            things.append(SwiftUploadObject(None, object_name=path))
+            things.append(SwiftUploadObject(None, object_name=path,
+                                            options={'meta': meta_options({'type': type})}))
         else:
             self.log.debug("SwiftFS._do_write create file/notebook from '%s'", content)
-            output = io.BytesIO(content.encode('utf-8'))
-            things.append(SwiftUploadObject(output, object_name=path))
+            things.append(self._upload_object(path, written, type, meta))
 
         # Now do the upload
-        path = self.clean_path(path)
+        path = name
+        self._changes += 1
+        self.limiter.acquire('write')
         try:
-            response = self.swift.upload(self.container, things)
+            response = self.swift.upload(self.container_for(path), things)
         except SwiftError as e:
             self.log.error("SwiftFS._do_write swift-error: %s", e.value)
             raise
         except ClientException as e:
             self.log.error("SwiftFS._do_write client-error: %s", e.value)
             raise
+        etag = None
         for r in response:
             self.log.debug("SwiftFS._do_write action: '%s', response: '%s'",
                            r['action'], r['success'])
+            if r['action'] == 'upload_object' and r['success']:
+                etag = r.get('response_dict', {}).get('headers', {}).get('etag')
+                if self.usage is not None:
+                    source = things[0].source
+                    size = len(source.getvalue()) if source is not None else 0
+                    if previous is None:
+                        self.usage.add(path, size)
+                    else:
+                        self.usage.add(path, size - int(previous.get('content-length', 0)), 0)
+        self._listing_changed(path)
+        if self.cache is not None and type != "directory":
+            self.cache.invalidate(self.container, path)
+            self.cache.put(self.container, path, etag, written)
+        return etag
+
+    # Saving what is already stored (an autosave with nothing new, say) needn't
+    # upload anything.  Stored objects carry the md5 of their uncompressed
+    # content (or, uncompressed, have it as their ETag); an object with the
+    # same md5, metadata and compression is left as it is.  When the disk cache
+    # holds a copy that's different, the content has changed (or the cache is
+    # stale, and the object needs writing anyway), so there's no need to ask.
+    def _cache_differs(self, path, data):
+        if self.cache is None:
+            return False
+        etag = self.cache.etag(self.container, path)
+        cached = self.cache.get(self.container, path, etag) if etag else None
+        return cached is not None and hashlib.md5(cached).hexdigest() != hashlib.md5(data).hexdigest()
+
+    def _unchanged(self, headers, data, type, meta=None):
+        """whether the object with headers holds data, with the metadata a write would give it"""
+        if headers is None:
+            return False
+        encoding = None
+        if self.compression and len(data) >= self.compression_min_size:
+            encoding = self.compression
+        return self._stored_as(headers, hashlib.md5(data).hexdigest(), len(data),
+                               encoding, type, meta)
+
+    def _stored_as(self, headers, md5, size, encoding, type, meta=None):
+        """whether the object with headers holds content of md5 and size, stored as a write would"""
+        if headers is None:
+            return False
+        stored = object_meta(headers)
+        stored_md5 = stored.get('hash')
+        if stored_md5 is None and 'encoding' not in stored:
+            stored_md5 = headers.get('etag', '').strip('"')
+        if stored_md5 != md5:
+            return False
+        if stored.get('encoding') != encoding:
+            return False
+        wanted = dict(meta or {}, type=type, size=size)
+        return all(stored.get(key) == str(value)
+                   for key, value in wanted.items() if value is not None)
+
+    # The object to upload for a file's (uncompressed) bytes: compressed if
+    # configured, and with its type, size and hash in its metadata
+    def _upload_object(self, path, data, type, meta=None):
+        meta = dict(meta or {}, type=type, size=len(data),
+                    hash=hashlib.md5(data).hexdigest())
+        if self.compression and len(data) >= self.compression_min_size:
+            data = compress(data, self.compression)
+            meta['encoding'] = self.compression
+        return SwiftUploadObject(io.BytesIO(data), object_name=path,
+                                 options={'meta': meta_options(meta)})
+
+    # Blobs are content-addressed: the object name is the hash of the content,
+    # so a blob that exists never needs uploading again
+    @LogMethodResults()
+    def missing_blobs(self, keys):
+        """returns the subset of blob keys that are not in the blob container"""
+        missing = set(keys)
+        try:
+            response = self._stat(list(keys), container=self.blob_container)
+            for r in response:
+                if r['success']:
+                    missing.discard(r['object'])
+        except SwiftError as e:
+            self.log.debug("SwiftFS.missing_blobs %s", e.value)
+        return [k for k in keys if k in missing]
+
+    # Blobs count towards the usage totals of the root directory only, as
+    # a blob may be shared by notebooks anywhere in the container
+    @_changes_container
+    def write_blobs(self, blobs):
+        """upload a dictionary of {key: bytes} to the blob container"""
+        if not blobs:
+            return
+        things = [SwiftUploadObject(io.BytesIO(data), object_name=key)
+                  for key, data in blobs.items()]
+        self.limiter.acquire('write', len(things))
+        try:
+            response = self.swift.upload(self.blob_container, things)
+            for r in response:
+                self.log.debug("SwiftFS.write_blobs action: '%s', response: '%s'",
+                               r['action'], r['success'])
+                if r['action'] == 'upload_object' and not r['success']:
+                    raise r['error']
+                if r['action'] == 'upload_object' and self.usage is not None and \
+                        r['object'] != USAGE_OBJECT:
+                    self.usage.add(r['object'], len(blobs[r['object']]))
+        except SwiftError as e:
+            self.log.error("SwiftFS.write_blobs swift-error: %s", e.value)
+            raise
+
+    def list_blobs(self):
+        """{key: (bytes, last modified as a unix time)} for every blob stored"""
+        blobs = {}
+        try:
+            for record in self._iterlist('', self.blob_container):
+                if record['name'] == USAGE_OBJECT:
+                    continue
+                modified = parse_timestamp(record['last_modified'])
+                if modified.tzinfo is None:
+                    modified = modified.replace(tzinfo=timezone.utc)
+                blobs[record['name']] = (record.get('bytes', 0), modified.timestamp())
+        except SwiftError as e:
+            # no blob container: nothing has been stored in it yet
+            if getattr(e.exception, 'http_status', None) != 404:
+                raise
+        return blobs
+
+    @LogMethod()
+    @_changes_container
+    def delete_blobs(self, keys):
+        """delete blobs from the blob container, returning the keys deleted"""
+        if not keys:
+            return []
+        sizes = {}
+        if self.usage is not None:
+            sizes = dict((r['object'], int(r['headers'].get('content-length', 0)))
+                         for r in self._stat(list(keys), container=self.blob_container)
+                         if r['success'])
+        deleted = []
+        self.limiter.acquire('delete', len(keys))
+        try:
+            for r in self.swift.delete(container=self.blob_container, objects=list(keys)):
+                if r['action'] == 'delete_object' and r['success']:
+                    deleted.append(r['object'])
+                    if r['object'] in sizes:
+                        self.usage.remove(r['object'], sizes[r['object']])
+        except SwiftError as e:
+            self.log.error("SwiftFS.delete_blobs %s", e.value)
+        return deleted
+
+    # As with read, the blobs are downloaded to local disk; SwiftService
+    # fetches the objects in parallel
+    def read_blobs(self, keys):
+        """download blobs, returning a dictionary of {key: bytes}"""
+        def attempt(swift):
+            blobs = {}
+            with tempfile.TemporaryDirectory(prefix="swiftfs_") as localDir:
+                response = swift.download(container=self.blob_container,
+                                               objects=list(keys),
+                                               options={"out_directory": localDir})
+                for r in response:
+                    self._raise_retryable(r)
+                    if r['success']:
+                        with open(r['path'], 'rb') as lf:
+                            blobs[r['object']] = lf.read()
+                    else:
+                        self.log.error("SwiftFS.read_blobs failed for %s",
+                                       r['object'])
+            return blobs
+
+        try:
+            return self._call('read', attempt, len(keys))
+        except SwiftError as e:
+            self.log.error("SwiftFS.read_blobs %s", e.value)
+        return {}
 
     @LogMethodResults()
     def guess_type(self, path, allow_directory=True):
@@ -452,3 +1836,9 @@ class NoSuchFile(SwiftFSError):
     def __init__(self, path, *args, **kwargs):
         super(NoSuchFile, self).__init__(*args, **kwargs)
         self.path = path
+
+
+# raised when every storage endpoint has failed an attempt, so the request
+# policy stops failing over
+class _NoEndpointAnswered(SwiftError):
+    pass
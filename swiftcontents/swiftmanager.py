@@ -1,28 +1,115 @@
 import os
 import json
+import inspect
+import functools
+import itertools
 import mimetypes
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dateutil.parser import parse
-from pprint import pprint
 from tornado.web import HTTPError
-from traitlets import default, Unicode, List
+from traitlets import default, Unicode, List, Bool, Integer, Float
 from base64 import b64decode
 
 from swiftcontents.swiftfs import SwiftFS, SwiftFSError, NoSuchFile
+from swiftcontents.blobstore import (BlobStore, externalize_outputs, internalize_outputs,
+                                     has_blobs, blob_refs)
+from swiftcontents.nbcache import NotebookCache
+from swiftcontents.search import SearchIndex, notebook_text
+from swiftcontents.streaming import json_chunks, Measured
+from swiftcontents.pathlocks import PathLocks
+from swiftcontents.ratelimit import BULK
+from swiftcontents.listing import ListingRecord, parse_timestamp
+from swiftcontents.objectmeta import object_meta, HEADER_PREFIX
 from swiftcontents.ipycompat import ContentsManager
-from swiftcontents.ipycompat import reads, from_dict
+from swiftcontents.ipycompat import reads, from_dict, convert, versions
 from swiftcontents.callLogging import *
 
 DUMMY_CREATED_DATE = datetime.now( )
 NBFORMAT_VERSION = 4
 
+
+def holding_paths(*names):
+    """run the method holding the path locks of the named arguments"""
+    def decorate(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapped(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            with self.path_locks.hold(*(bound.arguments[n] for n in names)):
+                return method(self, *args, **kwargs)
+        return wrapped
+    return decorate
+
+
 class SwiftContentsManager(ContentsManager):
 
+    externalize_outputs = Bool(False, config=True,
+        help="Store large notebook outputs as separate content-addressed objects")
+
+    output_blob_threshold = Integer(16384, config=True,
+        help="Size (in characters) above which an output is stored as a blob")
+
+    blob_cache_size = Integer(64 * 1024 * 1024, config=True,
+        help="Bytes of notebook output blobs to keep in memory")
+
+    blob_sweep_age = Float(24 * 3600.0, config=True,
+        help="""Seconds a blob is kept by sweep_blobs() after it was written, whether or not
+a notebook refers to it yet: long enough for any save (by any server) to finish""")
+
+    directory_metadata = Bool(False, config=True,
+        help="Stat the files in a directory listing (in one parallel batch) for their mimetype and size")
+
+    notebook_cache_size = Integer(32, config=True,
+        help="Number of parsed notebooks to keep in memory, keyed by ETag")
+
+    search_index_path = Unicode("", config=True,
+        help="""File to keep a full-text index of the container's notebooks in, for search();
+':memory:' keeps it in memory, and an empty string turns search off""")
+
+    search_refresh_interval = Float(60.0, config=True,
+        help="""Seconds between checks of the container listing for notebooks changed elsewhere;
+0 lists it only once, at startup""")
+
+    executor_threads = Integer(8, config=True,
+        help="""Threads to run Swift I/O on, away from the server's event loop: for the
+streaming handlers, and for every contents operation in AsyncSwiftContentsManager""")
+
+    stream_save_threshold = Integer(8 * 1024 * 1024, config=True,
+        help="""Notebooks whose JSON is bigger than this many bytes are serialised straight
+into the upload, a chunk at a time, rather than held in memory whole""")
+
     # Initialise the instance
     def __init__(self, *args, **kwargs):
         super(SwiftContentsManager, self).__init__(*args, **kwargs)
-        self.swiftfs = SwiftFS(log=self.log)
+        self.swiftfs = SwiftFS(parent=self, log=self.log)
+        self.blobstore = BlobStore(self.swiftfs, cache_size=self.blob_cache_size)
+        self.notebook_cache = NotebookCache(size=self.notebook_cache_size)
+        # saves, deletes and renames of one path happen one at a time
+        self.path_locks = PathLocks()
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_threads,
+                                           thread_name_prefix='swiftcontents')
+        # see _notary_call
+        self._notary_executor = None
+        self.search_index = None
+        if self.search_index_path:
+            self.search_index = SearchIndex(self.search_index_path)
+        self._search_lock = threading.Lock()
+        # names to reindex, and the thread that does it (see _search_loop)
+        self._search_pending = set()
+        self._search_pending_lock = threading.Lock()
+        self._search_wake = threading.Event()
+        self._search_thread = None
+        if self.swiftfs.refresher is not None:
+            self.swiftfs.refresher.subscribe(self._changed_elsewhere)
+        if self.search_index is not None:
+            self._search_thread = threading.Thread(target=self._search_loop,
+                                                   name='SwiftContentsManager-search',
+                                                   daemon=True)
+            self._search_thread.start()
 
     @LogMethodResults()
     def make_dir(self, path):
@@ -43,9 +130,29 @@ class SwiftContentsManager(ContentsManager):
             type: ['notebook', 'directory', 'file'] specifies what type of object this is
             format: /dunno/
         """
+        return self._get_model(path, content=content, type=type, format=format)
 
+    @LogMethodResults()
+    def save(self, model, path):
+        """Save a file or directory model to path.
+        """
+        return self._save_model(model, path)
+
+    # The work of get() and save(), which the manager's own methods call
+    # rather than the public ones (which are coroutines in the async manager)
+    def _get_model(self, path, content=True, type=None, format=None):
+        # one stat says whether there's a file here, and (from the metadata
+        # it was saved with) what it is: no listing probes.  A stat that
+        # fails is an error, not a missing file
+        headers = None
+        if type != 'directory' and path.strip('/') and not path.endswith('/'):
+            headers = self.swiftfs.stat(path, strict=True)
         if type is None:
-            type = self.swiftfs.guess_type(path)
+            if headers is not None:
+                type = object_meta(headers).get('type') or \
+                    self.swiftfs.guess_type(path, allow_directory=False)
+            else:
+                type = self.swiftfs.guess_type(path)
         if type not in ["directory","notebook","file"]:
             msg = "Unknown type passed: '{}'".format(type)
             self.do_error(msg)
@@ -53,7 +160,7 @@ class SwiftContentsManager(ContentsManager):
         if type == 'directory':
             exists = self.dir_exists(path)
         else:
-            exists = self.file_exists(path)
+            exists = headers is not None
 
         if not exists:
             self.no_such_entity(path)
@@ -61,16 +168,17 @@ class SwiftContentsManager(ContentsManager):
         # construct accessor name from type
         # eg file => _get_file
         func = getattr(self,'_get_'+type)
-        metadata = self.swiftfs.listdir(path)
+        if type == 'directory':
+            metadata = self.swiftfs.listdir(path)
+        else:
+            metadata = ListingRecord.from_headers(path.strip('/'), headers)
 
         # now call the appropriate function, with the parameters given    
         response = func(path=path, content=content, format=format, metadata=metadata)
         return response
 
-    @LogMethodResults()
-    def save(self, model, path):
-        """Save a file or directory model to path.
-        """
+    @holding_paths('path')
+    def _save_model(self, model, path):
         if "type" not in model:
             self.do_error("No model type provided", 400)
         if "content" not in model and model["type"] != "directory":
@@ -92,21 +200,26 @@ class SwiftContentsManager(ContentsManager):
 
         # Read back content to verify save
         self.log.debug("swiftmanager.save getting file to validate: `%s`, `%s`", path, model["type"] )
-        returned_model = self.get(path, type=model["type"], content=False)
+        returned_model = self._get_model(path, type=model["type"], content=False)
         if validation_message is not None:
             returned_model["message"] = validation_message
         return returned_model
 
     @LogMethod()
+    @holding_paths('path')
     def delete_file(self, path):
         """Delete the file or directory at path.
         """
         if self.file_exists(path) or self.dir_exists(path):
             self.swiftfs.rm(path)
+            self.notebook_cache.invalidate_tree(path.strip('/'))
+            if self.search_index is not None:
+                self.search_index.remove_tree(path)
         else:
             self.no_such_entity(path)
 
     @LogMethod()
+    @holding_paths('old_path', 'new_path')
     def rename_file(self, old_path, new_path):
         """Rename a file or directory.
 
@@ -119,9 +232,187 @@ class SwiftContentsManager(ContentsManager):
             self.log.debug("swiftmanager.rename_file: Actually renaming '%s' to '%s'", old_path,
                            new_path)
             self.swiftfs.mv(old_path, new_path)
+            self.notebook_cache.invalidate_tree(old_path.strip('/'))
+            if self.search_index is not None:
+                self.search_index.move(old_path, new_path)
         else:
             self.no_such_entity(old_path)
 
+    @LogMethod()
+    def upload_archive(self, path, archive):
+        """Extract a tar or zip archive (a seekable binary file) into the
+        directory at path, returning that directory's model"""
+        if not self.dir_exists(path):
+            self.no_such_entity(path)
+        written = self.swiftfs.upload_archive(path, archive, metadata=self.directory_metadata)
+        self.notebook_cache.invalidate_tree(path.strip('/'))
+        self._reindex_later(written)
+        return self._get_model(path, content=False)
+
+    # The handlers send files straight from Swift, but a notebook stored
+    # with its outputs as blobs isn't whole until they're put back
+    def open_stream(self, path, start=None, end=None):
+        """SwiftFS.open_stream, giving notebooks with their outputs"""
+        headers, chunks = self.swiftfs.open_stream(path, start, end)
+        if object_meta(headers).get('blobs') != '1':
+            return headers, chunks
+        if 'content-range' in headers:
+            # the range was of the stored notebook: send it all instead
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            headers, chunks = self.swiftfs.open_stream(path)
+        return self._with_outputs(headers, chunks)
+
+    def iter_archive(self, path, fmt='zip'):
+        """SwiftFS.iter_archive, with notebooks archived with their outputs"""
+        return self.swiftfs.iter_archive(path, fmt, resolve=self._with_outputs)
+
+    def _with_outputs(self, headers, chunks):
+        if object_meta(headers).get('blobs') != '1':
+            return headers, chunks
+        nb = json.loads(b''.join(chunks).decode('utf-8'))
+        internalize_outputs(nb, self.blobstore.get)
+        data = json.dumps(nb).encode('utf-8')
+        # what's sent isn't what's stored, so none of its metadata applies
+        headers = dict((k, v) for k, v in headers.items() if not k.startswith(HEADER_PREFIX))
+        headers['content-length'] = str(len(data))
+        return headers, [data]
+
+    # Nothing else deletes blobs (see blobstore.py): run this now and then
+    # to delete those no notebook refers to any more
+    @LogMethod()
+    def sweep_blobs(self):
+        """delete the output blobs no notebook refers to, returning how many were deleted"""
+        with self.swiftfs.limiter.priority(BULK):
+            deleted = self.blobstore.sweep(self._referenced_blobs,
+                                           time.time() - self.blob_sweep_age)
+        return len(deleted)
+
+    def _referenced_blobs(self):
+        names = [record['name'] for record in self.swiftfs.iterlist('')
+                 if self.swiftfs.guess_type(record['name'], allow_directory=False) == 'notebook']
+        keys = set()
+        # any failure here is raised, so nothing is deleted on a partial list
+        for name, headers in zip(names, self.swiftfs.stat_many(names, strict=True)):
+            if headers is None or object_meta(headers).get('blobs') != '1':
+                continue
+            try:
+                keys.update(blob_refs(json.loads(self.swiftfs.read(name))))
+            except NoSuchFile:
+                continue
+        return keys
+
+    def _changed_elsewhere(self, names):
+        """the listing refresher found names changed by something other than this server"""
+        for name in names:
+            self.notebook_cache.invalidate(name)
+        self._reindex_later(names)
+
+    @LogMethod()
+    def search(self, query, path='', limit=50):
+        """Find the notebooks under path with every word of query in their
+        cells or name (and other files, by name), best match first.
+
+        Returns a list of {'path', 'name', 'type', 'snippet'}
+        """
+        if self.search_index is None:
+            self.do_error("search is not enabled", 404)
+        return [{'path': found, 'name': found.rsplit('/', 1)[-1],
+                 'type': self.swiftfs.guess_type(found, allow_directory=False),
+                 'snippet': snippet}
+                for found, snippet in self.search_index.search(query, path, limit)]
+
+    # Searches are answered from the index alone.  Changes made through this
+    # server update it as they happen, names the listing refresher reports
+    # are reindexed by a background thread, and the same thread lists the
+    # container every search_refresh_interval to catch the rest.
+    def _reindex_later(self, names):
+        if self.search_index is None or not names:
+            return
+        with self._search_pending_lock:
+            self._search_pending.update(name.strip('/') for name in names)
+        self._search_wake.set()
+
+    def _search_loop(self):
+        last_scan = None
+        while True:
+            self._search_wake.clear()
+            try:
+                interval = self.search_refresh_interval
+                if last_scan is None or (interval > 0 and time.monotonic() - last_scan >= interval):
+                    self.refresh_search_index()
+                    last_scan = time.monotonic()
+                with self._search_pending_lock:
+                    names, self._search_pending = self._search_pending, set()
+                if names:
+                    self.reindex(names)
+            except Exception as e:
+                self.log.warning("swiftmanager: search index update failed: %s", e)
+            # until the first listing succeeds, retry it at least every minute
+            timeout = self.search_refresh_interval or None
+            if last_scan is None:
+                timeout = min(timeout or 60.0, 60.0)
+            self._search_wake.wait(timeout)
+
+    # reindexing is bulk work, behind the requests of anyone using the server
+    # Priority is per thread, so each of the pool's threads does all its
+    # work for the index at BULK priority
+    def _reindex(self, stale):
+        def reindex(entry):
+            with self.swiftfs.limiter.priority(BULK):
+                index(*entry)
+
+        def index(name, etag):
+            if self.swiftfs.guess_type(name, allow_directory=False) != 'notebook':
+                self.search_index.update(name, etag)
+                return
+            try:
+                text = notebook_text(self.swiftfs.read(name))
+            except NoSuchFile:
+                self.search_index.remove([name])
+                return
+            except HTTPError as e:
+                # keep the old ETag, so it's tried again
+                self.log.warning("swiftmanager: could not index %s: %s", name, e)
+                return
+            self.search_index.update(name, etag, text)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(reindex, stale))
+
+    @LogMethod()
+    def reindex(self, names):
+        """bring the index up to date for the objects named"""
+        names = [name.strip('/') for name in names if not name.endswith('/')]
+        with self._search_lock:
+            indexed = self.search_index.etags()
+            with self.swiftfs.limiter.priority(BULK):
+                found = self.swiftfs.stat_many(names)
+            gone = [name for name, headers in zip(names, found) if headers is None]
+            self.search_index.remove(gone)
+            self._reindex([(name, headers.get('etag'))
+                           for name, headers in zip(names, found)
+                           if headers is not None and indexed.get(name) != headers.get('etag')])
+
+    @LogMethod()
+    def refresh_search_index(self):
+        """bring the whole index up to date from a listing of the container"""
+        with self._search_lock:
+            indexed = self.search_index.etags()
+            listed, stale = set(), []
+            with self.swiftfs.limiter.priority(BULK):
+                for record in self.swiftfs.iterlist(''):
+                    name = record['name']
+                    if name.endswith('/'):
+                        continue
+                    listed.add(name)
+                    if indexed.get(name) != record.get('hash'):
+                        stale.append((name, record.get('hash')))
+            self.search_index.remove([name for name in indexed if name not in listed])
+            self._reindex(stale)
+            self.log.debug("swiftmanager.refresh_search_index: %d listed, %d reindexed",
+                           len(listed), len(stale))
+
     @LogMethodResults()
     def file_exists(self, path):
         return self.swiftfs.isfile(path)
@@ -130,6 +421,38 @@ class SwiftContentsManager(ContentsManager):
     def dir_exists(self, path):
         return self.swiftfs.isdir(path)
 
+    # The notary keeps its signatures in SQLite, which can only be used from
+    # the thread that opened it: with the executor, all of its work is done
+    # on a thread of its own
+    def _notary_call(self, fn, *args):
+        if self._notary_executor is None or \
+                threading.current_thread().name.startswith('swiftcontents-notary'):
+            return fn(*args)
+        return self._notary_executor.submit(fn, *args).result()
+
+    def _mark_signed_cells(self, nb):
+        self.notary.mark_cells(nb, self.notary.check_signature(nb))
+
+    def check_and_sign(self, nb, path=''):
+        self._notary_call(super(SwiftContentsManager, self).check_and_sign, nb, path)
+
+    def mark_trusted_cells(self, nb, path=''):
+        self._notary_call(super(SwiftContentsManager, self).mark_trusted_cells, nb, path)
+
+    # Trusting a notebook changes the notary's verdict, but not the object,
+    # so the cached (trust-marked) notebook has to go
+    @LogMethod()
+    def trust_notebook(self, path):
+        self._trust_notebook(path)
+
+    def _trust_notebook(self, path):
+        model = self._get_model(path)
+        nb = model['content']
+        self.log.warning("Trusting notebook %s", path)
+        self._notary_call(self.notary.mark_cells, nb, True)
+        self.check_and_sign(nb, path)
+        self.notebook_cache.invalidate(path.strip('/'))
+
     # Swift doesn't do "hidden" files, so this always returns False
     @LogMethodResults()
     def is_hidden(self, path):
@@ -197,18 +520,34 @@ class SwiftContentsManager(ContentsManager):
         if isinstance(metadata,list):
             metadata = metadata[0]
         if 'last_modified' in metadata :
-            model['last_modified'] = model['created'] = parse(metadata['last_modified'])
+            model['last_modified'] = model['created'] = parse_timestamp(metadata['last_modified'])
         else:
             model['last_modified'] = model['created'] = DUMMY_CREATED_DATE
         if content:
-            if not self.swiftfs.isfile(path):
+            # an unchanged notebook needs no download, parse or validation
+            etag = metadata.get('hash')
+            cached = self.notebook_cache.get(path.strip('/'), etag) if etag else None
+            if cached is not None:
+                model["format"] = "json"
+                model["content"], message = cached
+                if message is not None:
+                    model["message"] = message
+                return model
+            # metadata from a stat (see get) has already shown the file exists
+            meta = metadata.get('meta')
+            if meta is None and not self.swiftfs.isfile(path):
                 self.no_such_entity(path)
-            file_content = self.swiftfs.read(path)
-            nb_content = reads(file_content, as_version=NBFORMAT_VERSION)
+            file_content = self.swiftfs.read(path, etag=etag)
+            nb_content = self._reads_notebook(file_content)
             self.mark_trusted_cells(nb_content, path)
             model["format"] = "json"
             model["content"] = nb_content
-            self.validate_notebook_model(model)
+            # a notebook this server saved as valid is still valid at the
+            # same ETag; the 'valid' metadata is only a record, as anything
+            # that can write to the container can set it
+            if not self.notebook_cache.known_valid(path.strip('/'), etag):
+                self.validate_notebook_model(model)
+            self.notebook_cache.put(path.strip('/'), etag, nb_content, model.get("message"))
         return model
 
     @LogMethodResults()
@@ -222,17 +561,18 @@ class SwiftContentsManager(ContentsManager):
         if isinstance(metadata,list):
             metadata = metadata[0]
         if 'last_modified' in metadata :
-            model['last_modified'] = model['created'] = parse(metadata['last_modified'])
+            model['last_modified'] = model['created'] = parse_timestamp(metadata['last_modified'])
         else:
             model['last_modified'] = model['created'] = DUMMY_CREATED_DATE
         if content:
             try:
-                content = self.swiftfs.read(path)
+                content = self.swiftfs.read(path, etag=metadata.get('hash'))
             except NoSuchFile as e:
                 self.no_such_entity(e.path)
             except SwiftFSError as e:
                 self.do_error(str(e), 500)
-            model["format"] = format or "text"
+            # the content is as it was saved: text, or base64 encoded text
+            model["format"] = format or (metadata.get('meta') or {}).get('format') or "text"
             model["content"] = content
             model["mimetype"] = mimetypes.guess_type(path)[0] or "text/plain"
             if format == "base64":
@@ -243,46 +583,114 @@ class SwiftContentsManager(ContentsManager):
     @LogMethodResults()
     def _convert_file_records(self, records):
         """
-        Applies _notebook_model_from_swift_path or _file_model_from_swift_path to each entry of `paths`,
-        depending on the result of `guess_type`.
+        Builds the content-less model of each entry of `records` (as
+        _notebook_model_from_path, _file_model_from_path or
+        _directory_model_from_path would), depending on the result of `guess_type`.
         """
         ret = []
+        stats = {}
+        if self.directory_metadata:
+            files = [r['name'] for r in records if not r['name'].endswith('/')]
+            stats = dict(zip(files, self.swiftfs.stat_many(files)))
         for r in records:
-            self.log.debug("swiftmanager._convert_file_records iterating: '%s'" % r)
+            self.log.debug("swiftmanager._convert_file_records iterating: '%s'", r)
             type_ = ""
 
-            # Each record is a dictionary thus:
+            # Each record is a ListingRecord (or a dictionary) thus:
             # {'hash': 'd41d8cd98f00b204e9800998ecf8427e', 'bytes': 0, 'last_modified': '2017-05-31T09:20:22.224Z', 'name': 'foo/file.txt'}
             # in which case, we 
             if not isinstance(r, str):
                 path = r['name']
 
-            type_ = self.swiftfs.guess_type( path )
-
-            self.log.debug("swiftmanager._convert_file_records type is: '%s' [ %s]" % (type_, r) )
-            if type_ == "notebook":
-                ret.append(self._notebook_model_from_path(path, content=False, metadata=r))
-            elif type_ == "file":
-                ret.append(self._file_model_from_path(path, content=False, metadata=r))
-            elif type_ == "directory":
-                ret.append(self._directory_model_from_path(path, content=False, metadata=r))
+            # a listing only holds directories as markers (with a trailing
+            # slash), so the name alone gives the type: no need to ask swift,
+            # unless it was saved with its type in its metadata
+            headers = stats.get(path)
+            meta = object_meta(headers)
+            type_ = meta.get('type') or \
+                self.swiftfs.guess_type( path, allow_directory=path.endswith('/') )
+
+            self.log.debug("swiftmanager._convert_file_records type is: '%s' [ %s]", type_, r)
+            # the content=False models of _notebook_model_from_path and
+            # friends, built directly: a big directory has a lot of these
+            if type_ == "directory":
+                model = base_directory_model(path)
+            elif type_ in ("notebook", "file"):
+                model = base_model(path)
+                model['type'] = type_
+                last_modified = r.get('last_modified')
+                if last_modified:
+                    model['last_modified'] = model['created'] = parse_timestamp(last_modified)
+                else:
+                    model['last_modified'] = model['created'] = DUMMY_CREATED_DATE
             else:
                 self.do_error("Unknown file type %s for file '%s'" % (type_, path), 500)
+            if headers:
+                # the size before any compression, if it was recorded
+                model['size'] = int(meta.get('size') or headers.get('content-length', r.get('bytes', 0)))
+                if type_ == "file":
+                    model['mimetype'] = headers.get('content-type')
+            ret.append(model)
         return ret
 
+    def _reads_notebook(self, file_content):
+        """reads(file_content), with any externalized outputs put back first"""
+        nb = json.loads(file_content)
+        major = nb.get('nbformat') if isinstance(nb, dict) else None
+        if major not in versions:
+            # let nbformat report what's wrong with it
+            return reads(file_content, as_version=NBFORMAT_VERSION)
+        if has_blobs(nb):
+            internalize_outputs(nb, self.blobstore.get)
+        nb = versions[major].to_notebook_json(nb, minor=nb.get('nbformat_minor', 0))
+        return convert(nb, NBFORMAT_VERSION)
+
     @LogMethodResults()
     def _save_notebook(self, model, path):
         nb_contents = from_dict(model['content'])
         self.check_and_sign(nb_contents, path)
-        file_contents = json.dumps(model["content"])
-        self.swiftfs.write(path, file_contents)
+        stored, blobs = model["content"], None
+        if self.externalize_outputs:
+            stored, blobs = externalize_outputs(stored, self.output_blob_threshold)
+            self.blobstore.put(blobs)
         self.validate_notebook_model(model)
+        meta = {'nbformat': '%s.%s' % (nb_contents.get('nbformat'), nb_contents.get('nbformat_minor')),
+                'valid': '0' if 'message' in model else '1',
+                'blobs': '1' if blobs else None}
+        # serialise until it's clear whether the notebook is big enough to stream
+        chunks = json_chunks(stored)
+        head, size = [], 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size > self.stream_save_threshold:
+                break
+        if size > self.stream_save_threshold:
+            # json_chunks gives the same bytes every time, so a first pass
+            # finds what's to be stored, and an unchanged notebook isn't
+            # uploaded again
+            measured = Measured(itertools.chain(head, chunks))
+            for chunk in measured:
+                pass
+            etag = self.swiftfs.write_stream(path, json_chunks(stored), meta=meta,
+                                             digest=(measured.size, measured.hexdigest()))
+        else:
+            etag = self.swiftfs.write(path, b''.join(head).decode('utf-8'), meta=meta)
+        # the next open of this notebook can come straight from the cache
+        self._notary_call(self._mark_signed_cells, nb_contents)
+        self.notebook_cache.put(path.strip('/'), etag, nb_contents, model.get("message"))
+        if 'message' not in model:
+            self.notebook_cache.mark_valid(path.strip('/'), etag)
+        if self.search_index is not None:
+            self.search_index.update(path, etag, notebook_text(stored))
         return model.get("message")
 
     @LogMethod()
     def _save_file(self, model, path):
         file_contents = model["content"]
-        self.swiftfs.write(path, file_contents)
+        etag = self.swiftfs.write(path, file_contents, meta={'format': model.get('format') or 'text'})
+        if self.search_index is not None:
+            self.search_index.update(path, etag)
 
     @LogMethod()
     def _save_directory(self, path):
@@ -309,6 +717,7 @@ class SwiftContentsManager(ContentsManager):
                 continue
         return current_dir
 
+
 @LogMethod()
 def base_model(path):
     p = path.split('/')
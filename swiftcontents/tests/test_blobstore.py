@@ -0,0 +1,53 @@
+import copy
+import json
+import logging
+from nose.tools import assert_equals, assert_true, assert_false
+from swiftcontents.blobstore import externalize_outputs, internalize_outputs, has_blobs, blob_refs
+
+log = logging.getLogger('TestBlobStore')
+
+testImage = 'iVBORw0KGgo' * 4096
+testNotebookContent = {"metadata": {},
+                       "nbformat_minor": 2,
+                       "nbformat": 4,
+                       "cells": [{"cell_type": "code",
+                                  "execution_count": 1,
+                                  "metadata": {},
+                                  "source": "plot()",
+                                  "outputs": [{"output_type": "display_data",
+                                               "metadata": {},
+                                               "data": {"image/png": testImage,
+                                                        "text/plain": ["<Figure>"]}}]}]}
+
+
+class Test_BlobStore(object):
+
+    def test_small_outputs_stay_inline(self):
+        log.info('test outputs below the threshold are not externalized')
+        stub, blobs = externalize_outputs(testNotebookContent, len(testImage) + 1)
+        assert_equals(blobs, {})
+        assert_false(has_blobs(stub))
+
+    def test_externalize_leaves_model_alone(self):
+        log.info('test externalizing does not modify the notebook passed in')
+        nb = copy.deepcopy(testNotebookContent)
+        stub, blobs = externalize_outputs(nb, 1024)
+        assert_equals(nb, testNotebookContent)
+        assert_equals(len(blobs), 1)
+        assert_true(has_blobs(stub))
+        assert_true(len(json.dumps(stub)) < 1024)
+
+    def test_round_trip(self):
+        log.info('test a stored notebook reassembles to the original')
+        stub, blobs = externalize_outputs(testNotebookContent, 1024)
+        stored = json.loads(json.dumps(stub))
+        assert_equals(blob_refs(stored), set(blobs))
+        fetched = []
+
+        def fetch(keys):
+            fetched.extend(keys)
+            return dict((k, blobs[k]) for k in keys)
+
+        nb = internalize_outputs(stored, fetch)
+        assert_equals(nb, testNotebookContent)
+        assert_equals(sorted(fetched), sorted(blobs))
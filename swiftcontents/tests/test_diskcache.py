@@ -0,0 +1,50 @@
+import os
+import logging
+from tempfile import TemporaryDirectory
+from nose.tools import assert_equals, assert_true, assert_is_none
+from swiftcontents.diskcache import DiskCache
+
+log = logging.getLogger('TestDiskCache')
+
+testContainer = 'testing'
+testFileName = 'temp/hello.txt'
+testFileContent = b'Hello world'
+
+
+class Test_DiskCache(object):
+
+    def setup(self):
+        self._temp_dir = TemporaryDirectory()
+        self.cache = DiskCache(self._temp_dir.name, max_bytes=64)
+
+    def teardown(self):
+        self._temp_dir.cleanup()
+
+    def test_get_by_etag(self):
+        log.info('test a cached object is only returned for its etag')
+        self.cache.put(testContainer, testFileName, 'etag1', testFileContent)
+        assert_equals(self.cache.get(testContainer, testFileName, 'etag1'), testFileContent)
+        assert_is_none(self.cache.get(testContainer, testFileName, 'etag2'))
+        assert_equals(self.cache.etag(testContainer, testFileName), 'etag1')
+
+    def test_survives_restart(self):
+        log.info('test the cache is reloaded from disk')
+        self.cache.put(testContainer, testFileName, 'etag1', testFileContent)
+        cache = DiskCache(self._temp_dir.name, max_bytes=64)
+        assert_equals(cache.get(testContainer, testFileName, 'etag1'), testFileContent)
+
+    def test_eviction(self):
+        log.info('test the least recently used objects are evicted')
+        for i in range(4):
+            self.cache.put(testContainer, 'file%d' % i, 'etag', b'x' * 20)
+            self.cache.get(testContainer, 'file0', 'etag')
+        assert_equals(self.cache.get(testContainer, 'file0', 'etag'), b'x' * 20)
+        assert_is_none(self.cache.get(testContainer, 'file1', 'etag'))
+        assert_true(self.cache._bytes <= 64)
+
+    def test_crash_leftovers_ignored(self):
+        log.info('test a body without its metadata is not used')
+        self.cache.put(testContainer, testFileName, 'etag1', testFileContent)
+        os.remove(self.cache._paths(self.cache._key(testContainer, testFileName))[1])
+        cache = DiskCache(self._temp_dir.name, max_bytes=64)
+        assert_is_none(cache.etag(testContainer, testFileName))
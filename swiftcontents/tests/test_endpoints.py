@@ -0,0 +1,58 @@
+import time
+import socket
+import logging
+from nose.tools import assert_equals, assert_true, assert_false, assert_raises
+from requests.exceptions import ConnectionError, ReadTimeout
+from swiftclient.exceptions import ClientException
+from swiftclient.service import SwiftError
+from swiftcontents.endpoints import EndpointSelector, is_endpoint_failure
+
+log = logging.getLogger('TestEndpoints')
+
+testEndpoints = ['https://proxy1.example.com/v1/AUTH_test',
+                 'https://proxy2.example.com/v1/AUTH_test',
+                 'https://proxy3.example.com/v1/AUTH_test']
+
+
+class Test_Endpoints(object):
+
+    def test_failures(self):
+        log.info('test which errors are worth trying another endpoint for')
+        assert_true(is_endpoint_failure(ConnectionError('refused')))
+        assert_true(is_endpoint_failure(ReadTimeout('timed out')))
+        assert_true(is_endpoint_failure(socket.timeout('timed out')))
+        assert_true(is_endpoint_failure(SwiftError('failed', exc=ConnectionError('refused'))))
+        assert_true(is_endpoint_failure(ClientException('unavailable', http_status=503)))
+        assert_true(is_endpoint_failure(ClientException('slow down', http_status=429)))
+        assert_false(is_endpoint_failure(ClientException('not found', http_status=404)))
+        assert_false(is_endpoint_failure(ClientException('Authorization Failure')))
+        assert_false(is_endpoint_failure(TypeError('a bug')))
+        assert_false(is_endpoint_failure(KeyError('etag')))
+
+    def test_every_endpoint_is_a_candidate(self):
+        log.info('test every endpoint is tried once, for failover')
+        endpoints = EndpointSelector(testEndpoints)
+        assert_equals(sorted(endpoints.candidates()), sorted(testEndpoints))
+        assert_raises(ValueError, EndpointSelector, [])
+
+    def test_spread_and_avoid_degraded(self):
+        log.info('test requests spread over healthy endpoints, avoiding a slow one')
+        endpoints = EndpointSelector(testEndpoints)
+        for url in testEndpoints:
+            endpoints.record(url, 0.5 if url == testEndpoints[2] else 0.01)
+        endpoints.record(testEndpoints[2], 0.5, ok=False)
+        chosen = [endpoints.best() for i in range(200)]
+        assert_false(testEndpoints[2] in chosen)
+        assert_true(testEndpoints[0] in chosen and testEndpoints[1] in chosen)
+        assert_equals(endpoints.candidates()[-1], testEndpoints[2])
+        assert_equals(endpoints.metrics()[testEndpoints[2]]['failures'], 1)
+
+    def test_probe_recovered(self):
+        log.info('test an endpoint unused for a while is tried again')
+        endpoints = EndpointSelector(testEndpoints[:2], probe_interval=0.05)
+        endpoints.record(testEndpoints[0], 0.01)
+        endpoints.record(testEndpoints[1], 5.0, ok=False)
+        assert_equals(endpoints.best(), testEndpoints[0])
+        time.sleep(0.1)
+        endpoints.record(testEndpoints[0], 0.01)
+        assert_equals(endpoints.best(), testEndpoints[1])
@@ -0,0 +1,31 @@
+import sys
+import logging
+import subprocess
+from nose.tools import assert_equals
+
+log = logging.getLogger('TestImports')
+
+
+def loaded_after(statement, modules):
+    """which of modules a fresh interpreter has loaded after running statement"""
+    code = '%s\nimport sys\nprint(" ".join(m for m in %r if m in sys.modules))' % (statement, modules)
+    out = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    return out.split()
+
+
+class Test_Imports(object):
+
+    def test_no_test_modules(self):
+        log.info('test importing the manager does not load test-only modules')
+        assert_equals(loaded_after('import swiftcontents.swiftmanager',
+                                   ['notebook.services.contents.tests.test_manager',
+                                    'notebook.services.contents.tests.test_contents_api',
+                                    'notebook.services.contents.filemanager',
+                                    'keystoneauth1.identity.v3',
+                                    'jupyter_server.services.contents.manager']), [])
+
+    def test_swiftfs_alone(self):
+        log.info('test importing swiftfs does not load the notebook server')
+        assert_equals(loaded_after('import swiftcontents.swiftfs',
+                                   ['swiftcontents.swiftmanager',
+                                    'notebook.services.contents.manager']), [])
@@ -0,0 +1,36 @@
+import logging
+from datetime import datetime, timezone
+from nose.tools import assert_equals, assert_raises, assert_true, assert_false
+from swiftcontents.listing import ListingRecord, parse_timestamp
+
+log = logging.getLogger('TestListing')
+
+testRecord = {'hash': 'd41d8cd98f00b204e9800998ecf8427e', 'bytes': 0,
+              'last_modified': '2017-05-31T09:20:22.224000', 'name': 'foo/file.txt',
+              'content_type': 'text/plain'}
+
+
+class Test_Listing(object):
+
+    def test_parse_timestamp(self):
+        log.info('test parsing the timestamps swift gives')
+        assert_equals(parse_timestamp('2017-05-31T09:20:22.224000'),
+                      datetime(2017, 5, 31, 9, 20, 22, 224000))
+        assert_equals(parse_timestamp('2017-05-31T09:20:22.224Z'),
+                      datetime(2017, 5, 31, 9, 20, 22, 224000, tzinfo=timezone.utc))
+        log.info('test other formats fall back to the general parser')
+        assert_equals(parse_timestamp('31 May 2017 09:20:22'),
+                      datetime(2017, 5, 31, 9, 20, 22))
+
+    def test_record_as_dict(self):
+        log.info('test a listing record reads like the dict it came from')
+        r = ListingRecord.from_dict(testRecord)
+        assert_equals(r['name'], testRecord['name'])
+        assert_equals(r.get('hash'), testRecord['hash'])
+        assert_true('last_modified' in r)
+        assert_false('subdir' in r)
+        assert_equals(r.get('subdir', 'x'), 'x')
+        assert_raises(KeyError, lambda: r['subdir'])
+        assert_equals(r.to_dict(), testRecord)
+        assert_equals(r, testRecord)
+        assert_equals(r.modified(), datetime(2017, 5, 31, 9, 20, 22, 224000))
@@ -0,0 +1,64 @@
+import time
+import logging
+import threading
+from nose.tools import assert_equals, assert_true, assert_less
+from swiftcontents.ratelimit import RateLimiter, INTERACTIVE, BULK
+
+log = logging.getLogger('TestRateLimiter')
+
+
+class Test_RateLimiter(object):
+
+    def test_unlimited(self):
+        log.info('test kinds without a rate never wait')
+        limiter = RateLimiter({'read': 10})
+        assert_equals(limiter.acquire('list', 1000), 0.0)
+        assert_equals(list(limiter.metrics()), ['read'])
+
+    def test_rate(self):
+        log.info('test a burst goes straight through, then requests wait for tokens')
+        limiter = RateLimiter({'stat': 100}, burst=0.1)
+        start = time.monotonic()
+        for i in range(10):
+            limiter.acquire('stat')
+        assert_less(time.monotonic() - start, 0.05)
+        limiter.acquire('stat', 5)
+        assert_true(time.monotonic() - start >= 0.04)
+        metrics = limiter.metrics()['stat']
+        assert_equals(metrics['requests'], 15)
+        assert_equals(metrics['waited'], 1)
+        assert_equals(metrics['queued'], 0)
+
+    def test_priority(self):
+        log.info('test interactive requests go ahead of bulk ones')
+        limiter = RateLimiter({'read': 20}, burst=0.05)
+        limiter.acquire('read')
+        order = []
+
+        def request(level, name):
+            with limiter.priority(level):
+                limiter.acquire('read')
+            order.append(name)
+        bulk = [threading.Thread(target=request, args=(BULK, 'bulk%d' % i)) for i in range(3)]
+        for t in bulk:
+            t.start()
+        while limiter.metrics()['read']['queued'] < 3:
+            time.sleep(0.001)
+        interactive = threading.Thread(target=request, args=(INTERACTIVE, 'interactive'))
+        interactive.start()
+        for t in bulk + [interactive]:
+            t.join()
+        assert_true(order.index('interactive') < 2)
+        assert_equals(limiter.metrics()['read']['max_queued'], 4)
+
+    def test_throttled(self):
+        log.info('test a refusal slows the rate, which then recovers')
+        limiter = RateLimiter({'list': 100}, recovery=0.2)
+        limiter.throttled('list')
+        limiter.throttled('list')
+        metrics = limiter.metrics()['list']
+        assert_true(metrics['rate'] <= 25.5)
+        assert_equals(metrics['throttled'], 2)
+        time.sleep(0.25)
+        limiter.acquire('list')
+        assert_equals(limiter.metrics()['list']['rate'], 100)
@@ -0,0 +1,87 @@
+import time
+import logging
+from datetime import datetime, timezone
+from nose.tools import assert_equals, assert_true, assert_false
+from swiftcontents.refresher import ListingRefresher
+
+log = logging.getLogger('TestRefresher')
+
+
+def record(name, etag, age=0):
+    modified = datetime.fromtimestamp(time.time() - age, timezone.utc)
+    return {'name': name, 'hash': etag, 'last_modified': modified.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+
+
+class Test_Refresher(object):
+
+    def setUp(self):
+        self.listings = {'a/': [record('a/one', '1'), record('a/two', '2')]}
+        self.listed = []
+        self.published = []
+        self.refresher = ListingRefresher(self.lister, interval=0)
+        self.refresher.subscribe(self.published.extend)
+
+    def lister(self, path):
+        self.listed.append(path)
+        return list(self.listings[path])
+
+    def test_publishes_changes(self):
+        log.info('test a re-listing publishes what was added, changed and removed')
+        self.refresher.put('a/', self.lister('a/'), self.refresher.generation())
+        self.listings['a/'] = [record('a/one', '1b'), record('a/three', '3')]
+        assert_equals(sorted(self.refresher.refresh()), ['a/one', 'a/three', 'a/two'])
+        assert_equals(sorted(self.published), ['a/one', 'a/three', 'a/two'])
+        assert_equals([r['name'] for r in self.refresher.get('a/')], ['a/one', 'a/three'])
+        assert_equals(self.refresher.refresh(), [])
+
+    def test_invalidate(self):
+        log.info('test a listing fetched across an invalidation is not kept')
+        generation = self.refresher.generation()
+        records = self.lister('a/')
+        self.refresher.invalidate('a/')
+        self.refresher.put('a/', records, generation)
+        assert_equals(self.refresher.get('a/'), None)
+        self.refresher.put('a/', records, self.refresher.generation())
+        self.refresher.invalidate('', recursive=True)
+        assert_equals(self.refresher.get('a/'), None)
+        log.info('test invalidating other directories does not stop a listing being kept')
+        generation = self.refresher.generation()
+        self.refresher.invalidate('b/')
+        self.refresher.invalidate('a/b/', recursive=True)
+        self.refresher.put('a/', records, generation)
+        assert_equals(len(self.refresher.get('a/')), 2)
+        self.refresher.invalidate('a/')
+        generation = self.refresher.generation()
+        self.refresher.invalidate('', recursive=True)
+        self.refresher.put('a/', records, generation)
+        assert_equals(self.refresher.get('a/'), None)
+
+    def test_invalidated_while_listing(self):
+        log.info('test an invalidation during a refresh only affects its own path')
+        self.listings['b/'] = [record('b/one', '1')]
+        for path in ['a/', 'b/']:
+            self.refresher.put(path, self.lister(path), self.refresher.generation())
+        self.listings['a/'] = [record('a/one', '1b')]
+        self.listings['b/'] = [record('b/one', '1b')]
+        lister = self.refresher.lister
+
+        def invalidating(path):
+            if path == 'a/':
+                self.refresher.invalidate('a/')
+            return lister(path)
+        self.refresher.lister = invalidating
+        assert_equals(sorted(self.refresher.refresh()), ['a/one', 'a/two', 'b/one'])
+        assert_equals(self.refresher.get('a/'), None)
+        assert_equals([r['hash'] for r in self.refresher.get('b/')], ['1b'])
+
+    def test_backs_off_and_forgets(self):
+        log.info('test quiet directories are re-listed less often, and cold ones forgotten')
+        self.listings['a/'] = [record('a/one', '1', age=3600)]
+        self.refresher.interval = 1
+        self.refresher.put('a/', self.lister('a/'), self.refresher.generation())
+        self.listed = []
+        self.refresher.refresh()
+        assert_equals(self.listed, [])
+        self.refresher.hot_seconds = 0
+        self.refresher.refresh()
+        assert_equals(self.refresher.get('a/'), None)
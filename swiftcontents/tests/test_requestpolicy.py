@@ -0,0 +1,82 @@
+import time
+import logging
+import threading
+from nose.tools import assert_equals, assert_raises, assert_true
+from swiftclient.exceptions import ClientException
+from swiftcontents.requestpolicy import RequestPolicy
+
+log = logging.getLogger('TestRequestPolicy')
+
+
+class Test_RequestPolicy(object):
+
+    def test_retry_on_503(self):
+        log.info('test requests refused with 503 are retried')
+        policy = RequestPolicy(backoff=0.001)
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ClientException('unavailable', http_status=503)
+            return 'ok'
+
+        assert_equals(policy.call('read', flaky), 'ok')
+        assert_equals(policy.metrics()['read']['retries'], 2)
+
+    def test_no_retry_on_404(self):
+        log.info('test other errors are not retried')
+        policy = RequestPolicy(backoff=0.001)
+
+        def missing():
+            raise ClientException('not found', http_status=404)
+
+        assert_raises(ClientException, policy.call, 'read', missing)
+        assert_equals(policy.metrics()['read']['retries'], 0)
+
+    def test_hedge_slow_request(self):
+        log.info('test a slow request is hedged and the fast answer used')
+        policy = RequestPolicy(hedge_min_delay=0.01)
+        for i in range(policy.min_samples):
+            policy._record('list', 0.001)
+        first = threading.Event()
+
+        def sometimes_slow():
+            if not first.is_set():
+                first.set()
+                time.sleep(1)
+                return 'slow'
+            return 'fast'
+
+        start = time.monotonic()
+        assert_equals(policy.call('list', sometimes_slow), 'fast')
+        assert_true(time.monotonic() - start < 0.5)
+        assert_equals(policy.metrics()['list']['hedge_wins'], 1)
+
+    def test_deadline(self):
+        log.info('test a request past its deadline fails')
+        policy = RequestPolicy(hedge=False, deadlines={'stat': 0.05})
+        assert_raises(Exception, policy.call, 'stat', lambda: time.sleep(0.5))
+        assert_equals(policy.metrics()['stat']['deadline_exceeded'], 1)
+
+    def test_before_every_attempt(self):
+        log.info('test before() is called on the calling thread ahead of each attempt')
+        policy = RequestPolicy(backoff=0.001,
+                               failover=lambda e: _status(e) == 502)
+        statuses = [503, 502]
+        befores = []
+
+        def flaky():
+            if statuses:
+                raise ClientException('failed', http_status=statuses.pop(0))
+            return 'ok'
+
+        before = lambda: befores.append(threading.current_thread())
+        assert_equals(policy.call('read', flaky, before=before), 'ok')
+        # the first attempt, its retry and that retry's failover
+        assert_equals(befores, [threading.current_thread()] * 3)
+        assert_equals(policy.metrics()['read']['retries'], 1)
+
+
+def _status(e):
+    return getattr(e, 'http_status', None)
@@ -0,0 +1,55 @@
+import logging
+import threading
+from nose.tools import assert_equals, assert_raises
+from swiftcontents.singleflight import SingleFlight
+
+log = logging.getLogger('TestSingleFlight')
+
+
+class Test_SingleFlight(object):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow(self, result):
+        self.calls.append(result)
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_together(self, key, result, n=4):
+        results = []
+
+        def call():
+            try:
+                results.append(self.flights.do(key, lambda: self.slow(result)))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=call) for i in range(n)]
+        for t in threads:
+            t.start()
+        while self.flights.metrics()['shared'] < n - 1:
+            threading.Event().wait(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_shared(self):
+        log.info('test concurrent calls for one key make one request')
+        assert_equals(self.run_together('a', 42), [42] * 4)
+        assert_equals(self.calls, [42])
+        assert_equals(self.flights.metrics(), {'requests': 1, 'shared': 3})
+        log.info('test a later call makes a new request')
+        assert_equals(self.flights.do('a', lambda: self.slow(43)), 43)
+        assert_equals(len(self.calls), 2)
+
+    def test_error_shared(self):
+        log.info('test every caller sees the error')
+        error = ValueError('failed')
+        assert_equals(self.run_together('b', error), [error] * 4)
+        assert_equals(self.calls, [error])
+        assert_raises(KeyError, self.flights.do, 'b', lambda: {}['x'])
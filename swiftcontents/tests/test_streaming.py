@@ -0,0 +1,52 @@
+import json
+import hashlib
+import logging
+from nose.tools import assert_equals, assert_true
+from swiftcontents.streaming import as_chunks, json_chunks, Measured, ChunkReader
+
+log = logging.getLogger('TestStreaming')
+
+notebook = {'cells': [{'cell_type': 'code', 'source': ['print("héllo")\n', 'x'],
+                       'metadata': {}, 'execution_count': 1,
+                       'outputs': [{'output_type': 'stream', 'text': ['x' * 5000]},
+                                   {'data': {'image/png': 'iVBOR' * 2000}, 'metadata': {}}]},
+                      {'cell_type': 'markdown', 'source': '', 'metadata': {'tags': []}}],
+            'metadata': {'kernelspec': {'name': 'python3'}, 'empty': {}},
+            'nbformat': 4, 'nbformat_minor': 2}
+
+
+class Test_Streaming(object):
+
+    def test_json_chunks(self):
+        log.info('test the chunks are json.dumps, in pieces')
+        chunks = list(json_chunks(notebook, chunk_size=1000))
+        assert_true(len(chunks) > 2)
+        assert_equals(b''.join(chunks), json.dumps(notebook).encode('utf-8'))
+        for obj in [[], {}, 'text', None, [1, [2, {}]], {1: 'a'}]:
+            assert_equals(b''.join(json_chunks(obj)), json.dumps(obj).encode('utf-8'))
+
+    def test_as_chunks(self):
+        log.info('test bytes are cut into views, not copies')
+        data = bytearray(b'0123456789' * 10)
+        chunks = list(as_chunks(data, chunk_size=32))
+        assert_equals([len(c) for c in chunks], [32, 32, 32, 4])
+        data[0:1] = b'x'
+        assert_equals(bytes(chunks[0][:1]), b'x')
+
+    def test_reader(self):
+        log.info('test reading chunks back, whatever the read size')
+        measured = Measured(iter([b'abc', memoryview(b'defgh'), b'', bytearray(b'ij')]))
+        reader = ChunkReader(measured)
+        pieces = []
+        while True:
+            piece = reader.read(4)
+            if not piece:
+                break
+            pieces.append(bytes(piece))
+        assert_equals(pieces, [b'abc', b'defg', b'h', b'ij'])
+        assert_equals(reader.size, 10)
+        assert_equals(measured.size, 10)
+        assert_equals(measured.hexdigest(), hashlib.md5(b'abcdefghij').hexdigest())
+        reader = ChunkReader([b'abc', b'def'])
+        assert_equals(bytes(reader.read(2)), b'ab')
+        assert_equals(reader.read(), b'cdef')
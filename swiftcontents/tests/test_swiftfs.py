@@ -1,6 +1,17 @@
+import io
 import logging
+from tempfile import TemporaryDirectory
+import hashlib
+import tarfile
+import zipfile
+import threading
+import time
 from nose.tools import assert_equals, assert_not_equals, assert_raises, assert_true, assert_false,assert_set_equal, assert_not_in
 from swiftcontents.swiftfs import SwiftFS, HTTPError, SwiftError
+from swiftclient.exceptions import ClientException
+from swiftcontents.objectmeta import object_meta
+from swiftcontents.ratelimit import BULK
+from swiftcontents.migrate import migrate
 
 # list of dirs to make
 # note, directory names must end with a /
@@ -79,6 +90,34 @@ class Test_SwiftNoFS(object):
         log.info('test do_error')
         assert_raises(HTTPError,self.swiftfs.do_error,"test error")
 
+    def test_shared_service(self):
+        log.info('test SwiftFS instances share one SwiftService')
+        other = SwiftFS(container_template='{user}_other', user=self.swiftfs.container)
+        assert_equals(other.container, self.swiftfs.container + '_other')
+        assert_true(other.swift is self.swiftfs.swift)
+        other.remove_container()
+
+    def test_lazy_connect(self):
+        log.info('test SwiftFS only connects to swift when first used')
+        other = SwiftFS(container_template='{user}_lazy', user=self.swiftfs.container)
+        assert_true(other._swift is None)
+        assert_equals(other.listdir(''),[])
+        assert_false(other._swift is None)
+        other.remove_container()
+
+    def test_warm_up(self):
+        log.info('test warming up prefetches the root listing')
+        self.swiftfs.mkdir(testDirectories[0])
+        other = SwiftFS(warm_up=True)
+        other._warm_up_thread.join()
+        assert_false(other._swift is None)
+        assert_equals([f['name'] for f in other._prefetched[1]],[testDirectories[0]])
+        log.info('test a prefetched listing is not used after a change')
+        other.mkdir('a_test_dir/')
+        names = set(f['name'] for f in other.listdir(''))
+        assert_set_equal(names,set([testDirectories[0],'a_test_dir/']))
+        other.rm('a_test_dir/')
+
     def test_directory(self):
         log.info('test creating a directory')
         p = 'a_test_dir/'
@@ -117,6 +156,401 @@ class Test_SwiftNoFS(object):
         result = self.swiftfs.read(p)
         assert_equals(testString,result)
 
+    def test_read_write_compressed(self):
+        log.info('test reading from and writing to a compressed file')
+        testString = "hello, world - magi was here\n" * 1000
+        p = testFileName
+        self.swiftfs.compression = 'gzip'
+        self.swiftfs.write(p,testString)
+        self.swiftfs.compression = ''
+        result = self.swiftfs.read(p)
+        assert_equals(testString,result)
+
+    def test_object_meta(self):
+        log.info('test writing records the type, size and hash in object metadata')
+        testString = "hello, world - magi was here\n" * 1000
+        p = testFileName
+        self.swiftfs.compression = 'gzip'
+        self.swiftfs.write(p,testString,meta={'format': 'text'})
+        self.swiftfs.compression = ''
+        meta = object_meta(self.swiftfs.stat(p))
+        assert_equals(meta['type'],'file')
+        assert_equals(int(meta['size']),len(testString))
+        assert_equals(meta['hash'],hashlib.md5(testString.encode('utf-8')).hexdigest())
+        assert_equals(meta['format'],'text')
+        assert_equals(meta['encoding'],'gzip')
+        self.swiftfs.mkdir(testDirectories[0])
+        assert_equals(object_meta(self.swiftfs.stat(testDirectories[0]))['type'],'directory')
+
+    def test_upload_archive(self):
+        log.info('test extracting tar and zip archives into a directory')
+        files = {'a.txt': b'first file', 'sub/b.txt': b'second file',
+                 'sub/deeper/c.ipynb': b'{}'}
+        tar = io.BytesIO()
+        with tarfile.open(fileobj=tar, mode='w:gz') as tf:
+            for name, data in sorted(files.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+        zipped = io.BytesIO()
+        with zipfile.ZipFile(zipped, 'w') as zf:
+            zf.writestr('empty/', b'')
+            for name, data in files.items():
+                zf.writestr(name, data)
+            zf.writestr('../escaped.txt', b'nope')
+        self.swiftfs.mkdir(testDirectories[0])
+        for archive, target in [(tar, 'temp/tar'), (zipped, 'temp/zip')]:
+            self.swiftfs.mkdir(target + '/')
+            archive.seek(0)
+            written = self.swiftfs.upload_archive(target, archive)
+            assert_set_equal(set(written), set(target + '/' + n for n in files))
+            for name, data in files.items():
+                assert_equals(self.swiftfs.read(target + '/' + name), data.decode('utf-8'))
+            assert_true(self.swiftfs.isdir(target + '/sub/deeper/'))
+        assert_true(self.swiftfs.isdir('temp/zip/empty/'))
+        assert_false(self.swiftfs.isfile('temp/escaped.txt'))
+        assert_raises(HTTPError,self.swiftfs.upload_archive,'temp/',io.BytesIO(b'not an archive'))
+        assert_raises(HTTPError,self.swiftfs.upload_archive,'nowhere/',tar)
+
+    def test_upload_archive_bulk(self):
+        log.info('test only archives the bulk middleware extracts faithfully are sent to it')
+        def tar_of(names):
+            tar = io.BytesIO()
+            with tarfile.open(fileobj=tar, mode='w') as tf:
+                for name in names:
+                    info = tarfile.TarInfo(name)
+                    info.size = 4
+                    tf.addfile(info, io.BytesIO(b'data'))
+            tar.seek(0)
+            return tar
+        fs = SwiftFS()
+        fs.mkdir(testDirectories[0])
+        extracted = []
+        fs._bulk_upload_supported = lambda: True
+        fs._extract_archive = lambda base, archive, fmt: extracted.append(base) and False
+        fs.upload_archive('temp/', tar_of(['a.txt', 'sub/b.txt']))
+        assert_equals(extracted, ['temp'])
+        for names in [['a.txt', '../escaped.txt'], ['./a.txt'], ['sub//b.txt']]:
+            fs.upload_archive('temp/', tar_of(names))
+        fs.upload_archive('temp/', tar_of(['a.txt']), metadata=True)
+        fs.compression = 'gzip'
+        fs.upload_archive('temp/', tar_of(['a.txt']))
+        assert_equals(extracted, ['temp'])
+        # written by the client instead, with the archive's names made safe
+        # and with metadata
+        assert_true(fs.isfile('temp/sub/b.txt'))
+        assert_false(fs.isfile('escaped.txt'))
+        assert_equals(object_meta(fs.stat('temp/a.txt'))['type'], 'file')
+
+    def test_iter_archive(self):
+        log.info('test downloading a directory as a zip or tar archive')
+        files = {'a.txt': 'first file', 'sub/b.txt': 'second file' * 1000}
+        for d in ['temp/', 'temp/sub/', 'temp/sub/empty/']:
+            self.swiftfs.mkdir(d)
+        for name, content in files.items():
+            self.swiftfs.write('temp/' + name, content)
+        self.swiftfs.archive_prefetch_limit = 100
+        zipped = zipfile.ZipFile(io.BytesIO(b''.join(self.swiftfs.iter_archive('temp'))))
+        for name, content in files.items():
+            assert_equals(zipped.read(name).decode('utf-8'), content)
+        assert_true('sub/empty/' in zipped.namelist())
+        tar = tarfile.open(fileobj=io.BytesIO(b''.join(self.swiftfs.iter_archive('temp/', 'tar'))))
+        for name, content in files.items():
+            assert_equals(tar.extractfile(name).read().decode('utf-8'), content)
+        assert_true(tar.getmember('sub/empty').isdir())
+        assert_raises(HTTPError,self.swiftfs.iter_archive,'temp','rar')
+
+    def test_usage(self):
+        log.info('test usage totals follow writes, copies and deletes')
+        fs = SwiftFS(usage_tracking=True, usage_save_interval=3600)
+        fs._usage_wake.set()
+        for d in testDirectories[:3]:
+            fs.mkdir(d)
+        fs.write('temp/a.txt', 'x' * 100)
+        fs.write('temp/bar/b.txt', 'y' * 50)
+        fs.write('temp/a.txt', 'x' * 10)
+        fs.cp('temp/bar/', 'temp/copied/')
+        fs.mv('temp/a.txt', 'temp/bar/temp/a.txt')
+        fs.rm('temp/copied/', recursive=True)
+        fs.rm('temp/bar/b.txt')
+        totals = fs.usage_totals('temp')
+        assert_true(fs.reconcile_usage())
+        assert_equals(totals, fs.usage_totals('temp'))
+        assert_equals(totals['bytes'], 10)
+        assert_equals(totals['directories'], {'bar': {'bytes': 10, 'objects': 2}})
+        assert_raises(HTTPError,self.swiftfs.usage_totals,'temp')
+        log.info('test blobs count towards the root directory')
+        root = fs.usage_totals()['bytes']
+        fs.write_blobs({'usage-test-blob': b'z' * 7})
+        assert_equals(fs.usage_totals()['bytes'], root + 7)
+        assert_true(fs.reconcile_usage())
+        assert_equals(fs.usage_totals()['bytes'], root + 7)
+        assert_equals(fs.delete_blobs(['usage-test-blob']), ['usage-test-blob'])
+        assert_equals(fs.usage_totals()['bytes'], root)
+
+    def test_listing_refresh(self):
+        log.info('test kept listings pick up changes made elsewhere when refreshed')
+        fs = SwiftFS(listing_refresh_interval=3600)
+        # refreshed by hand, not by its thread
+        fs.refresher.stop()
+        fs.refresher.interval = 0
+        fs.mkdir(testDirectories[0])
+        fs.write('temp/mine.txt', 'one')
+        assert_equals([f['name'] for f in fs.listdir('temp/')], ['temp/mine.txt'])
+        self.swiftfs.write('temp/theirs.txt', 'two')
+        assert_equals(len(fs.listdir('temp')), 1)
+        assert_equals(fs.refresher.refresh(), ['temp/theirs.txt'])
+        assert_equals(len(fs.listdir('temp')), 2)
+        log.info('test changes made here show straight away')
+        fs.rm('temp/mine.txt')
+        assert_equals([f['name'] for f in fs.listdir('temp/')], ['temp/theirs.txt'])
+
+    def test_coalescing(self):
+        log.info('test concurrent reads of one file share a download')
+        self.swiftfs.write(testFileName, testFileContent)
+        download = self.swiftfs._download
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_download(*args):
+            started.set()
+            release.wait(5)
+            return download(*args)
+        self.swiftfs._download = slow_download
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.swiftfs.read(testFileName)))
+                   for i in range(3)]
+        for t in threads:
+            t.start()
+        started.wait(5)
+        while self.swiftfs.coalescing_metrics()['shared'] < 2:
+            threading.Event().wait(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        del self.swiftfs._download
+        assert_equals(results, [testFileContent] * 3)
+        log.info('test a write means a new request')
+        self.swiftfs.write(testFileName, 'changed')
+        assert_equals(self.swiftfs.read(testFileName), 'changed')
+
+    def test_skip_unchanged(self):
+        log.info('test writing what is already stored uploads nothing')
+        path = testFileName
+        etag = self.swiftfs.write(path, testFileContent, meta={'format': 'text'})
+        modified = self.swiftfs.stat(path)['last-modified']
+        assert_equals(self.swiftfs.write(path, testFileContent, meta={'format': 'text'}), etag)
+        assert_equals(self.swiftfs.unchanged_writes, 1)
+        assert_equals(self.swiftfs.stat(path)['last-modified'], modified)
+        log.info('test different metadata or content is uploaded')
+        self.swiftfs.write(path, testFileContent, meta={'format': 'base64'})
+        assert_equals(object_meta(self.swiftfs.stat(path))['format'], 'base64')
+        self.swiftfs.write(path, 'changed', meta={'format': 'base64'})
+        assert_equals(self.swiftfs.read(path), 'changed')
+        assert_equals(self.swiftfs.unchanged_writes, 1)
+        log.info('test compressed files compare their uncompressed content')
+        fs = SwiftFS(compression='gzip', compression_min_size=0)
+        fs.write(path, testFileContent)
+        fs.write(path, testFileContent)
+        assert_equals(fs.unchanged_writes, 1)
+
+    def test_write_stream(self):
+        log.info('test writing from bytes, memoryviews and chunks')
+        data = testFileContent.encode('utf-8') * 10000
+        for content in [data, memoryview(data), (data[i:i + 4096] for i in range(0, len(data), 4096))]:
+            self.swiftfs.write_stream(testFileName, content)
+            assert_equals(self.swiftfs._read_bytes(testFileName), data)
+            assert_equals(int(self.swiftfs.stat(testFileName)['content-length']), len(data))
+        meta = object_meta(self.swiftfs.stat(testFileName))
+        assert_equals(meta['size'], str(len(data)))
+        assert_equals(meta['hash'], hashlib.md5(data).hexdigest())
+        log.info('test a stream with a known digest is not written again')
+        writes = self.swiftfs.unchanged_writes
+        digest = (len(data), hashlib.md5(data).hexdigest())
+        etag = self.swiftfs.write_stream(testFileName, iter([data]), digest=digest)
+        assert_equals(self.swiftfs.unchanged_writes, writes + 1)
+        assert_equals(etag, self.swiftfs.stat(testFileName)['etag'])
+        changed = data + b'!'
+        self.swiftfs.write_stream(testFileName, iter([changed]),
+                                  digest=(len(changed), hashlib.md5(changed).hexdigest()))
+        assert_equals(self.swiftfs.unchanged_writes, writes + 1)
+        assert_equals(self.swiftfs._read_bytes(testFileName), changed)
+        log.info('test a compressed stream records its size and hash')
+        fs = SwiftFS(compression='gzip')
+        etag = fs.write_stream(testFileName, iter([data[:1000], data[1000:]]))
+        headers = fs.stat(testFileName)
+        assert_equals(headers['etag'], etag)
+        assert_true(int(headers['content-length']) < len(data))
+        assert_equals(object_meta(headers)['size'], str(len(data)))
+        assert_equals(fs.read(testFileName), data.decode('utf-8'))
+        assert_true(fs._unchanged(headers, data, 'file'))
+        assert_raises(HTTPError, fs.write_stream, 'temp_does_not_exist/' + testFileName, data)
+
+    def test_cache_evicted(self):
+        log.info('test an unchanged file evicted from the disk cache is fetched again')
+        with TemporaryDirectory() as cache_dir:
+            fs = SwiftFS(cache_dir=cache_dir)
+            fs.write(testFileName, testFileContent)
+            fs.cache.get = lambda container, name, etag: None
+            assert_equals(fs.read(testFileName), testFileContent)
+
+    def test_request_deadlines(self):
+        log.info('test a listing that misses its deadline is handled by isdir')
+        fs = SwiftFS()
+        def deadline(op, fn, hedge=True, before=None):
+            raise SwiftError("%s request deadline exceeded" % op)
+        fs.policy.call = deadline
+        assert_false(fs.isdir(testDirectories[0]))
+        log.info('test a read that misses its deadline is an error, not an empty file')
+        assert_raises(HTTPError, fs.read, testFileName)
+        assert_equals(self.swiftfs.read('no_such_file.txt'), '')
+
+    def test_listing_pages(self):
+        log.info('test a listing fetches each page when it is wanted, on one attempt')
+        fs = SwiftFS()
+        for d in testDirectories[:3]:
+            fs.mkdir(d)
+        fetched = []
+        list_page = fs._list_page
+        def counting(*args):
+            fetched.append(args[2])
+            return list_page(*args)
+        fs._list_page = counting
+        call = fs.policy.call
+        # a hedged listing: both attempts answer, one is thrown away
+        fs.policy.call = lambda op, fn, hedge=True, before=None: (fn(), call(op, fn, hedge, before))[1]
+        pages = fs._list_pages('temp/')
+        page = next(pages)
+        assert_equals([r['name'] for r in page['listing']], testDirectories[:3])
+        assert_equals(fetched, ['', ''])
+        assert_equals(list(pages), [])
+        assert_equals(fetched, ['', '', 'temp/bar/temp/', 'temp/bar/temp/'])
+
+    def test_rate_limits(self):
+        log.info('test requests are counted against their kind of limit')
+        fs = SwiftFS(request_rates={'delete': 1000, 'write': 1000})
+        for d in testDirectories[:3]:
+            fs.mkdir(d)
+        fs.write('temp/' + testFileName, testFileContent)
+        fs.rm('temp/', recursive=True)
+        metrics = fs.rate_limit_metrics()
+        assert_equals(set(metrics), set(['delete', 'write']))
+        assert_equals(metrics['write']['requests'], 4)
+        assert_equals(metrics['delete']['requests'], 4)
+        assert_equals(metrics['delete']['queued'], 0)
+        log.info('test each attempt at a request takes a token, at the priority of its caller')
+        fs = SwiftFS(request_rates={'stat': 1000})
+        fs.write(testFileName, testFileContent)
+        before = fs.rate_limit_metrics()['stat']['requests']
+        taken = []
+        acquire = fs.limiter.acquire
+        def recording(op, n=1):
+            taken.append((op, n, fs.limiter.current_priority(), threading.current_thread()))
+            return acquire(op, n)
+        fs.limiter.acquire = recording
+        stat = fs.swift.stat
+        refusals = [ClientException('busy', http_status=503)]
+        def busy(*args, **kwargs):
+            if refusals:
+                raise refusals.pop()
+            return stat(*args, **kwargs)
+        fs.swift.stat = busy
+        # a retried request: two attempts, both paid for on this thread
+        with fs.limiter.priority(BULK):
+            assert_true(fs.stat(testFileName) is not None)
+        fs.swift.stat = stat
+        caller = threading.current_thread()
+        assert_equals(taken, [('stat', 1, BULK, caller), ('stat', 1, BULK, caller)])
+        assert_equals(fs.rate_limit_metrics()['stat']['requests'], before + 2)
+
+    def test_interactive_overtakes_bulk(self):
+        log.info('test an interactive request goes ahead of bulk ones waiting for tokens')
+        fs = SwiftFS(request_rates={'stat': 20}, request_burst=0.05)
+        fs.write(testFileName, testFileContent)
+        done = []
+        def bulk():
+            with fs.limiter.priority(BULK):
+                fs.stat_many([testFileName])
+            done.append('bulk')
+        threads = [threading.Thread(target=bulk) for _ in range(16)]
+        for t in threads:
+            t.start()
+        while fs.rate_limit_metrics()['stat']['queued'] < 12:
+            time.sleep(0.01)
+        fs.stat_many([testFileName])
+        done.append('interactive')
+        for t in threads:
+            t.join()
+        assert_true(done.index('interactive') < 8, done)
+
+    def test_shards(self):
+        log.info('test a sharded layout behaves as one container')
+        fs = SwiftFS(shards=4)
+        try:
+            for d in testDirectories:
+                fs.mkdir(d)
+                fs.write(d + testFileName, d)
+            assert_true(len(set(fs.container_for(d + testFileName) for d in testDirectories)) > 1)
+            listed = []
+            list_pages = fs._list_pages
+            fs._list_pages = lambda prefix, container=None: \
+                listed.append(container) or list_pages(prefix, container)
+            for d in testDirectories:
+                assert_set_equal(set(f['name'] for f in fs.listdir(d)),
+                                 testTree.get(d, set([d + testFileName])))
+            assert_equals(len(listed), len(testDirectories))
+            del fs._list_pages
+            log.info('test moves across shards, and recursive deletes')
+            fs.mv('temp/bar/', 'temp/moved/')
+            assert_true(fs.isdir('temp/moved/temp/bar/foo/bar/'))
+            assert_false(fs.isdir('temp/bar/'))
+            assert_equals(fs.read('temp/moved/temp/' + testFileName), 'temp/bar/temp/')
+            fs.mkdir('temp/empty/')
+            assert_true(fs.isdir('temp/empty/'))
+            fs.rm('temp/', recursive=True)
+            assert_equals(list(fs.iterlist('')), [])
+        finally:
+            fs.remove_container()
+
+    def test_migrate(self):
+        log.info('test moving a container into shards, and back')
+        for d in testDirectories[:3]:
+            self.swiftfs.mkdir(d)
+            self.swiftfs.write(d + testFileName, d)
+        names = [f['name'] for f in self.swiftfs.iterlist('')]
+        moved, failed = migrate(self.swiftfs.container, 3, delete=True)
+        assert_equals(failed, [])
+        sharded = SwiftFS(shards=3)
+        assert_equals([f['name'] for f in sharded.iterlist('')], names)
+        assert_equals(sharded.read('temp/bar/' + testFileName), 'temp/bar/')
+        assert_true(moved > 0)
+        assert_equals(len(list(self.swiftfs.iterlist(''))), len(names) - moved)
+        migrate(self.swiftfs.container, 0, from_shards=3, delete=True)
+        assert_equals([f['name'] for f in self.swiftfs.iterlist('')], names)
+        sharded.remove_container()
+
+    def test_open_stream(self):
+        log.info('test streaming a file, whole and by byte range')
+        testString = "hello, world - magi was here\n" * 1000
+        p = testFileName
+        self.swiftfs.write(p,testString)
+        data = testString.encode('utf-8')
+        headers, chunks = self.swiftfs.open_stream(p)
+        assert_equals(b''.join(chunks),data)
+        assert_equals(int(headers['content-length']),len(data))
+        for start, end, expected in [(10, 19, data[10:20]), (100, None, data[100:]),
+                                     (None, 50, data[-50:])]:
+            headers, chunks = self.swiftfs.open_stream(p, start, end)
+            assert_equals(b''.join(chunks),expected)
+            assert_equals(int(headers['content-length']),len(expected))
+        assert_raises(HTTPError,self.swiftfs.open_stream,p,len(data),None)
+        log.info('test compressed files are decompressed as they stream')
+        self.swiftfs.compression = 'gzip'
+        self.swiftfs.write(p,testString)
+        self.swiftfs.compression = ''
+        headers, chunks = self.swiftfs.open_stream(p, 10, 19)
+        assert_equals(b''.join(chunks),data)
+
     def test_write_wrong_path(self):
         log.info('test writing to a non existant path')
         testString = "hello, world - magi was here"
@@ -213,6 +647,34 @@ class Test_SwiftFS(object):
                 results.add(r['name'])
             assert_set_equal(results,testTree['temp/'])
 
+    def test_walk_path(self):
+        log.info('test walking a directory tree visits parents before children')
+        source = 'temp/bar/'
+        expected = set()
+        for d in testDirectories:
+            if d.startswith(source):
+                expected.add(d)
+                expected.add(d+testFileName)
+        walked = list(self.swiftfs._walk_path(source))
+        assert_set_equal(set(walked),expected)
+        assert_equals(walked[0],source)
+        for i, name in enumerate(walked):
+            for child in walked[:i]:
+                assert_false(child.startswith(name) and child != name)
+        log.info('test dir_first visits children before parents')
+        assert_equals(list(self.swiftfs._walk_path(source, dir_first=True)),
+                      list(reversed(walked)))
+
+    def test_stat_many(self):
+        log.info('test stat_many returns results in order, None for missing objects')
+        paths = [d+testFileName for d in testDirectories]
+        paths.insert(1, 'temp/does_not_exist.txt')
+        results = self.swiftfs.stat_many(paths)
+        assert_equals(len(results),len(paths))
+        assert_equals(results[1],None)
+        for p, r in zip(paths[2:],results[2:]):
+            assert_equals(int(r['content-length']),len(testFileContent))
+
     def test_copy_file(self):
         log.info('test copying a file')
         fName = testDirectories[0]+testFileName
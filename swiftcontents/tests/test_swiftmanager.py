@@ -1,14 +1,24 @@
 import logging
 from nose.tools import assert_equals, assert_not_equals, assert_raises, assert_true, assert_false
+import io
 import os
 import json
+import hashlib
+import zipfile
+import time
+import asyncio
+import threading
 import shutil
 from pprint import pprint
 
 from swiftcontents.ipycompat import TestContentsManager
 
-from swiftcontents import SwiftContentsManager
+from swiftcontents import SwiftContentsManager, AsyncSwiftContentsManager
+from swiftcontents.ipycompat import Config
+from jupyter_server.services.contents.manager import AsyncContentsManager
 from swiftcontents.swiftfs import SwiftError
+from swiftcontents.objectmeta import object_meta
+from swiftcontents.ratelimit import BULK
 from tempfile import TemporaryDirectory
 from tornado.web import HTTPError
 
@@ -177,6 +187,29 @@ class Test_SwiftManager(object):
         data = sm.get(path, content=True)
         assert_true( data['content'] == testNotebookContent)
 
+    def test_get_stat_fails(self):
+        sm = SwiftContentsManager()
+        log.info("test_get_stat_fails starting")
+        path = testDirectories[0] + testFileName
+        def deadline(op, fn, hedge=True, before=None):
+            raise SwiftError("%s request deadline exceeded" % op)
+        sm.swiftfs.policy.call = deadline
+        with assert_raises(HTTPError) as e:
+            sm.get(path)
+        assert_equals( e.exception.status_code, 500 )
+
+    def test_valid_metadata(self):
+        sm = self.swiftmanager
+        log.info("test_valid_metadata starting")
+        path = testDirectories[0] + testNotebookName
+        notebook = dict(testNotebookContent, cells=[{'cell_type': 'code', 'metadata': {}, 'source': ''}])
+        # marked valid by something other than this server: still checked
+        sm.swiftfs.write(path, json.dumps(notebook), meta={'valid': '1'})
+        assert_true( 'message' in sm.get(path) )
+        sm.save({'content': testNotebookContent, 'type': 'notebook'}, path)
+        etag = sm.swiftfs.stat(path)['etag']
+        assert_true( sm.notebook_cache.known_valid(path, etag) )
+
     # tests that save raises errors for no type given & invalid type given
     def test_save_errors(self):
         sm = self.swiftmanager
@@ -226,6 +259,258 @@ class Test_SwiftManager(object):
         data = sm.get(path)
         assert_true( data['content'] == testNotebookContent )
 
+    # tests a cached notebook is handed out as a copy
+    def test_notebook_cache(self):
+        sm = self.swiftmanager
+        log.info("test_notebook_cache starting")
+        path = testDirectories[1] + testNotebookName
+        model={'content': testNotebookContent, 'type': 'notebook'}
+        sm.save(model, path)
+        data = sm.get(path)
+        data['content']['metadata']['changed'] = True
+        data = sm.get(path)
+        assert_true( data['content'] == testNotebookContent )
+
+    def test_reads_notebook(self):
+        sm = self.swiftmanager
+        log.info("test_reads_notebook starting")
+        notebook = dict(testNotebookContent, cells=[
+            {'cell_type': 'markdown', 'metadata': {},
+             'source': ['the key is\n', '"swiftcontents"']}])
+        nb = sm._reads_notebook(json.dumps(notebook))
+        assert_equals( nb.cells[0].source, 'the key is\n"swiftcontents"' )
+
+    def test_saved_metadata(self):
+        sm = self.swiftmanager
+        log.info("test_saved_metadata starting")
+        path = testDirectories[1] + testNotebookName
+        model={'content': testNotebookContent, 'type': 'notebook'}
+        sm.save(model, path)
+        meta = object_meta(sm.swiftfs.stat(path))
+        assert_equals( meta['type'], 'notebook' )
+        assert_equals( meta['nbformat'], '4.2' )
+        assert_equals( meta['valid'], '1' )
+        path = testDirectories[1] + 'data.csv'
+        model={'content': 'YSxi', 'type': 'file', 'format': 'base64'}
+        sm.save(model, path)
+        data = sm.get(path)
+        assert_equals( data['type'], 'file' )
+        assert_equals( data['format'], 'base64' )
+        assert_equals( data['content'], 'YSxi' )
+
+    def test_save_streamed(self):
+        sm = SwiftContentsManager(stream_save_threshold=1000)
+        log.info("test_save_streamed starting")
+        path = testDirectories[1] + testNotebookName
+        notebook = dict(testNotebookContent, cells=[
+            {'cell_type': 'code', 'source': 'print(%d)' % i, 'metadata': {},
+             'outputs': [], 'execution_count': None} for i in range(100)])
+        model = sm.save({'content': notebook, 'type': 'notebook'}, path)
+        assert_equals( model['path'], path )
+        headers = sm.swiftfs.stat(path)
+        assert_equals( object_meta(headers)['nbformat'], '4.2' )
+        assert_equals( int(headers['content-length']), len(json.dumps(notebook)) )
+        assert_equals( object_meta(headers)['size'], headers['content-length'] )
+        # saving it again uploads nothing
+        writes = sm.swiftfs.unchanged_writes
+        sm.save({'content': notebook, 'type': 'notebook'}, path)
+        assert_equals( sm.swiftfs.unchanged_writes, writes + 1 )
+        sm.notebook_cache.invalidate(path)
+        content = sm.get(path)['content']
+        assert_equals( [c['source'] for c in content['cells']],
+                       [c['source'] for c in notebook['cells']] )
+
+    def test_streamed_outputs(self):
+        sm = SwiftContentsManager(externalize_outputs=True, output_blob_threshold=1024)
+        log.info("test_streamed_outputs starting")
+        image = 'iVBORw0KGgo' * 1024
+        notebook = dict(testNotebookContent, cells=[
+            {'cell_type': 'code', 'source': 'plot()', 'metadata': {}, 'execution_count': 1,
+             'outputs': [{'output_type': 'display_data', 'metadata': {},
+                          'data': {'image/png': image}}]}])
+        path = testDirectories[1] + testNotebookName
+        sm.save({'content': notebook, 'type': 'notebook'}, path)
+        assert_equals( object_meta(sm.swiftfs.stat(path))['blobs'], '1' )
+        assert_true( image not in sm.swiftfs.read(path) )
+        for start, end in [(None, None), (0, 9)]:
+            headers, chunks = sm.open_stream(path, start, end)
+            data = b''.join(chunks)
+            assert_equals( int(headers['content-length']), len(data) )
+            assert_true( 'content-range' not in headers )
+            assert_equals( json.loads(data.decode('utf-8'))['cells'][0]['outputs'][0]['data'],
+                           {'image/png': image} )
+        zipped = zipfile.ZipFile(io.BytesIO(b''.join(sm.iter_archive(testDirectories[1]))))
+        member = json.loads(zipped.read(testNotebookName).decode('utf-8'))
+        assert_equals( member['cells'][0]['outputs'][0]['data'], {'image/png': image} )
+        # anything else is sent as it is stored
+        headers, chunks = sm.open_stream(testDirectories[1] + testFileName, 0, 4)
+        assert_equals( b''.join(chunks), testFileContent[:5].encode('utf-8') )
+
+    def test_sweep_blobs(self):
+        sm = SwiftContentsManager(externalize_outputs=True, output_blob_threshold=1024,
+                                  blob_sweep_age=0)
+        log.info("test_sweep_blobs starting")
+        def notebook(image):
+            return dict(testNotebookContent, cells=[
+                {'cell_type': 'code', 'source': 'plot()', 'metadata': {}, 'execution_count': 1,
+                 'outputs': [{'output_type': 'display_data', 'metadata': {},
+                              'data': {'image/png': image}}]}])
+        def key(image):
+            return hashlib.sha256(json.dumps(image).encode('utf-8')).hexdigest()
+        kept, dropped, late = 'iVBORw0KGgo' * 1024, 'R0lGODlh' * 1024, 'AAAA' * 1024
+        path = testDirectories[1] + testNotebookName
+        other = testDirectories[6] + testNotebookName
+        sm.save({'content': notebook(kept), 'type': 'notebook'}, path)
+        sm.save({'content': notebook(dropped), 'type': 'notebook'}, other)
+        sm.save({'content': testNotebookContent, 'type': 'notebook'}, other)
+        # a blob put while the sweep runs may be for a save not yet written
+        referenced = sm._referenced_blobs
+        def saving():
+            keys = referenced()
+            sm.blobstore.put({key(late): json.dumps(late).encode('utf-8')})
+            return keys
+        sm._referenced_blobs = saving
+        assert_true( sm.sweep_blobs() >= 1 )
+        stored = sm.swiftfs.list_blobs()
+        assert_true( key(kept) in stored )
+        assert_true( key(late) in stored )
+        assert_true( key(dropped) not in stored )
+        sm.notebook_cache.invalidate(path)
+        assert_equals( sm.get(path)['content']['cells'][0]['outputs'][0]['data'],
+                       {'image/png': kept} )
+        # saved again, a swept blob is uploaded again
+        sm.save({'content': notebook(dropped), 'type': 'notebook'}, other)
+        assert_true( key(dropped) in sm.swiftfs.list_blobs() )
+
+    def test_search(self):
+        sm = SwiftContentsManager(search_index_path=':memory:', search_refresh_interval=0)
+        log.info("test_search starting")
+        assert_raises(HTTPError, lambda: self.swiftmanager.search('anything'))
+        notebook = dict(testNotebookContent, cells=[
+            {'cell_type': 'code', 'source': ['import numpy\n', 'numpy.zeros(3)'],
+             'metadata': {}, 'outputs': [], 'execution_count': None}])
+        path = testDirectories[1] + testNotebookName
+        sm.save({'content': notebook, 'type': 'notebook'}, path)
+        # written behind the manager's back: found from the listing
+        sm.swiftfs.write(testDirectories[6] + 'other.ipynb', json.dumps(notebook))
+        sm.refresh_search_index()
+        found = sm.search('numpy zeros')
+        assert_equals( sorted(f['path'] for f in found),
+                       [path, testDirectories[6] + 'other.ipynb'] )
+        assert_true( '[numpy]' in found[0]['snippet'] )
+        assert_equals( [f['path'] for f in sm.search('numpy', path=testDirectories[6])],
+                       [testDirectories[6] + 'other.ipynb'] )
+        assert_equals( len(sm.search('hello.t', limit=100)), len(testDirectories) )
+        assert_equals( sm.search('pandas'), [] )
+        sm.rename_file(path, testDirectories[1] + 'moved.ipynb')
+        sm.delete_file(testDirectories[6] + 'other.ipynb')
+        assert_equals( [f['path'] for f in sm.search('numpy')],
+                       [testDirectories[1] + 'moved.ipynb'] )
+
+    def test_reindex(self):
+        sm = SwiftContentsManager(search_index_path=':memory:', search_refresh_interval=0)
+        log.info("test_reindex starting")
+        notebook = dict(testNotebookContent, cells=[
+            {'cell_type': 'markdown', 'source': 'numpy', 'metadata': {}}])
+        path = testDirectories[6] + 'other.ipynb'
+        sm.swiftfs.write(path, json.dumps(notebook))
+        # reported by the listing refresher: reindexed in the background
+        sm._changed_elsewhere([path])
+        for i in range(100):
+            if sm.search('numpy'):
+                break
+            time.sleep(0.01)
+        assert_equals( [f['path'] for f in sm.search('numpy')], [path] )
+        # a failed read leaves the old entry, to be tried again
+        notebook['cells'][0]['source'] = 'pandas'
+        sm.swiftfs.write(path, json.dumps(notebook))
+        etags = sm.search_index.etags()
+        read = sm.swiftfs.read
+        def failing(*args, **kwargs):
+            raise HTTPError(500)
+        sm.swiftfs.read = failing
+        sm.reindex([path])
+        assert_equals( sm.search_index.etags(), etags )
+        # all of it at bulk priority, with no listings to guess types
+        priorities = []
+        def reading(*args, **kwargs):
+            priorities.append(sm.swiftfs.limiter.current_priority())
+            return read(*args, **kwargs)
+        sm.swiftfs.read = reading
+        sm.swiftfs.isdir = failing
+        sm.reindex([path, testDirectories[6] + testFileName])
+        del sm.swiftfs.isdir
+        sm.swiftfs.read = read
+        assert_equals( priorities, [BULK] )
+        assert_equals( [f['path'] for f in sm.search('pandas')], [path] )
+        sm.swiftfs.rm(path)
+        sm.reindex([path])
+        assert_equals( sm.search('pandas'), [] )
+
+    def test_executor(self):
+        sm = AsyncSwiftContentsManager(config=Config({'SwiftContentsManager': {'executor_threads': 4}}))
+        log.info("test_executor starting")
+        assert_true( isinstance(sm, AsyncContentsManager) )
+        assert_equals( sm.executor._max_workers, 4 )
+        path = testDirectories[1] + testNotebookName
+        renamed = testDirectories[1] + 'renamed.ipynb'
+        model = {'content': testNotebookContent, 'type': 'notebook'}
+
+        async def run():
+            await asyncio.gather(*[sm.save(model, path) for i in range(4)])
+            assert_true( await sm.file_exists(path) )
+            assert_true( await sm.dir_exists(testDirectories[1]) )
+            assert_false( await sm.is_hidden(path) )
+            updated = await sm.update({'path': renamed}, path)
+            assert_equals( updated['path'], renamed )
+            assert_false( await sm.exists(path) )
+            await sm.save(model, path)
+            try:
+                await sm.update({'path': renamed}, path)
+            except HTTPError as e:
+                assert_equals( e.status_code, 409 )
+            else:
+                raise AssertionError("renaming onto an existing notebook should fail")
+            untitled = await sm.new_untitled(testDirectories[1], ext='.ipynb')
+            copied = await sm.copy(untitled['path'])
+            assert_equals( copied['name'], 'Untitled-Copy1.ipynb' )
+            await sm.trust_notebook(copied['path'])
+            await sm.delete(copied['path'])
+            assert_false( await sm.file_exists(copied['path']) )
+            return await sm.get(renamed)
+
+        got = asyncio.run(run())
+        assert_equals( got['type'], 'notebook' )
+        log.info("test_executor: the synchronous manager gives models, even on the event loop")
+
+        async def sync_on_loop():
+            return self.swiftmanager.get(renamed, content=False)
+        assert_equals( asyncio.run(sync_on_loop())['name'], 'renamed.ipynb' )
+
+    def test_path_locks(self):
+        log.info("test_path_locks: one path at a time, different paths together")
+        sm = self.swiftmanager
+        running, overlaps = [], []
+        lock = threading.Lock()
+
+        def change(path):
+            with sm.path_locks.hold(path):
+                with lock:
+                    running.append(path)
+                    overlaps.append(list(running))
+                threading.Event().wait(0.05)
+                with lock:
+                    running.remove(path)
+
+        threads = [threading.Thread(target=change, args=(p,)) for p in ['a', 'a', '/a', 'b']]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_true( all(o.count('a') + o.count('/a') <= 1 for o in overlaps) )
+        assert_true( any('b' in o and len(o) == 2 for o in overlaps) )
+        assert_equals( sm.path_locks._locks, {} )
+
     def test_rename_file(self):
         sm = self.swiftmanager
         log.info("test_rename_file starting")
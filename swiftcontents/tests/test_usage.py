@@ -0,0 +1,47 @@
+import logging
+from nose.tools import assert_equals
+from swiftcontents.usage import Usage
+
+log = logging.getLogger('TestUsage')
+
+testRecords = [{'name': 'a/', 'bytes': 0},
+               {'name': 'a/one.txt', 'bytes': 10},
+               {'name': 'a/b/', 'bytes': 0},
+               {'name': 'a/b/two.txt', 'bytes': 20},
+               {'name': 'three.txt', 'bytes': 30}]
+
+
+class Test_Usage(object):
+
+    def test_totals(self):
+        log.info('test totals count everything below a directory')
+        usage = Usage()
+        usage.rebuild(testRecords)
+        assert_equals(usage.totals(''), {'bytes': 60, 'objects': 5})
+        assert_equals(usage.totals('a'), {'bytes': 30, 'objects': 3})
+        assert_equals(usage.totals('/a/b/'), {'bytes': 20, 'objects': 1})
+        assert_equals(usage.totals('nowhere'), {'bytes': 0, 'objects': 0})
+        assert_equals(usage.subdirectories(''), {'a': {'bytes': 30, 'objects': 3}})
+        assert_equals(usage.subdirectories('a'), {'b': {'bytes': 20, 'objects': 1}})
+
+    def test_deltas(self):
+        log.info('test adding and removing objects matches a rebuild')
+        usage = Usage()
+        for r in testRecords:
+            usage.add(r['name'], r['bytes'])
+        usage.remove('a/b/two.txt', 20)
+        usage.add('a/one.txt', 5, 0)
+        expected = Usage()
+        expected.rebuild([dict(r, bytes=15) if r['name'] == 'a/one.txt' else r
+                          for r in testRecords if r['name'] != 'a/b/two.txt'])
+        assert_equals(usage.to_json(), expected.to_json())
+
+    def test_merge(self):
+        log.info('test saved totals add to changes made before they were loaded')
+        saved = Usage()
+        saved.rebuild(testRecords)
+        usage = Usage()
+        usage.remove('three.txt', 30)
+        usage.merge(saved.to_json())
+        assert_equals(usage.totals(''), {'bytes': 30, 'objects': 4})
+        assert_equals(usage.totals('a'), {'bytes': 30, 'objects': 3})
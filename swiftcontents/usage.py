@@ -0,0 +1,97 @@
+"""
+Running totals of the bytes and objects stored under each directory
+
+SwiftFS keeps these up to date from the sizes it knows as it writes, copies
+and deletes, so usage (for quotas, or to show) never needs a listing of the
+whole container.  The totals are saved, as a small JSON object, now and then;
+a periodic scan of the container replaces them, so they can't drift far from
+the truth when something else writes to it.
+
+A directory's totals count every object below it, at any depth, including
+directory markers but not its own.  The root directory is ''.
+"""
+import json
+import threading
+
+__all__ = ['Usage', 'USAGE_OBJECT']
+
+# the name of the saved totals, in SwiftFS's blob container
+USAGE_OBJECT = 'swiftcontents-usage.json'
+
+
+class Usage(object):
+
+    def __init__(self, delimiter='/'):
+        self.delimiter = delimiter
+        self._totals = {}   # directory -> [bytes, objects]
+        self._lock = threading.Lock()
+        # changed since last saved
+        self.dirty = False
+
+    def _directories(self, name):
+        """the directories name is in: '', then 'a/', 'a/b/', ..."""
+        parts = name.rstrip(self.delimiter).split(self.delimiter)[:-1]
+        yield ''
+        for i in range(1, len(parts) + 1):
+            yield self.delimiter.join(parts[:i]) + self.delimiter
+
+    def add(self, name, size, count=1):
+        """count an object (a negative size and count take one away)"""
+        with self._lock:
+            for d in self._directories(name):
+                totals = self._totals.setdefault(d, [0, 0])
+                totals[0] += size
+                totals[1] += count
+                if totals == [0, 0] and d:
+                    del self._totals[d]
+            self.dirty = True
+
+    def remove(self, name, size):
+        self.add(name, -size, -1)
+
+    def totals(self, path=''):
+        """{'bytes', 'objects'} under the directory path"""
+        path = self._directory(path)
+        with self._lock:
+            size, count = self._totals.get(path, (0, 0))
+        return {'bytes': size, 'objects': count}
+
+    def subdirectories(self, path=''):
+        """{name: {'bytes', 'objects'}} for each directory in the directory path"""
+        path = self._directory(path)
+        depth = path.count(self.delimiter) + 1
+        with self._lock:
+            return dict((d[len(path):].rstrip(self.delimiter), {'bytes': t[0], 'objects': t[1]})
+                        for d, t in self._totals.items()
+                        if d.startswith(path) and d.count(self.delimiter) == depth)
+
+    def _directory(self, path):
+        path = path.strip(self.delimiter)
+        return path + self.delimiter if path else ''
+
+    def rebuild(self, records):
+        """replace the totals with those of a listing (of the whole container)"""
+        totals = {}
+        for record in records:
+            for d in self._directories(record['name']):
+                t = totals.setdefault(d, [0, 0])
+                t[0] += record.get('bytes', 0)
+                t[1] += 1
+        with self._lock:
+            self._totals = totals
+            self.dirty = True
+
+    def merge(self, data):
+        """add saved totals (from to_json) to these"""
+        saved = json.loads(data)
+        with self._lock:
+            for d, (size, count) in saved.get('totals', {}).items():
+                t = self._totals.setdefault(d, [0, 0])
+                t[0] += size
+                t[1] += count
+            self.dirty = True
+
+    def to_json(self):
+        with self._lock:
+            self.dirty = False
+            return json.dumps({'totals': self._totals}, separators=(',', ':'))